@@ -0,0 +1,61 @@
+import filecmp
+import os
+import subprocess
+
+from varifier import benchmark, recall, utils, vcf_record
+
+
+def test_make_synthetic_genomes():
+    tmp_out = "tmp.benchmark.make_synthetic_genomes"
+    subprocess.check_output(f"rm -rf {tmp_out} {tmp_out}.2", shell=True)
+    counts = benchmark.make_synthetic_genomes(
+        tmp_out, 50000, snp_rate=0.002, sv_rate=0.0001, repeat_fraction=0.1
+    )
+    ref_seq = utils.file_to_dict_of_seqs(os.path.join(tmp_out, "ref.fa"))["ref"].seq
+    truth_seq = utils.file_to_dict_of_seqs(os.path.join(tmp_out, "truth.fa"))
+    truth_seq = truth_seq["truth"].seq
+    assert len(ref_seq) == 50000
+    _, truth_records = vcf_record.vcf_file_to_list(
+        os.path.join(tmp_out, "truth_variants.vcf")
+    )
+    assert counts["truth_variants"] == len(truth_records)
+    assert 100 < len(truth_records) <= 115
+    mutated = recall.apply_variants_to_seqs({"ref": ref_seq}, truth_records)
+    assert mutated["ref.mutated"] == truth_seq
+    _, calls = vcf_record.vcf_file_to_list(os.path.join(tmp_out, "calls.vcf"))
+    assert counts["calls"] == len(calls)
+    assert counts["true_calls"] < len(truth_records)
+
+    # Same seed should give the same files
+    benchmark.make_synthetic_genomes(
+        f"{tmp_out}.2", 50000, snp_rate=0.002, sv_rate=0.0001, repeat_fraction=0.1
+    )
+    for filename in os.listdir(tmp_out):
+        assert filecmp.cmp(
+            os.path.join(tmp_out, filename),
+            os.path.join(f"{tmp_out}.2", filename),
+            shallow=False,
+        )
+    subprocess.check_output(f"rm -r {tmp_out} {tmp_out}.2", shell=True)
+
+
+def test_scaling_exponent():
+    assert benchmark.scaling_exponent([10, 100, 1000], [2, 20, 200]) == 1
+    assert benchmark.scaling_exponent([10, 100], [1, 100]) == 2
+    assert benchmark.scaling_exponent([10], [1]) is None
+    assert benchmark.scaling_exponent([10, 100], [0, 1]) is None
+
+
+def test_run_benchmark():
+    tmp_out = "tmp.benchmark.run_benchmark"
+    subprocess.check_output(f"rm -rf {tmp_out}", shell=True)
+    got = benchmark.run_benchmark(tmp_out, [20000, 40000], snp_rate=0.002)
+    assert os.path.exists(os.path.join(tmp_out, "benchmark.json"))
+    assert [x["genome_size"] for x in got["runs"]] == [20000, 40000]
+    for run in got["runs"]:
+        assert set(run["steps"]) == {"make_truth_vcf", "vcf_eval"}
+        assert run["steps"]["vcf_eval"]["peak_memory_mb"] > 0
+        assert "recall/recall.vcf" in run["steps"]["vcf_eval"]["stages"]
+        assert run["summary_stats"]["Recall"]["TP"]["Count"] > 0
+    assert set(got["scaling"]) == {"make_truth_vcf", "vcf_eval"}
+    subprocess.check_output(f"rm -r {tmp_out}", shell=True)
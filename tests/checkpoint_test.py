@@ -0,0 +1,79 @@
+import os
+import pytest
+import subprocess
+
+from varifier import checkpoint
+
+
+def test_run_stage():
+    tmp_dir = "tmp.checkpoint.run_stage"
+    subprocess.check_output(f"rm -rf {tmp_dir}", shell=True)
+    os.mkdir(tmp_dir)
+    infile = os.path.join(tmp_dir, "in.txt")
+    outfile = os.path.join(tmp_dir, "out.txt")
+    with open(infile, "w") as f:
+        print("foo", file=f)
+
+    calls = []
+
+    def copy_file(infile, outfile, suffix=""):
+        calls.append(suffix)
+        with open(infile) as f_in, open(outfile, "w") as f_out:
+            print(f_in.read().rstrip() + suffix, file=f_out)
+        return len(calls)
+
+    def run(resume, params=None):
+        suffix = "" if params is None else params["suffix"]
+        return checkpoint.run_stage(
+            [outfile],
+            [infile],
+            params,
+            resume,
+            copy_file,
+            infile,
+            outfile,
+            suffix=suffix,
+        )
+
+    assert run(False) == 1
+    assert os.path.exists(checkpoint.checkpoint_file(outfile))
+    # Not resuming means the stage always gets run
+    assert run(False) == 2
+    # Resuming with same inputs and params skips the stage, and returns the
+    # result from the previous run
+    assert run(True) == 2
+    assert len(calls) == 2
+
+    # Changing the params means the stage is rerun
+    assert run(True, params={"suffix": "bar"}) == 3
+    assert run(True, params={"suffix": "bar"}) == 3
+
+    # Changing the input file means the stage is rerun
+    with open(infile, "w") as f:
+        print("baz", file=f)
+    assert run(True, params={"suffix": "bar"}) == 4
+    with open(outfile) as f:
+        assert f.read() == "bazbar\n"
+
+    # Changing the output file, eg because it was truncated when the
+    # job was killed, means the stage is rerun
+    with open(outfile, "w") as f:
+        print("baz", file=f)
+    assert run(True, params={"suffix": "bar"}) == 5
+
+    # No outfile means rerun
+    os.unlink(outfile)
+    assert run(True, params={"suffix": "bar"}) == 6
+    assert checkpoint.stage_is_done([outfile], [infile], params={"suffix": "bar"})
+    assert not checkpoint.stage_is_done([outfile], [infile], params={"suffix": "x"})
+
+    # Only stages that are run have their times recorded
+    with checkpoint.record_stage_times() as stage_times:
+        run(True, params={"suffix": "bar"})
+        assert stage_times == []
+        run(False)
+    assert [x[0] for x in stage_times] == [outfile]
+    assert stage_times[0][1] >= 0
+    run(False)
+    assert len(stage_times) == 1
+    subprocess.check_output(f"rm -r {tmp_dir}", shell=True)
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+
+# This script makes a VCF and corresponding reference FASTA, and a truth
+# FASTA, for testing adaptive probe flank lengths. The truth genome has a
+# 150bp repeat, with two identical copies. The reference is the same as the
+# truth, except for a SNP in the middle of the second copy of the repeat.
+# The VCF has the SNP (which is a TP), and a SNP in unique sequence (also
+# a TP). Probes with short flanks for the first SNP are entirely in the
+# repeat, so do not map uniquely to the truth.
+
+import pyfastaq
+import random
+
+random.seed(42)
+
+
+def random_seq(length):
+    return "".join([random.choice(["A", "C", "G", "T"]) for _ in range(length)])
+
+
+repeat = random_seq(150)
+truth_seq = random_seq(300) + repeat + random_seq(300) + repeat + random_seq(300)
+snp_pos = 300 + 150 + 300 + 75
+unique_snp_pos = 150
+ref_seq = list(truth_seq)
+for pos in snp_pos, unique_snp_pos:
+    ref_seq[pos] = "A" if truth_seq[pos] != "A" else "C"
+ref_seq = "".join(ref_seq)
+
+with open("adaptive_flank_length.ref.fa", "w") as f:
+    print(pyfastaq.sequences.Fasta("ref", ref_seq), file=f)
+
+with open("adaptive_flank_length.truth.fa", "w") as f:
+    print(pyfastaq.sequences.Fasta("truth", truth_seq), file=f)
+
+with open("adaptive_flank_length.in.vcf", "w") as f:
+    print("##fileformat=VCFv4.2", file=f)
+    print(
+        "#CHROM", "POS", "ID", "REF", "ALT", "QUAL", "FILTER", "INFO", "FORMAT",
+        "sample", sep="\t", file=f,
+    )
+    for pos in unique_snp_pos, snp_pos:
+        print(
+            "ref", pos + 1, ".", ref_seq[pos], truth_seq[pos], ".", "PASS", ".",
+            "GT", "1/1", sep="\t", file=f,
+        )
@@ -0,0 +1,61 @@
+import pytest
+import subprocess
+import sys
+
+import varifier
+
+heavy_modules = [
+    "Bio",
+    "cluster_vcf_records",
+    "mappy",
+    "pandas",
+    "pyfastaq",
+    "pymummer",
+    "pysam",
+]
+
+
+def _modules_loaded_by(code):
+    """Runs code in a new python process. Returns the modules in
+    heavy_modules that were imported"""
+    code += f"\nimport sys\nprint('LOADED', *[x for x in {heavy_modules} if x in sys.modules])"
+    output = subprocess.check_output(
+        [sys.executable, "-c", code], stderr=subprocess.DEVNULL
+    )
+    loaded = output.decode().rstrip("\n").split("\n")[-1].split()
+    assert loaded[0] == "LOADED"
+    return set(loaded[1:])
+
+
+def test_import_varifier():
+    assert _modules_loaded_by("import varifier") == set()
+    assert _modules_loaded_by("import varifier; varifier.__version__") == set()
+    assert _modules_loaded_by("import varifier.checkpoint, varifier.tasks") == set()
+
+
+def test_command_line_help():
+    code = """import sys
+import varifier.__main__
+sys.argv = ["varifier", "--help"]
+try:
+    varifier.__main__.main()
+except SystemExit:
+    pass"""
+    assert _modules_loaded_by(code) == set()
+
+
+def test_vcf_eval_does_not_load_truth_finding():
+    # Making a truth VCF needs MUMmer and pymummer, but vcf_eval should not
+    # load them until they are needed
+    loaded = _modules_loaded_by("import varifier.tasks.vcf_eval")
+    assert "mappy" in loaded
+    assert "pymummer" not in loaded
+
+
+def test_lazy_submodules():
+    assert varifier.vcf_stats.__name__ == "varifier.vcf_stats"
+    assert varifier.tasks.vcf_eval.__name__ == "varifier.tasks.vcf_eval"
+    assert "vcf_evaluate" in dir(varifier)
+    assert isinstance(varifier.__version__, str)
+    with pytest.raises(AttributeError):
+        varifier.not_a_module
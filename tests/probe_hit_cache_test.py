@@ -0,0 +1,49 @@
+import os
+import pytest
+
+from varifier import probe_hit_cache
+
+this_dir = os.path.dirname(os.path.abspath(__file__))
+data_dir = os.path.join(this_dir, "data", "probe_hit_cache")
+
+
+def test_cache_namespace():
+    fasta1 = os.path.join(data_dir, "cache_namespace.1.fa")
+    fasta2 = os.path.join(data_dir, "cache_namespace.2.fa")
+    options = {"k": 15, "w": 10}
+    namespace = probe_hit_cache.cache_namespace(fasta1, options)
+    assert namespace == probe_hit_cache.cache_namespace(fasta1, {"w": 10, "k": 15})
+    assert namespace != probe_hit_cache.cache_namespace(fasta2, options)
+    assert namespace != probe_hit_cache.cache_namespace(fasta1, {"k": 15, "w": 11})
+
+
+def test_probe_hit_cache():
+    tmp_db = "tmp.probe_hit_cache.sqlite"
+    if os.path.exists(tmp_db):
+        os.unlink(tmp_db)
+
+    hit1 = ("ctg1", 10, 20, 0, 10, 1, [[10, 7]], 60, 0)
+    hit2 = ("ctg2", 30, 40, 1, 11, -1, [[5, 7], [1, 8], [4, 7]], 60, 1)
+    with probe_hit_cache.ProbeHitCache(tmp_db, "ns1", max_entries=2) as cache:
+        assert cache.get("A") is None
+        cache.put("A", [hit1, hit2])
+        cache.put("C", [])
+        assert cache.get("A") == [hit1, hit2]
+        assert cache.get("C") == []
+
+    with probe_hit_cache.ProbeHitCache(tmp_db, "ns2", max_entries=2) as cache:
+        assert cache.get("A") is None
+
+    # Use "A", so that "C" is least recently used, and is removed when
+    # "G" is added
+    with probe_hit_cache.ProbeHitCache(tmp_db, "ns1", max_entries=2) as cache:
+        assert cache.get("A") == [hit1, hit2]
+    with probe_hit_cache.ProbeHitCache(tmp_db, "ns1", max_entries=2) as cache:
+        cache.put("G", [hit2])
+
+    with probe_hit_cache.ProbeHitCache(tmp_db, "ns1", max_entries=2) as cache:
+        assert cache.get("A") == [hit1, hit2]
+        assert cache.get("C") is None
+        assert cache.get("G") == [hit2]
+
+    os.unlink(tmp_db)
@@ -1,8 +1,10 @@
+import collections
 import filecmp
 import os
 import pytest
+from unittest import mock
 
-from varifier import probe_mapping
+from varifier import probe_mapping, registry, vcf_record
 
 this_dir = os.path.dirname(os.path.abspath(__file__))
 data_dir = os.path.join(this_dir, "data", "probe_mapping")
@@ -14,6 +16,112 @@ def clean_files(filenames):
             os.unlink(filename)
 
 
+def test_map_probe():
+    mapper = mock.Mock()
+    mapper.map.side_effect = lambda seq, MD=True: iter([f"hit_{seq}"])
+    assert probe_mapping.map_probe(mapper, "ACGT") == ["hit_ACGT"]
+    assert probe_mapping.map_probe(mapper, "ACGT") == ["hit_ACGT"]
+    assert mapper.map.call_count == 2
+
+    mapper.map.reset_mock()
+    cache = collections.OrderedDict()
+    for seq in "ACGT", "ACGT", "AAAA", "ACGT", "CCCC", "ACGT":
+        hits = probe_mapping.map_probe(mapper, seq, hit_cache=cache, max_cache_size=2)
+        assert hits == [f"hit_{seq}"]
+    # ACGT only mapped once, because it is always one of the 2 most recently
+    # used sequences
+    assert mapper.map.call_count == 3
+    assert list(cache.keys()) == ["CCCC", "ACGT"]
+
+
+def test_compare_to_truth():
+    assert probe_mapping._compare_to_truth("ACGTA", "ACGTA") == ([[5, 7]], 0)
+    assert probe_mapping._compare_to_truth("ACTTA", "ACGTA") == (
+        [[2, 7], [1, 8], [2, 7]],
+        1,
+    )
+    assert probe_mapping._compare_to_truth("ACGGTA", "ACGTA") == (
+        [[3, 7], [1, 1], [2, 7]],
+        1,
+    )
+    assert probe_mapping._compare_to_truth("ACTA", "ACGGTA") == (
+        [[2, 7], [2, 2], [2, 7]],
+        2,
+    )
+    assert probe_mapping._compare_to_truth("ACTTGA", "ACGTA") == (
+        [[2, 7], [1, 8], [1, 7], [1, 1], [1, 7]],
+        2,
+    )
+
+
+def test_window_mapper():
+    left = "GATTACAGCATCGACTAGGCAT"
+    right = "CCTAGGATCGATTTCAGGACTA"
+    truth_seqs = {"truth": "T" * 50 + left + "A" + right + "G" * 50}
+    with mock.patch.object(probe_mapping.mappy, "Aligner") as aligner:
+        mapper = probe_mapping.WindowMapper(truth_seqs, "truth", 40, 140)
+        hits = list(mapper.map(left + "A" + right))
+        assert len(hits) == 1
+        hit = hits[0]
+        assert (hit.ctg, hit.r_st, hit.r_en, hit.q_st, hit.q_en) == (
+            "truth",
+            50,
+            95,
+            0,
+            45,
+        )
+        assert (hit.strand, hit.cigar, hit.mapq, hit.NM) == (1, [[45, 7]], 60, 0)
+
+        hits = list(mapper.map(left + "CC" + right))
+        assert len(hits) == 1
+        hit = hits[0]
+        assert (hit.r_st, hit.r_en, hit.strand, hit.mapq, hit.NM) == (
+            50,
+            95,
+            1,
+            60,
+            2,
+        )
+        assert hit.cigar == [[22, 7], [1, 8], [1, 1], [22, 7]]
+
+        revcomp = (left + "C" + right).translate(str.maketrans("ACGT", "TGCA"))
+        hits = list(mapper.map(revcomp[::-1]))
+        assert len(hits) == 1
+        hit = hits[0]
+        assert (hit.r_st, hit.r_en, hit.strand, hit.mapq, hit.NM) == (
+            50,
+            95,
+            -1,
+            60,
+            1,
+        )
+        assert hit.cigar == [[22, 7], [1, 8], [22, 7]]
+
+        # Not in the window
+        assert list(mapper.map("ACGTACGTACGTAAAAACCCCCGGGGG")) == []
+        mapper = probe_mapping.WindowMapper(truth_seqs, "truth", 80, 140)
+        assert list(mapper.map(left + "A" + right)) == []
+        aligner.assert_not_called()
+
+    # Probe in the window twice, so mapq is zero
+    truth_seqs = {"truth": left + "A" + right + left + "A" + right}
+    mapper = probe_mapping.WindowMapper(truth_seqs, "truth", 0, 89)
+    hits = list(mapper.map(left + "A" + right))
+    assert [(x.r_st, x.mapq) for x in hits] == [(0, 0), (45, 0)]
+    # ... but looking it up at a known position gives one hit
+    hit = mapper.hit_at(left + "A" + right, 45)
+    assert (hit.ctg, hit.r_st, hit.r_en, hit.strand, hit.mapq, hit.NM) == (
+        "truth",
+        45,
+        90,
+        1,
+        60,
+        0,
+    )
+    assert mapper.hit_at(left + "A" + right, 44) is None
+    assert mapper.hit_at(left + "A" + right, 46) is None
+
+
 def test_annotate_vcf_with_probe_mapping():
     # This is an end-to-end test of running annotate_vcf_with_probe_mapping().
     # Input files are made by the script tests/data/probe_mapping/make_test_data.py.
@@ -92,3 +200,98 @@ def test_annotate_with_probe_mapping_clustered_snps_and_indels():
     assert filecmp.cmp(tmp_vcf, expect_vcf, shallow=False)
     assert filecmp.cmp(tmp_vcf_revcomp, expect_vcf, shallow=False)
     clean_files((tmp_vcf, tmp_vcf_revcomp, tmp_map))
+
+
+def test_annotate_vcf_with_probe_mapping_adaptive_flank_length():
+    # Data made by tests/data/probe_mapping/adaptive_flank_length_make_data.py.
+    # The second SNP is in a repeat, so short probes do not map uniquely
+    vcf_ref_fa = os.path.join(data_dir, "adaptive_flank_length.ref.fa")
+    vcf_in = os.path.join(data_dir, "adaptive_flank_length.in.vcf")
+    truth_ref_fa = os.path.join(data_dir, "adaptive_flank_length.truth.fa")
+    tmp_vcf = "tmp.probe_mapping.adaptive_flank_length.vcf"
+    clean_files((tmp_vcf,))
+
+    def got_results(max_flank_length):
+        probe_mapping.annotate_vcf_with_probe_mapping(
+            vcf_in,
+            vcf_ref_fa,
+            truth_ref_fa,
+            30,
+            tmp_vcf,
+            max_flank_length=max_flank_length,
+        )
+        _, records = vcf_record.vcf_file_to_list(tmp_vcf)
+        os.unlink(tmp_vcf)
+        return [x.FORMAT["VFR_RESULT"] for x in records]
+
+    assert got_results(None) == ["TP", "FP_PROBE_UNMAPPED"]
+    assert got_results(200) == ["TP", "TP"]
+
+
+def test_annotate_vcf_with_probe_mapping_truth_windows():
+    # Same data as test_annotate_vcf_with_probe_mapping_adaptive_flank_length.
+    # Mapping to the correct window of the truth genome is unique, even
+    # though the second SNP is in a repeat
+    vcf_ref_fa = os.path.join(data_dir, "adaptive_flank_length.ref.fa")
+    vcf_in = os.path.join(data_dir, "adaptive_flank_length.in.vcf")
+    truth_ref_fa = os.path.join(data_dir, "adaptive_flank_length.truth.fa")
+    tmp_vcf = "tmp.probe_mapping.truth_windows.vcf"
+    clean_files((tmp_vcf,))
+
+    def got_results(truth_windows):
+        probe_mapping.annotate_vcf_with_probe_mapping(
+            vcf_in,
+            vcf_ref_fa,
+            truth_ref_fa,
+            30,
+            tmp_vcf,
+            truth_windows=truth_windows,
+        )
+        _, records = vcf_record.vcf_file_to_list(tmp_vcf)
+        os.unlink(tmp_vcf)
+        return [x.FORMAT["VFR_RESULT"] for x in records]
+
+    # The index of the whole truth genome is not needed when every probe
+    # maps to its window
+    registry.forget(truth_ref_fa)
+    assert got_results(lambda ctg, start, end: ("truth", start, end)) == ["TP", "TP"]
+    assert ("aligner", truth_ref_fa) not in registry.loaded()
+    # Fall back to mapping to the whole genome when window is not known, or
+    # when the probe does not map to the window
+    assert got_results(lambda ctg, start, end: None) == ["TP", "FP_PROBE_UNMAPPED"]
+    assert got_results(lambda ctg, start, end: ("truth", 0, 0)) == [
+        "TP",
+        "FP_PROBE_UNMAPPED",
+    ]
+
+
+def test_annotate_vcf_with_probe_mapping_probe_hit_cache():
+    vcf_ref_fa = os.path.join(data_dir, "annotate_vcf_with_probe_mapping.ref.fa")
+    vcf_in = os.path.join(data_dir, "annotate_vcf_with_probe_mapping.in.vcf")
+    truth_ref_fa = os.path.join(data_dir, "annotate_vcf_with_probe_mapping.truth.fa")
+    expect_vcf = os.path.join(data_dir, "annotate_vcf_with_probe_mapping.expect.vcf")
+    tmp_vcf = "tmp.probe_mapping.probe_hit_cache.vcf"
+    tmp_db = "tmp.probe_mapping.probe_hit_cache.sqlite"
+    clean_files((tmp_vcf, tmp_db))
+    truth_mask = {"truth": {80, 81, 82}}
+
+    def run_and_check():
+        probe_mapping.annotate_vcf_with_probe_mapping(
+            vcf_in,
+            vcf_ref_fa,
+            truth_ref_fa,
+            100,
+            tmp_vcf,
+            use_fail_conflict=True,
+            truth_mask=truth_mask,
+            probe_hit_cache=tmp_db,
+        )
+        assert filecmp.cmp(tmp_vcf, expect_vcf, shallow=False)
+        os.unlink(tmp_vcf)
+
+    run_and_check()
+    # Second time, all probes should come from the cache, and not be mapped
+    with mock.patch.object(probe_mapping, "get_probe_mapper") as get_mapper:
+        get_mapper.return_value.map.side_effect = Exception("Probe was mapped")
+        run_and_check()
+    clean_files((tmp_vcf, tmp_db))
@@ -10,30 +10,34 @@ def test_allele_seq():
 
 
 def test_probe_allele_match_counts():
-    Hit = collections.namedtuple("Hit", ["NM", "q_st", "strand", "cigar"])
+    Hit = collections.namedtuple(
+        "Hit", ["NM", "r_st", "q_st", "q_en", "strand", "cigar"]
+    )
     p = probe.Probe("ACGTA", 2, 2)
     cigar = [[5, 7]]  # this is 5=
-    hit = Hit(0, 0, 1, cigar)
+    hit = Hit(0, 0, 0, 5, 1, cigar)
     assert p.allele_match_counts(hit) == (1, 1)
 
     cigar = [[2, 7], [1, 8], [2, 7]]  # this is 2=1X2=
-    hit = Hit(1, 0, 1, cigar)
+    hit = Hit(1, 0, 0, 5, 1, cigar)
     assert p.allele_match_counts(hit) == (0, 1)
 
     cigar = [[1, 7], [1, 8], [3, 7]]  # this is 1=1X3=
-    hit = Hit(1, 0, 1, cigar)
+    hit = Hit(1, 0, 0, 5, 1, cigar)
     assert p.allele_match_counts(hit) == (1, 1)
 
     cigar = [[3, 7], [1, 8], [1, 7]]  # this is 3=1X1=
-    hit = Hit(1, 0, 1, cigar)
+    hit = Hit(1, 0, 0, 5, 1, cigar)
     assert p.allele_match_counts(hit) == (1, 1)
 
 
 def test_raise_error_bad_cigar_operator():
-    Hit = collections.namedtuple("Hit", ["NM", "q_st", "strand", "cigar"])
+    Hit = collections.namedtuple(
+        "Hit", ["NM", "r_st", "q_st", "q_en", "strand", "cigar"]
+    )
     p = probe.Probe("ACGTA", 2, 2)
     cigar = [[5, 42]]  # 42 is not a valid cigar operator
-    hit = Hit(1, 0, 1, cigar)
+    hit = Hit(1, 0, 0, 5, 1, cigar)
     with pytest.raises(RuntimeError):
         foo = p.allele_match_counts(hit)
 
@@ -128,3 +132,53 @@ def test_edit_distance_vs_ref():
     assert (1, False) == p.edit_distance_vs_ref(hit, ref, ref_mask={3})
     assert (1, False) == p.edit_distance_vs_ref(hit, ref, ref_mask={3, 5})
     assert (1, True) == p.edit_distance_vs_ref(hit, ref, ref_mask={3, 4, 5})
+
+
+def test_alignment():
+    Hit = collections.namedtuple(
+        "Hit", ["NM", "r_st", "r_en", "q_st", "q_en", "strand", "cigar"]
+    )
+    p = probe.Probe("ACGTATC", 2, 4)
+    cigar = [[2, 7], [1, 2], [1, 7], [1, 1], [1, 8], [2, 7]]  # 2=1D1=1I1X2=
+    hit = Hit(2, 10, 17, 0, 7, 1, cigar)
+    got = p.alignment(hit)
+    assert p.alignment(got) is got
+    assert got.hit is hit
+    assert got.contains_allele
+    assert (got.allele_matches, got.allele_positions) == (1, 4)
+    assert got.allele_n_columns == 0
+    assert got.allele_ops == ((1, 7), (1, 1), (1, 8))
+    assert (got.truth_start, got.truth_end) == (13, 14)
+    ref = "N" * 10 + "ACAGTTC"
+    assert p.allele_alignment_strings(got, ref) == ("GTA", "G-T")
+    padded_probe, _ = p.padded_probe_or_ref_seq(hit)
+    padded_ref, _ = p.padded_probe_or_ref_seq(hit, ref_seq=ref)
+    start, end = p.padded_seq_allele_start_end_coords(padded_probe)
+    assert p.allele_alignment_strings(got, ref) == (
+        padded_probe[start : end + 1],
+        padded_ref[start : end + 1],
+    )
+
+    # Reverse strand: the cigar is in the order of the reference, but the
+    # alignment is in the order of the probe
+    hit = Hit(2, 10, 17, 0, 7, -1, list(reversed(cigar)))
+    got = p.alignment(hit)
+    assert hit.cigar == list(reversed(cigar))
+    assert got.allele_ops == ((1, 7), (1, 1), (1, 8))
+    assert (got.truth_start, got.truth_end) == (12, 13)
+    ref = "N" * 10 + "GAACTGT"
+    assert p.allele_alignment_strings(got, ref) == ("GTA", "G-T")
+
+    # The alignment starts part of the way through the allele
+    hit = Hit(0, 10, 13, 3, 6, 1, [[3, 7]])
+    got = p.alignment(hit)
+    assert not got.contains_allele
+    assert got.allele_n_columns == 1
+    assert got.allele_ops == ((2, 7),)
+    assert p.allele_alignment_strings(got, "N" * 10 + "TAT") == ("NTA", "NTA")
+
+    # The alignment ends before the allele does
+    hit = Hit(0, 10, 13, 0, 4, 1, [[4, 7]])
+    assert p.alignment(hit).allele_ops is None
+    assert p.allele_alignment_strings(hit, "N" * 10 + "ACGT") is None
+    assert p.edit_distance_vs_ref(hit, "N" * 10 + "ACGT") == (-1, False)
@@ -3,9 +3,7 @@ import os
 import pytest
 import subprocess
 
-from cluster_vcf_records import vcf_record
-
-from varifier import recall, utils
+from varifier import recall, utils, vcf_record
 
 this_dir = os.path.dirname(os.path.abspath(__file__))
 data_dir = os.path.join(this_dir, "data", "recall")
@@ -41,7 +39,7 @@ def test_get_recall():
     vcf_to_test = os.path.join(data_dir, "get_recall.to_test.vcf")
     tmp_out = "tmp.get_recall"
     subprocess.check_output(f"rm -rf {tmp_out}", shell=True)
-    got_vcf = recall.get_recall(
+    got_vcf, _ = recall.get_recall(
         ref_fasta, vcf_to_test, tmp_out, 100, debug=True, truth_fasta=truth_fasta,
     )
     expect_vcf = os.path.join(data_dir, "get_recall.expect.vcf")
@@ -51,7 +49,7 @@ def test_get_recall():
     # Same again, but with a mask that removes a few variants
     mask = {"truth": set(list(range(320, 391)))}
     mask["truth"].add(180)
-    got_vcf = recall.get_recall(
+    got_vcf, _ = recall.get_recall(
         ref_fasta,
         vcf_to_test,
         tmp_out,
@@ -63,3 +61,26 @@ def test_get_recall():
     expect_vcf = os.path.join(data_dir, "get_recall.expect.masked.vcf")
     assert utils.vcf_records_are_the_same(got_vcf, expect_vcf)
     subprocess.check_output(f"rm -r {tmp_out}", shell=True)
+
+
+def test_mutated_ref_windows():
+    ref_seqs = {"ref1": "ACGTACGTACGTACGTACGT", "ref2": "AAAAAAAAAA", "ref3": "CCC"}
+    vcf_records = [
+        vcf_record.VcfRecord("ref1\t3\t.\tG\tT\t.\tPASS\t.\tGT\t1/1"),
+        vcf_record.VcfRecord("ref1\t5\t.\tA\tATTT\t.\tPASS\t.\tGT\t1/1"),
+        vcf_record.VcfRecord("ref1\t5\t.\tAC\tA\t.\tPASS\t.\tGT\t1/1"),
+        vcf_record.VcfRecord("ref1\t9\t.\tACGT\tA\t.\tPASS\t.\tGT\t1/1"),
+        vcf_record.VcfRecord("ref1\t16\t.\tC\tG\t.\tPASS\t.\tGT\t0/0"),
+        vcf_record.VcfRecord("ref2\t2\t.\tA\tG\t.\tPASS\t.\tGT\t0/0"),
+    ]
+    mutated = recall.apply_variants_to_seqs(ref_seqs, vcf_records)
+    assert mutated["ref1.mutated"] == "ACTTAGTAACGTACGT"
+    windows = recall.mutated_ref_windows(vcf_records)
+    assert windows("ref3", 0, 2) is None
+    assert windows("ref2", 3, 5) == ("ref2.mutated", 3, 5)
+    # Positions that were not changed should have the same base in the
+    # mutated sequence. Changed positions go to the start of the new allele
+    expect = [0, 1, 2, 3, 4, 4, 5, 6, 7, 7, 7, 7, 8, 9, 10, 11, 12, 13, 14, 15]
+    got = [windows("ref1", i, i)[1] for i in range(20)]
+    assert got == expect
+    assert windows("ref1", 0, 19) == ("ref1.mutated", 0, 15)
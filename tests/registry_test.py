@@ -0,0 +1,118 @@
+import os
+import threading
+import pytest
+
+from varifier import registry
+
+
+def test_get_seqs_and_aligner():
+    tmp_fasta = "tmp.registry.fa"
+    with open(tmp_fasta, "w") as f:
+        print(">seq1", "ACGTACGTAGCTATCGACTACGACTACGATCAGCTTACG", sep="\n", file=f)
+    registry.clear()
+    seqs = registry.get_seqs(tmp_fasta)
+    assert list(seqs.keys()) == ["seq1"]
+    assert registry.get_seqs(tmp_fasta) is seqs
+
+    aligner = registry.get_aligner(tmp_fasta, k=15, w=10)
+    assert registry.get_aligner(tmp_fasta, k=15, w=10) is aligner
+    assert registry.get_aligner(tmp_fasta, k=11, w=10) is not aligner
+    # Loading with different options keeps what is already loaded
+    assert registry.get_aligner(tmp_fasta, k=15, w=10) is aligner
+    assert registry.get_seqs(tmp_fasta) is seqs
+    assert registry.loaded() == [
+        ("aligner", os.path.abspath(tmp_fasta)),
+        ("aligner", os.path.abspath(tmp_fasta)),
+        ("seqs", os.path.abspath(tmp_fasta)),
+    ]
+
+    # Changing the file means it gets loaded again
+    with open(tmp_fasta, "w") as f:
+        print(">seq2", "ACGTACGTAGCTATCGACTACGACTACGATCAGCTTACG", sep="\n", file=f)
+    os.utime(tmp_fasta, ns=(0, 0))
+    new_seqs = registry.get_seqs(tmp_fasta)
+    assert new_seqs is not seqs
+    assert list(new_seqs.keys()) == ["seq2"]
+    assert registry.get_aligner(tmp_fasta, k=15, w=10) is not aligner
+
+    assert registry.loaded() == [
+        ("aligner", os.path.abspath(tmp_fasta)),
+        ("seqs", os.path.abspath(tmp_fasta)),
+    ]
+
+    registry.forget(tmp_fasta)
+    assert registry.get_seqs(tmp_fasta) is not new_seqs
+    registry.clear()
+    os.unlink(tmp_fasta)
+
+
+def test_get_mask():
+    tmp_bed = "tmp.registry.bed"
+    with open(tmp_bed, "w") as f:
+        print("seq1", "2", "5", sep="\t", file=f)
+    registry.clear()
+    mask = registry.get_mask(tmp_bed)
+    assert mask == {"seq1": {2, 3, 4}}
+    assert registry.get_mask(tmp_bed) is mask
+    intervals = registry.get_bed_intervals(tmp_bed)
+    assert intervals == {"seq1": ([2], [5])}
+    assert registry.get_bed_intervals(tmp_bed) is intervals
+    registry.clear()
+    os.unlink(tmp_bed)
+
+
+def test_loading_does_not_block_other_files():
+    tmp_fasta1 = "tmp.registry.loading.1.fa"
+    tmp_fasta2 = "tmp.registry.loading.2.fa"
+    for filename in tmp_fasta1, tmp_fasta2:
+        with open(filename, "w") as f:
+            print(">seq1", "ACGT", sep="\n", file=f)
+    registry.clear()
+    seqs2 = registry.get_seqs(tmp_fasta2)
+    started = threading.Event()
+    finish = threading.Event()
+    loads = []
+
+    def slow_loader():
+        loads.append(1)
+        started.set()
+        assert finish.wait(timeout=10)
+        return "loaded"
+
+    def get():
+        results.append(registry._get("slow", tmp_fasta1, None, slow_loader))
+
+    results = []
+    threads = [threading.Thread(target=get) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    assert started.wait(timeout=10)
+    # Another file can be got while the slow one is loading
+    assert registry.get_seqs(tmp_fasta2) is seqs2
+    finish.set()
+    for thread in threads:
+        thread.join()
+    assert results == ["loaded", "loaded"]
+    assert loads == [1]
+    registry.clear()
+    os.unlink(tmp_fasta1)
+    os.unlink(tmp_fasta2)
+
+
+def test_failed_load_does_not_keep_lock():
+    tmp_bed = "tmp.registry.failed_load.bed"
+    with open(tmp_bed, "w") as f:
+        print("seq1", "2", "5", sep="\t", file=f)
+    registry.clear()
+
+    def fail():
+        raise ValueError("failed to load")
+
+    with pytest.raises(ValueError):
+        registry._get("mask", tmp_bed, None, fail)
+    assert registry._loading == {}
+    assert registry.loaded() == []
+    assert registry.get_mask(tmp_bed) == {"seq1": {2, 3, 4}}
+    assert registry._loading == {}
+    registry.clear()
+    os.unlink(tmp_bed)
@@ -0,0 +1,78 @@
+import os
+import pytest
+import subprocess
+
+from varifier import checkpoint, scratch
+
+
+def _touch(filename):
+    with open(filename, "w") as f:
+        print("foo", file=f)
+
+
+def _all_files(directory):
+    found = set()
+    for root, dirs, files in os.walk(directory):
+        found.update(os.path.relpath(os.path.join(root, x), directory) for x in files)
+    return found
+
+
+def test_remove_intermediate_files():
+    tmp_file = "tmp.scratch.remove_intermediate_files"
+    marker = checkpoint.checkpoint_file(tmp_file)
+    _touch(tmp_file)
+    _touch(marker)
+    scratch.remove_intermediate_files("all", tmp_file)
+    assert os.path.exists(tmp_file)
+    assert os.path.exists(marker)
+    scratch.remove_intermediate_files("final", tmp_file, "tmp.scratch.not_a_file")
+    assert not os.path.exists(tmp_file)
+    assert not os.path.exists(marker)
+
+
+def test_output_dir():
+    outdir = "tmp.scratch.output_dir.out"
+    tmpdir = "tmp.scratch.output_dir.tmp"
+    subprocess.check_output(f"rm -rf {outdir} {tmpdir}", shell=True)
+    os.mkdir(tmpdir)
+
+    def run(**kwargs):
+        with scratch.output_dir(outdir, results=["a", "b/c"], **kwargs) as workdir:
+            os.mkdir(os.path.join(workdir, "b"))
+            for filename in "a", "b/c", "b/d", "e":
+                _touch(os.path.join(workdir, filename))
+        return workdir
+
+    assert run() == outdir
+    assert _all_files(outdir) == {"a", "b/c", "b/d", "e"}
+    with pytest.raises(FileExistsError):
+        run()
+    run(force=True, keep="none")
+    assert _all_files(outdir) == {"a", "b/c"}
+
+    workdir = run(force=True, tmpdir=tmpdir)
+    assert os.path.dirname(workdir) == tmpdir
+    assert _all_files(outdir) == {"a", "b/c", "b/d", "e"}
+    assert os.listdir(tmpdir) == []
+    run(force=True, tmpdir=tmpdir, keep="none")
+    assert _all_files(outdir) == {"a", "b/c"}
+    assert os.listdir(tmpdir) == []
+    with pytest.raises(Exception):
+        run(force=True, tmpdir=tmpdir, resume=True)
+    # Resuming needs the intermediate files, so they must all be kept
+    for keep in "none", "final":
+        with pytest.raises(Exception, match="Cannot resume"):
+            run(resume=True, keep=keep)
+    scratch.check_can_resume(True, "all")
+    scratch.check_can_resume(False, "final", tmpdir=tmpdir)
+
+    # The temporary directory is always deleted, and nothing is moved to
+    # the output directory if there is an error
+    subprocess.check_output(f"rm -r {outdir}", shell=True)
+    with pytest.raises(ZeroDivisionError):
+        with scratch.output_dir(outdir, tmpdir=tmpdir) as workdir:
+            _touch(os.path.join(workdir, "a"))
+            1 / 0
+    assert os.listdir(outdir) == []
+    assert os.listdir(tmpdir) == []
+    subprocess.check_output(f"rm -r {outdir} {tmpdir}", shell=True)
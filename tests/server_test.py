@@ -0,0 +1,112 @@
+import json
+import os
+import subprocess
+import threading
+from unittest import mock
+
+import pytest
+
+from varifier import probe_mapping, registry, server, vcf_evaluate
+
+this_dir = os.path.dirname(os.path.abspath(__file__))
+data_dir = os.path.join(this_dir, "data", "vcf_evaluate")
+
+
+def _start_server(**kwargs):
+    s = server.make_server(**kwargs)
+    thread = threading.Thread(target=s.serve_forever)
+    thread.start()
+    return s, thread
+
+
+def _stop_server(s, thread):
+    s.shutdown()
+    thread.join()
+    s.server_close()
+
+
+def test_server():
+    truth_fasta = os.path.join(data_dir, "evaluate_multi_sample_vcf.truth.fa")
+    truth_vcf = os.path.join(data_dir, "evaluate_multi_sample_vcf.truth.vcf")
+    ref_fasta = os.path.join(data_dir, "evaluate_multi_sample_vcf.ref.fa")
+    vcf_to_eval = os.path.join(data_dir, "evaluate_multi_sample_vcf.to_eval.vcf")
+    tmp_vcf = "tmp.server.vcf"
+    tmp_expect = "tmp.server.expect"
+    tmp_out = "tmp.server.out"
+    tmp_socket = "tmp.server.sock"
+    subprocess.check_output(
+        f"rm -rf {tmp_vcf} {tmp_expect} {tmp_out} {tmp_socket}", shell=True
+    )
+    subprocess.check_output(f"cut -f 1-10 {vcf_to_eval} > {tmp_vcf}", shell=True)
+    vcf_evaluate.evaluate_vcf(
+        tmp_vcf, ref_fasta, truth_fasta, 100, tmp_expect, truth_vcf=truth_vcf
+    )
+    with open(os.path.join(tmp_expect, "summary_stats.json")) as f:
+        expect = json.load(f)
+
+    registry.clear()
+    server.preload(fasta_files=[truth_fasta])
+    job = {
+        "vcf_to_eval": tmp_vcf,
+        "vcf_ref_fasta": ref_fasta,
+        "truth_ref_fasta": truth_fasta,
+        "truth_vcf": truth_vcf,
+    }
+    s, thread = _start_server(port=0, workers=2, outdir=tmp_out)
+    assert s.server_address[0] == "127.0.0.1"
+    port = s.server_address[1]
+    try:
+        assert server.submit_job(job, port=port) == expect
+        assert server.submit_job({**job, "outdir": "eval"}, port=port) == expect
+        assert os.path.exists(os.path.join(tmp_out, "eval", "summary_stats.json"))
+        got = server.submit_job(
+            {**job, "filter_policies": {"all": None, "pass": ["PASS"]}}, port=port
+        )
+        assert set(got["Filter_policies"]) == {"all", "pass"}
+        for bad_job, error in [
+            ({**job, "not_an_option": 1}, "not allowed"),
+            ({**job, "force": True}, "not allowed"),
+            ({**job, "resume": True}, "not allowed"),
+            ({**job, "tmpdir": "/tmp"}, "not allowed"),
+            ({**job, "probe_hit_cache": "cache.db"}, "not allowed"),
+            ({**job, "outdir": "eval"}, "already exists"),
+            ({**job, "outdir": ".."}, "must be the name"),
+            ({**job, "outdir": "../x"}, "must be the name"),
+            ({**job, "outdir": "/tmp/x"}, "must be the name"),
+            ({"vcf_to_eval": tmp_vcf}, "Missing option"),
+        ]:
+            with pytest.raises(Exception, match=error):
+                server.submit_job(bad_job, port=port)
+
+        # A job that fails during recall should not leave the genome with
+        # the calls applied loaded in the registry
+        loaded = registry.loaded()
+        evaluate_vcf_record = probe_mapping.evaluate_vcf_record
+
+        def fail_on_mutated_genome(*args, **kwargs):
+            if any(x.endswith(".mutated") for x in args[5]):
+                raise RuntimeError("Recall failed")
+            return evaluate_vcf_record(*args, **kwargs)
+
+        with mock.patch.object(
+            probe_mapping, "evaluate_vcf_record", side_effect=fail_on_mutated_genome
+        ):
+            with pytest.raises(Exception, match="Recall failed"):
+                server.submit_job(job, port=port)
+        assert registry.loaded() == loaded
+        status = server.server_status(port=port)
+    finally:
+        _stop_server(s, thread)
+    assert status["jobs"] == {"queued": 0, "running": 0, "done": 3, "failed": 1}
+    assert {"kind": "aligner", "file": truth_fasta} in status["loaded"]
+
+    s, thread = _start_server(socket_path=tmp_socket)
+    try:
+        assert server.submit_job(job, socket_path=tmp_socket) == expect
+        with pytest.raises(Exception, match="server has no outdir"):
+            server.submit_job({**job, "outdir": "eval2"}, socket_path=tmp_socket)
+    finally:
+        _stop_server(s, thread)
+    assert not os.path.exists(tmp_socket)
+    registry.clear()
+    subprocess.check_output(f"rm -r {tmp_vcf} {tmp_expect} {tmp_out}", shell=True)
@@ -19,6 +19,13 @@ def test_make_truth_vcf():
     options.outdir = "tmp.tasks.make_truth_vcf"
     options.flank_length = 100
     options.max_recall_ref_len = None
+    options.resume = False
+    options.threads = 1
+    options.max_flank_length = None
+    options.local_probe_mapping = False
+    options.probe_hit_cache = None
+    options.tmpdir = None
+    options.keep = "all"
     subprocess.check_output(f"rm -rf {options.outdir}", shell=True)
     tasks.make_truth_vcf.run(options)
     got_vcf = os.path.join(options.outdir, "04.truth.vcf")
@@ -43,11 +50,22 @@ def test_vcf_eval():
     options.truth_vcf = None
     options.debug = False
     options.force = False
+    options.resume = False
+    options.threads = 1
+    options.max_flank_length = None
+    options.local_probe_mapping = False
+    options.probe_hit_cache = None
+    options.tmpdir = None
+    options.keep = "all"
     options.ref_mask = None
     options.truth_mask = None
     options.use_ref_calls = False
     options.max_recall_ref_len = None
     options.filter_pass = "PASS,."
+    options.samples = None
+    options.truth_names = None
+    options.filter_policy = None
+    options.stratify = None
     subprocess.check_output(f"rm -rf {options.outdir}", shell=True)
     tasks.vcf_eval.run(options)
     expect_json = os.path.join(data_dir, "vcf_eval.expect.summary_stats.json")
@@ -0,0 +1,87 @@
+import filecmp
+import os
+import shutil
+import subprocess
+
+from varifier import (
+    edit_distance,
+    probe_mapping,
+    recall,
+    registry,
+    truth_probes,
+    vcf_record,
+)
+
+this_dir = os.path.dirname(os.path.abspath(__file__))
+data_dir = os.path.join(this_dir, "data", "truth_probes")
+
+
+def test_write_and_load_truth_probes():
+    ref_fasta = os.path.join(data_dir, "ref.fa")
+    truth_vcf = os.path.join(data_dir, "truth.vcf")
+    tmp_file = "tmp.truth_probes.probes"
+    subprocess.check_output(f"rm -f {tmp_file}", shell=True)
+    truth_probes.write_truth_probes(truth_vcf, ref_fasta, 20, tmp_file)
+
+    _, vcf_records = vcf_record.vcf_file_to_list(truth_vcf)
+    expect = []
+    for _, ref_probe, alt_probe in probe_mapping.probes_for_vcf_records(
+        vcf_records, registry.get_seqs(ref_fasta), 20
+    ):
+        edit_dist = edit_distance.edit_distance_between_seqs(
+            ref_probe.allele_seq(), alt_probe.allele_seq()
+        )
+        expect.append((ref_probe, alt_probe, edit_dist))
+    got = truth_probes.load_truth_probes(truth_vcf, ref_fasta, 20, filename=tmp_file)
+    assert got == expect
+
+    # The file must have been made from the same inputs to be used
+    assert (
+        truth_probes.load_truth_probes(truth_vcf, ref_fasta, 21, filename=tmp_file)
+        is None
+    )
+    assert (
+        truth_probes.load_truth_probes(ref_fasta, ref_fasta, 20, filename=tmp_file)
+        is None
+    )
+    assert truth_probes.load_truth_probes(truth_vcf, ref_fasta, 20) is None
+    assert (
+        truth_probes.load_truth_probes(truth_vcf, ref_fasta, 20, filename=truth_vcf)
+        is None
+    )
+    os.unlink(tmp_file)
+
+
+def test_get_recall_uses_truth_probes(monkeypatch):
+    ref_fasta = os.path.join(data_dir, "ref.fa")
+    vcf_to_test = os.path.join(data_dir, "to_test.vcf")
+    tmp_dir = "tmp.truth_probes.get_recall"
+    subprocess.check_output(f"rm -rf {tmp_dir}", shell=True)
+    os.mkdir(tmp_dir)
+    truth_vcf = os.path.join(tmp_dir, "truth.vcf")
+    shutil.copy(os.path.join(data_dir, "truth.vcf"), truth_vcf)
+    expect_vcf, _ = recall.get_recall(
+        ref_fasta,
+        vcf_to_test,
+        os.path.join(tmp_dir, "no_probes"),
+        20,
+        truth_vcf=truth_vcf,
+    )
+
+    truth_probes.write_truth_probes(
+        truth_vcf, ref_fasta, 20, truth_probes.probes_file(truth_vcf)
+    )
+    made_probes = []
+    make_probes = probe_mapping.make_probes
+
+    def counting_make_probes(*args):
+        made_probes.append(args)
+        return make_probes(*args)
+
+    monkeypatch.setattr(probe_mapping, "make_probes", counting_make_probes)
+    got_vcf, _ = recall.get_recall(
+        ref_fasta, vcf_to_test, os.path.join(tmp_dir, "probes"), 20, truth_vcf=truth_vcf
+    )
+    assert made_probes == []
+    assert filecmp.cmp(got_vcf, expect_vcf, shallow=False)
+    subprocess.check_output(f"rm -r {tmp_dir}", shell=True)
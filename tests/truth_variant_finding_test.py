@@ -1,31 +1,26 @@
 import filecmp
+import gzip
 import os
 import pytest
 import subprocess
 
-from varifier import truth_variant_finding, utils
+from varifier import truth_probes, truth_variant_finding, utils
 
 this_dir = os.path.dirname(os.path.abspath(__file__))
 data_dir = os.path.join(this_dir, "data", "truth_variant_finding")
 
 
-def test_check_dependencies_in_path():
-    truth_variant_finding._check_dependencies_in_path()
-
-
-def test_truth_using_minimap2_paftools():
-    ref_fasta = os.path.join(data_dir, "truth_using_minimap2_paftools.ref.fa")
-    truth_fasta = os.path.join(data_dir, "truth_using_minimap2_paftools.truth.fa")
+def test_truth_using_minimap2():
+    ref_fasta = os.path.join(data_dir, "truth_using_minimap2.ref.fa")
+    truth_fasta = os.path.join(data_dir, "truth_using_minimap2.truth.fa")
     truth_revcomp_fasta = os.path.join(
-        data_dir, "truth_using_minimap2_paftools.truth.revcomp.fa"
+        data_dir, "truth_using_minimap2.truth.revcomp.fa"
     )
 
-    tmp_vcf = "tmp.truth_using_minimap2_paftools.vcf"
+    tmp_vcf = "tmp.truth_using_minimap2.vcf"
     subprocess.check_output(f"rm -f {tmp_vcf}", shell=True)
-    truth_variant_finding._truth_using_minimap2_paftools(
-        ref_fasta, truth_fasta, tmp_vcf
-    )
-    expect_vcf = os.path.join(data_dir, "truth_using_minimap2_paftools.expect.vcf")
+    truth_variant_finding._truth_using_minimap2(ref_fasta, truth_fasta, tmp_vcf)
+    expect_vcf = os.path.join(data_dir, "truth_using_minimap2.expect.vcf")
     assert filecmp.cmp(tmp_vcf, expect_vcf, shallow=False)
     os.unlink(tmp_vcf)
 
@@ -33,17 +28,44 @@ def test_truth_using_minimap2_paftools():
     # However, these tags: "QSTART=122;QSTRAND=-" mean that the VCF file is not
     # identical (although the CHROM, REF, ALT columns are). Hence we have a
     # different expceted VCF file
-    tmp_vcf_revcomp = "tmp.truth_using_minimap2_paftools.revcomp.vcf"
-    truth_variant_finding._truth_using_minimap2_paftools(
-        ref_fasta, truth_revcomp_fasta, tmp_vcf_revcomp
+    tmp_vcf_revcomp = "tmp.truth_using_minimap2.revcomp.vcf"
+    truth_variant_finding._truth_using_minimap2(
+        ref_fasta, truth_revcomp_fasta, tmp_vcf_revcomp, threads=2
     )
     expect_vcf_revcomp = os.path.join(
-        data_dir, "truth_using_minimap2_paftools.expect.revcomp.vcf"
+        data_dir, "truth_using_minimap2.expect.revcomp.vcf"
     )
     assert filecmp.cmp(tmp_vcf_revcomp, expect_vcf_revcomp, shallow=False)
     os.unlink(tmp_vcf_revcomp)
 
 
+def test_ref_to_truth_windows():
+    hits = [
+        ("ref1", 100, 200, "truth1", 1000, 1103, 1, 105, 60, ":10+aaaaa:40-cc:48"),
+        ("ref2", 0, 50, "truth2", 10, 60, -1, 50, 60, ":50"),
+        ("ref2", 100, 200, "truth2", 100, 200, 1, 100, 60, ":100"),
+        ("ref2", 150, 250, "truth3", 0, 100, 1, 100, 60, ":100"),
+        ("ref2", 10, 20, "truth4", 0, 10, 1, 10, 60, ":10"),
+        ("ref2", 300, 320, "truth4", 100, 120, 1, 20, 60, ":20"),
+        ("ref3", 0, 100, "truth3", 0, 100, 1, 100, 0, ":100"),
+    ]
+    truth_windows = truth_variant_finding._ref_to_truth_windows(hits)
+    assert truth_windows("ref1", 105, 105) == ("truth1", 1005, 1005)
+    assert truth_windows("ref1", 105, 120) == ("truth1", 1005, 1025)
+    assert truth_windows("ref1", 150, 160) == ("truth1", 1055, 1063)
+    assert truth_windows("ref1", 90, 120) is None
+    assert truth_windows("ref2", 0, 49) == ("truth2", 10, 59)
+    assert truth_windows("ref2", 110, 120) == ("truth2", 110, 120)
+    assert truth_windows("ref2", 240, 245) == ("truth3", 90, 95)
+    assert truth_windows("ref2", 12, 15) is None
+    assert truth_windows("ref2", 305, 310) == ("truth4", 105, 110)
+    # In two alignments
+    assert truth_windows("ref2", 160, 170) is None
+    # Alignment has mapq too low
+    assert truth_windows("ref3", 10, 20) is None
+    assert truth_windows("ref4", 10, 20) is None
+
+
 def test_merge_vcf_files_for_probe_mapping():
     vcf_files = [
         os.path.join(data_dir, "merge_vcf_files_for_probe_mapping.in.1.vcf"),
@@ -84,16 +106,75 @@ def test_filter_fps_and_long_vars_from_probe_mapped_vcf():
     os.unlink(tmp_vcf)
 
 
-def test_bcftools_norm():
-    ref_fasta = os.path.join(data_dir, "bcftools_norm.ref.fa")
-    vcf_in = os.path.join(data_dir, "bcftools_norm.in.vcf")
-    expect_vcf = os.path.join(data_dir, "bcftools_norm.expect.vcf")
-    tmp_vcf = "tmp.bcftools_norm.vcf"
+def test_call_variants_from_hits_skips_n_mismatches():
+    hits = [("ref", 0, 100, "truth", 0, 100, 1, 100, 60, ":10*an:5*na:5*ag:78")]
+    got = list(truth_variant_finding._call_variants_from_hits(hits))
+    assert got == [["ref", 22, 23, 1, 60, "a", "g", "truth", 22, 1]]
+
+
+def test_normalise_alleles():
+    ref_seq = "ACGTTTTAC"
+    normalise = truth_variant_finding._normalise_alleles
+    # SNP, nothing to change
+    assert normalise(ref_seq, 1, "C", "A") == (1, "C", "A")
+    # Deletion of a T, at right end of run of Ts, gets left-aligned
+    assert normalise(ref_seq, 5, "TT", "T") == (2, "GT", "G")
+    # Insertion of a T, with extra unneeded bases
+    assert normalise(ref_seq, 4, "TTA", "TTTA") == (2, "G", "GT")
+    # Deletion at start of sequence cannot be moved to left
+    assert normalise("AACGT", 1, "AC", "C") == (0, "AA", "A")
+    # Complex variant with common start base gets trimmed
+    assert normalise(ref_seq, 1, "CGT", "CAA") == (2, "GT", "AA")
+
+
+def test_normalise_vcf():
+    ref_fasta = os.path.join(data_dir, "normalise_vcf.ref.fa")
+    vcf_in = os.path.join(data_dir, "normalise_vcf.in.vcf")
+    expect_vcf = os.path.join(data_dir, "normalise_vcf.expect.vcf")
+    tmp_vcf = "tmp.normalise_vcf.vcf"
     subprocess.check_output(f"rm -f {tmp_vcf}", shell=True)
-    truth_variant_finding._bcftools_norm(ref_fasta, vcf_in, tmp_vcf)
+    truth_variant_finding._normalise_vcf(ref_fasta, vcf_in, tmp_vcf)
     # Header lines get changed, so just check the variant lines
     assert utils.vcf_records_are_the_same(tmp_vcf, expect_vcf)
     os.unlink(tmp_vcf)
+    # Small window means that the left-aligned deletion at 144 does not get
+    # moved before the one at 143 in the buffer, but is still a duplicate
+    truth_variant_finding._normalise_vcf(ref_fasta, vcf_in, tmp_vcf, window=0)
+    assert utils.vcf_records_are_the_same(tmp_vcf, expect_vcf)
+    os.unlink(tmp_vcf)
+
+
+def test_normalise_vcf_record_moves_past_window():
+    # The deletion at the end of the run of As gets left-aligned past the
+    # SNP at 12, which is already written when window=0. The record with
+    # REF=ALT is removed. The reference is gzipped, and has no .fai file
+    tmp_ref = "tmp.normalise_vcf_window.ref.fa.gz"
+    tmp_vcf_in = "tmp.normalise_vcf_window.in.vcf"
+    tmp_vcf_out = "tmp.normalise_vcf_window.out.vcf"
+    ref_seq = "GCGTC" + "A" * 20 + "CGTAGC"
+    with gzip.open(tmp_ref, "wt") as f:
+        print(">ref", ref_seq, sep="\n", file=f)
+    header = ["#CHROM", "POS", "ID", "REF", "ALT", "QUAL", "FILTER", "INFO"]
+    with open(tmp_vcf_in, "w") as f:
+        print("##fileformat=VCFv4.2", file=f)
+        print(*header, sep="\t", file=f)
+        print("ref", 3, "1", "G", "T", ".", "PASS", ".", sep="\t", file=f)
+        print("ref", 12, "2", "A", "G", ".", "PASS", ".", sep="\t", file=f)
+        print("ref", 25, "3", "AC", "C", ".", "PASS", ".", sep="\t", file=f)
+        print("ref", 27, "4", "G", "G", ".", "PASS", ".", sep="\t", file=f)
+        print("ref", 28, "5", "T", "A", ".", "PASS", ".", sep="\t", file=f)
+    truth_variant_finding._normalise_vcf(tmp_ref, tmp_vcf_in, tmp_vcf_out, window=0)
+    with open(tmp_vcf_out) as f:
+        got = [x.split("\t")[:5] for x in f if not x.startswith("#")]
+    assert got == [
+        ["ref", "3", "1", "G", "T"],
+        ["ref", "5", "3", "CA", "C"],
+        ["ref", "12", "2", "A", "G"],
+        ["ref", "28", "5", "T", "A"],
+    ]
+    assert not os.path.exists(f"{tmp_ref}.fai")
+    for filename in tmp_ref, tmp_vcf_in, tmp_vcf_out:
+        os.unlink(filename)
 
 
 def test_make_truth_vcf():
@@ -104,6 +185,7 @@ def test_make_truth_vcf():
     got_vcf = truth_variant_finding.make_truth_vcf(ref_fasta, truth_fasta, tmp_out, 100)
     expect_vcf = os.path.join(data_dir, "make_truth_vcf.expect.vcf")
     assert utils.vcf_records_are_the_same(got_vcf, expect_vcf)
+    assert truth_probes.load_truth_probes(got_vcf, ref_fasta, 100) is not None
     subprocess.check_output(f"rm -r {tmp_out}", shell=True)
     # Test same run again, but mask a position in the truth where there's a SNP
     truth_mask = {"truth": {59}}
@@ -18,6 +18,22 @@ def test_load_mask_bed_file():
     assert got_mask == expect
 
 
+def test_load_bed_intervals():
+    bed_file = os.path.join(data_dir, "load_bed_intervals.bed")
+    expect = {"ref1": ([10, 42, 47], [20, 46, 48]), "ref2": ([9], [12])}
+    intervals = utils.load_bed_intervals(bed_file)
+    assert intervals == expect
+
+    # Should agree with using the mask made by load_mask_bed_file()
+    mask = {"ref1": set(range(10, 20)) | {42, 43, 44, 45, 47}, "ref2": {9, 10, 11}}
+    for chrom in "ref1", "ref2", "ref3":
+        for pos in range(60):
+            for ref in "A", "ACG", "ACGTACGTACGT":
+                assert utils.ref_is_in_intervals(
+                    chrom, pos, ref, intervals
+                ) == utils.ref_is_in_mask(chrom, pos, ref, mask)
+
+
 def test_mask_vcf_file():
     vcf_in = os.path.join(data_dir, "mask_vcf_file.in.vcf")
     vcf_expect = os.path.join(data_dir, "mask_vcf_file.expect.vcf")
@@ -1,10 +1,22 @@
 import copy
 import filecmp
+import json
+import logging
 import os
 import pytest
+import sqlite3
 import subprocess
+from unittest import mock
 
-from varifier import utils, vcf_evaluate
+from varifier import (
+    probe_hit_cache,
+    probe_mapping,
+    recall,
+    utils,
+    vcf_evaluate,
+    vcf_record,
+    vcf_stats,
+)
 
 this_dir = os.path.dirname(os.path.abspath(__file__))
 data_dir = os.path.join(this_dir, "data", "vcf_evaluate")
@@ -158,3 +170,652 @@ def test_evaluate_vcf():
     summary_stats_got_json = os.path.join(tmp_out, "summary_stats.json")
     assert filecmp.cmp(summary_stats_got_json, summary_stats_expect_json, shallow=False)
     subprocess.check_output(f"rm -r {tmp_out}", shell=True)
+
+
+def test_evaluate_multi_sample_vcf():
+    truth_fasta = os.path.join(data_dir, "evaluate_multi_sample_vcf.truth.fa")
+    truth_vcf = os.path.join(data_dir, "evaluate_multi_sample_vcf.truth.vcf")
+    ref_fasta = os.path.join(data_dir, "evaluate_multi_sample_vcf.ref.fa")
+    vcf_to_eval = os.path.join(data_dir, "evaluate_multi_sample_vcf.to_eval.vcf")
+    tmp_out = "tmp.vcf_evaluate.evaluate_multi_sample_vcf.out"
+    subprocess.check_output(f"rm -rf {tmp_out}", shell=True)
+    samples = ["s1", "s2"]
+    vcf_evaluate.evaluate_multi_sample_vcf(
+        vcf_to_eval,
+        ref_fasta,
+        {x: truth_fasta for x in samples},
+        100,
+        tmp_out,
+        truth_vcfs={x: truth_vcf for x in samples},
+        filter_pass={"PASS", "."},
+        debug=True,
+    )
+
+    # Each sample should get the same results (and probe mapping debug
+    # output) as evaluating a VCF file that only has that sample
+    for i, sample in enumerate(samples):
+        single_sample_vcf = f"{tmp_out}.{sample}.vcf"
+        subprocess.check_output(
+            f"cut -f 1-9,{10 + i} {vcf_to_eval} > {single_sample_vcf}", shell=True
+        )
+        single_sample_out = f"{tmp_out}.{sample}"
+        vcf_evaluate.evaluate_vcf(
+            single_sample_vcf,
+            ref_fasta,
+            truth_fasta,
+            100,
+            single_sample_out,
+            truth_vcf=truth_vcf,
+            force=True,
+            filter_pass={"PASS", "."},
+            debug=True,
+        )
+        for filename in "summary_stats.json", "precision.vcf.debug.map":
+            assert filecmp.cmp(
+                os.path.join(tmp_out, sample, filename),
+                os.path.join(single_sample_out, filename),
+                shallow=False,
+            )
+        assert utils.vcf_records_are_the_same(
+            os.path.join(tmp_out, sample, "precision.vcf"),
+            os.path.join(single_sample_out, "precision.vcf"),
+        )
+        os.unlink(single_sample_vcf)
+        subprocess.check_output(f"rm -r {single_sample_out}", shell=True)
+
+    assert not filecmp.cmp(
+        os.path.join(tmp_out, "s1", "summary_stats.json"),
+        os.path.join(tmp_out, "s2", "summary_stats.json"),
+        shallow=False,
+    )
+    subprocess.check_output(f"rm -r {tmp_out}", shell=True)
+
+
+def test_evaluate_vcf_records():
+    truth_fasta = os.path.join(data_dir, "evaluate_multi_sample_vcf.truth.fa")
+    truth_vcf = os.path.join(data_dir, "evaluate_multi_sample_vcf.truth.vcf")
+    ref_fasta = os.path.join(data_dir, "evaluate_multi_sample_vcf.ref.fa")
+    vcf_to_eval = os.path.join(data_dir, "evaluate_multi_sample_vcf.to_eval.vcf")
+    tmp_vcf = "tmp.vcf_evaluate.evaluate_vcf_records.vcf"
+    tmp_out = "tmp.vcf_evaluate.evaluate_vcf_records.out"
+    subprocess.check_output(f"rm -rf {tmp_vcf} {tmp_out}", shell=True)
+    subprocess.check_output(f"cut -f 1-10 {vcf_to_eval} > {tmp_vcf}", shell=True)
+    vcf_evaluate.evaluate_vcf(
+        tmp_vcf,
+        ref_fasta,
+        truth_fasta,
+        100,
+        tmp_out,
+        truth_vcf=truth_vcf,
+        filter_pass={"PASS", "."},
+    )
+
+    # Should get the same results in memory as evaluate_vcf()
+    ref_seqs = utils.file_to_dict_of_seqs(ref_fasta)
+    truth_seqs = {k: v.seq for k, v in utils.file_to_dict_of_seqs(truth_fasta).items()}
+    _, truth_records = vcf_record.vcf_file_to_list(truth_vcf)
+    with open(tmp_vcf) as f:
+        got = vcf_evaluate.evaluate_vcf_records(
+            f,
+            ref_seqs,
+            truth_seqs,
+            100,
+            truth_vcf_records=truth_records,
+            filter_pass={"PASS", "."},
+        )
+    with open(os.path.join(tmp_out, "summary_stats.json")) as f:
+        assert got["Summary_stats"] == json.load(f)
+    _, expect_records = vcf_record.vcf_file_to_list(
+        os.path.join(tmp_out, "precision.vcf")
+    )
+    assert got["Precision_records"] == expect_records
+    assert got["Precision"] == vcf_stats.per_record_stats_from_vcf_records(
+        expect_records
+    )
+
+    # Mapping truth probes to where they should be in the genome with the
+    # calls applied should not change the results
+    tmp_local_out = f"{tmp_out}.local"
+    subprocess.check_output(f"rm -rf {tmp_local_out}", shell=True)
+    vcf_evaluate.evaluate_vcf(
+        tmp_vcf,
+        ref_fasta,
+        truth_fasta,
+        100,
+        tmp_local_out,
+        truth_vcf=truth_vcf,
+        filter_pass={"PASS", "."},
+        local_probe_mapping=True,
+    )
+    for filename in "summary_stats.json", os.path.join("recall", "recall.vcf"):
+        assert filecmp.cmp(
+            os.path.join(tmp_out, filename),
+            os.path.join(tmp_local_out, filename),
+            shallow=False,
+        )
+    subprocess.check_output(f"rm -r {tmp_local_out}", shell=True)
+    with open(tmp_vcf) as f:
+        got_local = vcf_evaluate.evaluate_vcf_records(
+            f,
+            ref_seqs,
+            truth_seqs,
+            100,
+            truth_vcf_records=truth_records,
+            filter_pass={"PASS", "."},
+            local_probe_mapping=True,
+        )
+    assert got_local["Summary_stats"] == got["Summary_stats"]
+    assert got_local["Recall_records"] == got["Recall_records"]
+
+    # Without truth records, only precision is calculated
+    got = vcf_evaluate.evaluate_vcf_records(
+        expect_records,
+        ref_seqs,
+        truth_seqs,
+        100,
+        filter_pass={"PASS", "."},
+        as_dataframes=True,
+    )
+    assert got["Recall"] is None
+    assert "Recall" not in got["Summary_stats"]
+    assert list(got["Precision"]["VFR_RESULT"]) == [
+        x.FORMAT["VFR_RESULT"] for x in expect_records
+    ]
+    os.unlink(tmp_vcf)
+    subprocess.check_output(f"rm -r {tmp_out}", shell=True)
+
+
+def test_evaluate_vcf_tmpdir_and_keep(caplog):
+    caplog.set_level(logging.INFO)
+    truth_fasta = os.path.join(data_dir, "evaluate_multi_sample_vcf.truth.fa")
+    truth_vcf = os.path.join(data_dir, "evaluate_multi_sample_vcf.truth.vcf")
+    ref_fasta = os.path.join(data_dir, "evaluate_multi_sample_vcf.ref.fa")
+    vcf_to_eval = os.path.join(data_dir, "evaluate_multi_sample_vcf.to_eval.vcf")
+    ref_mask = os.path.join(data_dir, "evaluate_vcf_tmpdir_and_keep.ref_mask.bed")
+    tmp_vcf = "tmp.vcf_evaluate.evaluate_vcf_tmpdir_and_keep.vcf"
+    tmp_dir = "tmp.vcf_evaluate.evaluate_vcf_tmpdir_and_keep.tmp"
+    subprocess.check_output(f"rm -rf {tmp_vcf} {tmp_dir}", shell=True)
+    subprocess.check_output(f"cut -f 1-10 {vcf_to_eval} > {tmp_vcf}", shell=True)
+    os.mkdir(tmp_dir)
+    expect_files = {
+        "all": {
+            "precision.vcf",
+            "recall/recall.vcf",
+            "recall/recall.vcf.masked.vcf",
+            "recall/ref_with_mutations_added.fa",
+            "summary_stats.json",
+            "variants_to_eval.excluded.vcf",
+            "variants_to_eval.filtered.vcf",
+            "variants_to_eval.masked.vcf",
+        },
+        "final": {
+            "precision.vcf",
+            "recall/recall.vcf.masked.vcf",
+            "summary_stats.json",
+            "variants_to_eval.excluded.vcf",
+        },
+        "none": {"summary_stats.json"},
+    }
+    summary_stats = {}
+
+    for keep, expect in expect_files.items():
+        for tmpdir in None, tmp_dir:
+            outdir = f"tmp.vcf_evaluate.evaluate_vcf_tmpdir_and_keep.{keep}"
+            caplog.clear()
+            vcf_evaluate.evaluate_vcf(
+                tmp_vcf,
+                ref_fasta,
+                truth_fasta,
+                100,
+                outdir,
+                truth_vcf=truth_vcf,
+                force=True,
+                ref_mask_bed_file=ref_mask,
+                tmpdir=tmpdir,
+                keep=keep,
+            )
+            assert os.listdir(tmp_dir) == []
+            summary_json = os.path.join(outdir, "summary_stats.json")
+            assert f"Results written to {summary_json}\n" in caplog.text
+            got_files = set()
+            for root, dirs, files in os.walk(outdir):
+                got_files.update(
+                    os.path.relpath(os.path.join(root, x), outdir)
+                    for x in files
+                    if not x.endswith(".checkpoint.json")
+                )
+            assert got_files == expect
+            with open(os.path.join(outdir, "summary_stats.json")) as f:
+                summary_stats[keep, tmpdir] = json.load(f)
+            subprocess.check_output(f"rm -r {outdir}", shell=True)
+
+    assert len(summary_stats) == 6
+    for stats in summary_stats.values():
+        assert stats == summary_stats["all", None]
+    os.unlink(tmp_vcf)
+    os.rmdir(tmp_dir)
+
+
+def test_evaluate_vcf_with_filter_policies():
+    truth_fasta = os.path.join(data_dir, "evaluate_multi_sample_vcf.truth.fa")
+    truth_vcf = os.path.join(data_dir, "evaluate_multi_sample_vcf.truth.vcf")
+    ref_fasta = os.path.join(data_dir, "evaluate_multi_sample_vcf.ref.fa")
+    vcf_to_eval = os.path.join(data_dir, "evaluate_multi_sample_vcf.to_eval.vcf")
+    tmp_vcf = "tmp.vcf_evaluate.evaluate_vcf_with_filter_policies.vcf"
+    tmp_out = "tmp.vcf_evaluate.evaluate_vcf_with_filter_policies.out"
+    subprocess.check_output(f"rm -rf {tmp_vcf} {tmp_out}", shell=True)
+    subprocess.check_output(f"cut -f 1-10 {vcf_to_eval} > {tmp_vcf}", shell=True)
+    filter_policies = {"pass": {"PASS"}, "all": None}
+    vcf_evaluate.evaluate_vcf(
+        tmp_vcf,
+        ref_fasta,
+        truth_fasta,
+        100,
+        tmp_out,
+        truth_vcf=truth_vcf,
+        filter_policies=filter_policies,
+    )
+    with open(os.path.join(tmp_out, "summary_stats.json")) as f:
+        got_stats = json.load(f)["Filter_policies"]
+    assert set(got_stats) == {"pass", "all"}
+
+    # Each policy should get the same results as running with filter_pass
+    for name, filter_pass in filter_policies.items():
+        single_out = f"{tmp_out}.{name}"
+        vcf_evaluate.evaluate_vcf(
+            tmp_vcf,
+            ref_fasta,
+            truth_fasta,
+            100,
+            single_out,
+            truth_vcf=truth_vcf,
+            force=True,
+            filter_pass=filter_pass,
+        )
+        with open(os.path.join(single_out, "summary_stats.json")) as f:
+            assert got_stats[name] == json.load(f)
+        assert utils.vcf_records_are_the_same(
+            os.path.join(tmp_out, "filter_policies", name, "precision.vcf"),
+            os.path.join(single_out, "precision.vcf"),
+        )
+        subprocess.check_output(f"rm -r {single_out}", shell=True)
+
+    assert got_stats["pass"] != got_stats["all"]
+    with pytest.raises(Exception):
+        vcf_evaluate.evaluate_vcf(
+            tmp_vcf,
+            ref_fasta,
+            truth_fasta,
+            100,
+            tmp_out,
+            truth_vcf=truth_vcf,
+            force=True,
+            filter_pass={"PASS"},
+            filter_policies=filter_policies,
+        )
+    # Policy names are used as directory names
+    subprocess.check_output(f"rm -r {tmp_out}", shell=True)
+    for bad_name in ".", "..", "../pass", "pass/all":
+        with pytest.raises(Exception):
+            vcf_evaluate.evaluate_vcf(
+                tmp_vcf,
+                ref_fasta,
+                truth_fasta,
+                100,
+                tmp_out,
+                truth_vcf=truth_vcf,
+                filter_policies={bad_name: None},
+            )
+        assert not os.path.exists(tmp_out)
+    os.unlink(tmp_vcf)
+
+
+def test_evaluate_vcf_against_truths():
+    truth_fasta = os.path.join(data_dir, "evaluate_multi_sample_vcf.truth.fa")
+    truth_vcf = os.path.join(data_dir, "evaluate_multi_sample_vcf.truth.vcf")
+    truth_mask = os.path.join(data_dir, "evaluate_vcf_against_truths.truth_mask.bed")
+    ref_fasta = os.path.join(data_dir, "evaluate_multi_sample_vcf.ref.fa")
+    vcf_to_eval = os.path.join(data_dir, "evaluate_multi_sample_vcf.to_eval.vcf")
+    tmp_vcf = "tmp.vcf_evaluate.evaluate_vcf_against_truths.vcf"
+    tmp_out = "tmp.vcf_evaluate.evaluate_vcf_against_truths.out"
+    subprocess.check_output(f"rm -rf {tmp_vcf} {tmp_out}", shell=True)
+    subprocess.check_output(f"cut -f 1-10 {vcf_to_eval} > {tmp_vcf}", shell=True)
+    # Use the same truth genome twice, but masked for one of them, so that
+    # the results are different
+    names = ["t1", "t2"]
+    truth_masks = {"t1": None, "t2": truth_mask}
+    vcf_evaluate.evaluate_vcf_against_truths(
+        tmp_vcf,
+        ref_fasta,
+        {x: truth_fasta for x in names},
+        100,
+        tmp_out,
+        truth_vcfs={x: truth_vcf for x in names},
+        truth_mask_bed_files=truth_masks,
+        threads=2,
+    )
+    with open(os.path.join(tmp_out, "summary_stats.json")) as f:
+        got_stats = json.load(f)
+
+    # Each truth should get the same results as running evaluate_vcf()
+    for name in names:
+        single_out = f"{tmp_out}.{name}"
+        vcf_evaluate.evaluate_vcf(
+            tmp_vcf,
+            ref_fasta,
+            truth_fasta,
+            100,
+            single_out,
+            truth_vcf=truth_vcf,
+            truth_mask_bed_file=truth_masks[name],
+        )
+        with open(os.path.join(single_out, "summary_stats.json")) as f:
+            assert got_stats["Truths"][name] == json.load(f)
+        for filename in "precision.vcf", "summary_stats.json":
+            assert filecmp.cmp(
+                os.path.join(tmp_out, "truths", name, filename),
+                os.path.join(single_out, filename),
+                shallow=False,
+            )
+        subprocess.check_output(f"rm -r {single_out}", shell=True)
+
+    t1_stats = got_stats["Truths"]["t1"]
+    t2_stats = got_stats["Truths"]["t2"]
+    assert t1_stats != t2_stats
+    consensus = got_stats["Consensus"]
+    assert consensus["Precision"]["MASKED"] > 0
+    assert consensus["Precision"]["TP_in_some_truths"] == 0
+    for prec_or_recall in "Precision", "Recall":
+        values = [t1_stats[prec_or_recall], t2_stats[prec_or_recall]]
+        got = consensus[prec_or_recall]
+        assert got["Min"] == min(x[prec_or_recall] for x in values)
+        assert got["Max"] == max(x[prec_or_recall] for x in values)
+    os.unlink(tmp_vcf)
+    subprocess.check_output(f"rm -r {tmp_out}", shell=True)
+
+
+def test_split_into_shards():
+    records = [
+        vcf_record.VcfRecord(f"{ctg}\t{pos + 1}\t.\tA\tG\t.\tPASS\t.\tGT\t1/1")
+        for ctg, pos in [
+            ("a", 1),
+            ("a", 5),
+            ("a", 5),
+            ("a", 9),
+            ("b", 2),
+            ("c", 3),
+            ("c", 4),
+            ("c", 8),
+        ]
+    ]
+    ref_seqs = {"a": "A" * 20, "b": "A" * 10, "x": "A", "c": "A" * 30}
+    assert vcf_evaluate._split_into_shards(records, ref_seqs, 1, "window") == [
+        [("a", 0, 20), ("b", 0, 10), ("c", 0, 30)]
+    ]
+    assert vcf_evaluate._split_into_shards(records, ref_seqs, 4, "window") == [
+        [("a", 0, 5)],
+        [("a", 5, 20)],
+        [("b", 0, 10), ("c", 0, 4)],
+        [("c", 4, 30)],
+    ]
+    assert vcf_evaluate._split_into_shards(records, ref_seqs, 10, "window") == [
+        [("a", 0, 5)],
+        [("a", 5, 9)],
+        [("a", 9, 20)],
+        [("b", 0, 10)],
+        [("c", 0, 4)],
+        [("c", 4, 8)],
+        [("c", 8, 30)],
+    ]
+    assert vcf_evaluate._split_into_shards(records, ref_seqs, 2, "contig") == [
+        [("a", 0, 20)],
+        [("b", 0, 10), ("c", 0, 30)],
+    ]
+    assert vcf_evaluate._split_into_shards(records, ref_seqs, 10, "contig") == [
+        [("a", 0, 20)],
+        [("c", 0, 30)],
+        [("b", 0, 10)],
+    ]
+    assert vcf_evaluate._split_into_shards([], ref_seqs, 2, "window") == [[]]
+
+    find_shard = vcf_evaluate._shard_finder([[("a", 0, 5)], [("a", 5, 20)]])
+    assert [find_shard(x) for x in records] == [0, 1, 1, 1, None, None, None, None]
+
+
+def test_scatter_shard_gather():
+    truth_fasta = os.path.join(data_dir, "evaluate_multi_sample_vcf.truth.fa")
+    truth_vcf = os.path.join(data_dir, "evaluate_multi_sample_vcf.truth.vcf")
+    ref_fasta = os.path.join(data_dir, "evaluate_multi_sample_vcf.ref.fa")
+    ref_mask = os.path.join(data_dir, "evaluate_vcf_tmpdir_and_keep.ref_mask.bed")
+    vcf_to_eval = os.path.join(data_dir, "evaluate_multi_sample_vcf.to_eval.vcf")
+    tmp_prefix = "tmp.vcf_evaluate.scatter_shard_gather"
+    tmp_vcf = f"{tmp_prefix}.vcf"
+    serial_out = f"{tmp_prefix}.serial"
+    scatter_out = f"{tmp_prefix}.scatter"
+    gather_out = f"{tmp_prefix}.gather"
+    subprocess.check_output(f"rm -rf {tmp_prefix}.*", shell=True)
+    subprocess.check_output(f"cut -f 1-10 {vcf_to_eval} > {tmp_vcf}", shell=True)
+    # Small flank length, so that the variants near the edges of the shards
+    # need variants from the neighbouring shards to make their probes.
+    # With local probe mapping, each shard needs all the calls to know where
+    # its truth variants are in the genome with the calls applied
+    for local_probe_mapping in False, True:
+        subprocess.check_output(
+            f"rm -rf {serial_out} {scatter_out} {gather_out} {tmp_prefix}.shard.*",
+            shell=True,
+        )
+        vcf_evaluate.evaluate_vcf(
+            tmp_vcf,
+            ref_fasta,
+            truth_fasta,
+            20,
+            serial_out,
+            truth_vcf=truth_vcf,
+            ref_mask_bed_file=ref_mask,
+            local_probe_mapping=local_probe_mapping,
+        )
+        vcf_evaluate.scatter_vcf_eval(
+            tmp_vcf,
+            ref_fasta,
+            truth_fasta,
+            20,
+            scatter_out,
+            3,
+            truth_vcf=truth_vcf,
+            ref_mask_bed_file=ref_mask,
+            local_probe_mapping=local_probe_mapping,
+        )
+        shard_outs = []
+        for i in range(3):
+            shard_outs.append(f"{tmp_prefix}.shard.{i}")
+            manifest = os.path.join(scatter_out, "shards", str(i), "manifest.json")
+            with open(manifest) as f:
+                assert json.load(f)["local_probe_mapping"] == local_probe_mapping
+            with mock.patch.object(
+                recall, "mutated_ref_windows", wraps=recall.mutated_ref_windows
+            ) as windows:
+                vcf_evaluate.evaluate_vcf_shard(manifest, shard_outs[-1])
+            assert windows.called == local_probe_mapping
+
+        with pytest.raises(Exception):
+            vcf_evaluate.gather_vcf_eval(scatter_out, shard_outs[:2], gather_out)
+        vcf_evaluate.gather_vcf_eval(scatter_out, shard_outs[::-1], gather_out)
+        for filename in [
+            "summary_stats.json",
+            "precision.vcf",
+            os.path.join("recall", "recall.vcf.masked.vcf"),
+        ]:
+            assert filecmp.cmp(
+                os.path.join(serial_out, filename),
+                os.path.join(gather_out, filename),
+                shallow=False,
+            )
+    subprocess.check_output(f"rm -r {tmp_prefix}.*", shell=True)
+
+
+def test_evaluate_vcf_resume():
+    truth_fasta = os.path.join(data_dir, "evaluate_multi_sample_vcf.truth.fa")
+    truth_vcf = os.path.join(data_dir, "evaluate_multi_sample_vcf.truth.vcf")
+    ref_fasta = os.path.join(data_dir, "evaluate_multi_sample_vcf.ref.fa")
+    ref_mask = os.path.join(data_dir, "evaluate_vcf_tmpdir_and_keep.ref_mask.bed")
+    vcf_to_eval = os.path.join(data_dir, "evaluate_multi_sample_vcf.to_eval.vcf")
+    tmp_vcf = "tmp.vcf_evaluate.evaluate_vcf_resume.vcf"
+    tmp_out = "tmp.vcf_evaluate.evaluate_vcf_resume.out"
+    subprocess.check_output(f"rm -rf {tmp_vcf} {tmp_out}", shell=True)
+    subprocess.check_output(f"cut -f 1-10 {vcf_to_eval} > {tmp_vcf}", shell=True)
+
+    def run():
+        vcf_evaluate.evaluate_vcf(
+            tmp_vcf,
+            ref_fasta,
+            truth_fasta,
+            100,
+            tmp_out,
+            truth_vcf=truth_vcf,
+            ref_mask_bed_file=ref_mask,
+            resume=True,
+        )
+        with open(os.path.join(tmp_out, "summary_stats.json")) as f:
+            return json.load(f)
+
+    expect_stats = run()
+    result_files = [
+        os.path.join(tmp_out, "precision.vcf"),
+        os.path.join(tmp_out, "recall", "recall.vcf.masked.vcf"),
+    ]
+    mtimes = [os.stat(x).st_mtime_ns for x in result_files]
+    # Stages that are skipped should give back the same stats, without
+    # making their files again
+    assert run() == expect_stats
+    assert [os.stat(x).st_mtime_ns for x in result_files] == mtimes
+
+    # The genome with the calls applied is made again, using the filtered
+    # calls from the file made by the (skipped) precision stage
+    os.unlink(os.path.join(tmp_out, "recall", "ref_with_mutations_added.fa"))
+    assert run() == expect_stats
+    assert os.stat(result_files[0]).st_mtime_ns == mtimes[0]
+    os.unlink(tmp_vcf)
+    subprocess.check_output(f"rm -r {tmp_out}", shell=True)
+
+
+def test_evaluate_vcf_with_strata():
+    truth_fasta = os.path.join(data_dir, "evaluate_multi_sample_vcf.truth.fa")
+    truth_vcf = os.path.join(data_dir, "evaluate_multi_sample_vcf.truth.vcf")
+    ref_fasta = os.path.join(data_dir, "evaluate_multi_sample_vcf.ref.fa")
+    vcf_to_eval = os.path.join(data_dir, "evaluate_multi_sample_vcf.to_eval.vcf")
+    strata_bed_files = {
+        x: os.path.join(data_dir, f"evaluate_vcf_with_strata.{x}.bed")
+        for x in ("all", "some", "none")
+    }
+    tmp_vcf = "tmp.vcf_evaluate.evaluate_vcf_with_strata.vcf"
+    tmp_out = "tmp.vcf_evaluate.evaluate_vcf_with_strata.out"
+    subprocess.check_output(f"rm -rf {tmp_vcf} {tmp_out}", shell=True)
+    subprocess.check_output(f"cut -f 1-10 {vcf_to_eval} > {tmp_vcf}", shell=True)
+    vcf_evaluate.evaluate_vcf(
+        tmp_vcf,
+        ref_fasta,
+        truth_fasta,
+        100,
+        tmp_out,
+        truth_vcf=truth_vcf,
+        strata_bed_files=strata_bed_files,
+    )
+    with open(os.path.join(tmp_out, "summary_stats.json")) as f:
+        got = json.load(f)
+    assert set(got["Strata"]) == {"all", "some", "none"}
+    for key in "Precision", "Recall":
+        assert got["Strata"]["all"][key] == got[key]
+        assert got["Strata"]["none"][key][key] == 0
+
+    # Stats for the regions should be the same as for the records that are
+    # in the regions
+    mask = utils.load_mask_bed_file(strata_bed_files["some"])
+    for key, vcf_file in (
+        ("Precision", "precision.vcf"),
+        ("Recall", os.path.join("recall", "recall.vcf")),
+    ):
+        _, records = vcf_record.vcf_file_to_list(os.path.join(tmp_out, vcf_file))
+        records = [
+            x for x in records if utils.ref_is_in_mask(x.CHROM, x.POS, x.REF, mask)
+        ]
+        assert len(records) > 0
+        expect = {
+            key: vcf_stats.summary_stats_from_per_record_stats(
+                vcf_stats.per_record_stats_from_vcf_records(records),
+                for_recall=key == "Recall",
+            )
+        }
+        vcf_evaluate._add_overall_precision_and_recall_to_summary_stats(expect)
+        assert got["Strata"]["some"][key] == expect[key]
+
+    # Resuming with the same BED files, but different names, must not reuse
+    # the stats of the first run
+    swapped = {
+        "all": strata_bed_files["none"],
+        "some": strata_bed_files["some"],
+        "none": strata_bed_files["all"],
+    }
+    vcf_evaluate.evaluate_vcf(
+        tmp_vcf,
+        ref_fasta,
+        truth_fasta,
+        100,
+        tmp_out,
+        truth_vcf=truth_vcf,
+        resume=True,
+        strata_bed_files=swapped,
+    )
+    with open(os.path.join(tmp_out, "summary_stats.json")) as f:
+        got_swapped = json.load(f)
+    assert got_swapped["Strata"]["all"] == got["Strata"]["none"]
+    assert got_swapped["Strata"]["none"] == got["Strata"]["all"]
+
+    # Filter policies use the same code for the stats, so should get the
+    # same strata
+    policies_out = f"{tmp_out}.policies"
+    vcf_evaluate.evaluate_vcf(
+        tmp_vcf,
+        ref_fasta,
+        truth_fasta,
+        100,
+        policies_out,
+        truth_vcf=truth_vcf,
+        force=True,
+        filter_policies={"all": None},
+        strata_bed_files=strata_bed_files,
+    )
+    with open(os.path.join(policies_out, "summary_stats.json")) as f:
+        assert json.load(f)["Filter_policies"]["all"] == got
+    subprocess.check_output(f"rm -r {policies_out}", shell=True)
+    os.unlink(tmp_vcf)
+    subprocess.check_output(f"rm -r {tmp_out}", shell=True)
+
+
+def test_evaluate_vcf_probe_hit_cache_only_has_truth_hits():
+    truth_fasta = os.path.join(data_dir, "evaluate_multi_sample_vcf.truth.fa")
+    truth_vcf = os.path.join(data_dir, "evaluate_multi_sample_vcf.truth.vcf")
+    ref_fasta = os.path.join(data_dir, "evaluate_multi_sample_vcf.ref.fa")
+    vcf_to_eval = os.path.join(data_dir, "evaluate_multi_sample_vcf.to_eval.vcf")
+    tmp_vcf = "tmp.vcf_evaluate.probe_hit_cache.vcf"
+    tmp_db = "tmp.vcf_evaluate.probe_hit_cache.db"
+    tmp_out = "tmp.vcf_evaluate.probe_hit_cache.out"
+    subprocess.check_output(f"rm -rf {tmp_vcf} {tmp_db} {tmp_out}", shell=True)
+    subprocess.check_output(f"cut -f 1-10 {vcf_to_eval} > {tmp_vcf}", shell=True)
+    vcf_evaluate.evaluate_vcf(
+        tmp_vcf,
+        ref_fasta,
+        truth_fasta,
+        100,
+        tmp_out,
+        truth_vcf=truth_vcf,
+        probe_hit_cache=tmp_db,
+    )
+    # Hits to the mutated reference used for recall are no use in another
+    # run, so only the precision hits to the truth genome are cached
+    conn = sqlite3.connect(tmp_db)
+    namespaces = [x[0] for x in conn.execute("SELECT DISTINCT namespace FROM hits")]
+    conn.close()
+    assert namespaces == [
+        probe_hit_cache.cache_namespace(truth_fasta, probe_mapping.probe_mapper_options)
+    ]
+    subprocess.check_output(f"rm -r {tmp_vcf} {tmp_db} {tmp_out}", shell=True)
@@ -0,0 +1,54 @@
+import os
+import pytest
+
+from cluster_vcf_records import vcf_record as cluster_vcf_record
+
+from varifier import vcf_record
+
+this_dir = os.path.dirname(os.path.abspath(__file__))
+data_dir = os.path.join(this_dir, "data", "vcf_record")
+
+
+def test_vcf_record():
+    line = "ref\t42\tid1\tAT\tA,G\t30\tF1;F2\tKEY1=1;KEY2\tGT:DP\t1/1:10\n"
+    record = vcf_record.VcfRecord(line)
+    expect = cluster_vcf_record.VcfRecord(line)
+    for attribute in ["CHROM", "POS", "ID", "REF", "ALT", "QUAL", "FILTER", "INFO"]:
+        assert getattr(record, attribute) == getattr(expect, attribute)
+    assert record.FORMAT == expect.FORMAT
+    assert record.ref_end_pos() == 42
+    assert str(record) == line.rstrip()
+
+    record.set_format_key_value("VFR_RESULT", "TP")
+    record.set_format_key_value("VFR_ED_RA", "1")
+    assert str(record).endswith("\tGT:DP:VFR_RESULT:VFR_ED_RA\t1/1:10:TP:1")
+    assert record.FORMAT["VFR_RESULT"] == "TP"
+    record.set_format_key_value("VFR_RESULT", "FP")
+    assert str(record).endswith("\tGT:DP:VFR_RESULT:VFR_ED_RA\t1/1:10:FP:1")
+    record.set_format_key_value("DP", "11")
+    assert str(record).endswith("\tGT:DP:VFR_RESULT:VFR_ED_RA\t1/1:11:FP:1")
+
+    record.FORMAT = {"GT": "1/1"}
+    assert str(record).endswith("\tKEY1=1;KEY2\tGT\t1/1")
+
+    record = vcf_record.VcfRecord("ref\t42\t.\tA\tG\t.\t.\t.")
+    assert record.QUAL is None
+    assert record.FILTER == set()
+    assert record.INFO == {}
+    assert record.FORMAT == {}
+    record.set_format_key_value("VFR_RESULT", "TP")
+    assert str(record) == "ref\t42\t.\tA\tG\t.\t.\t.\tVFR_RESULT\tTP"
+
+    with pytest.raises(ValueError):
+        vcf_record.VcfRecord("ref\t0\t.\tA\tG\t.\t.\t.")
+
+
+def test_vcf_file_to_list():
+    infile = os.path.join(data_dir, "vcf_file_to_list.vcf")
+    header_lines, records = vcf_record.vcf_file_to_list(infile)
+    assert header_lines == [
+        "##fileformat=VCFv4.2",
+        "#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tsample",
+    ]
+    assert [(x.CHROM, x.POS) for x in records] == [("ref1", 41), ("ref2", 9)]
+    assert list(vcf_record.vcf_file_records(infile)) == records
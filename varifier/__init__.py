@@ -1,22 +1,50 @@
-from pkg_resources import get_distribution
-
-try:
-    __version__ = get_distribution("varifier").version
-except:
-    __version__ = "local"
-
+import importlib
 
 __all__ = [
+    "benchmark",
+    "checkpoint",
     "dnadiff",
     "edit_distance",
     "probe",
+    "probe_hit_cache",
     "probe_mapping",
     "recall",
+    "registry",
+    "scratch",
+    "server",
     "tasks",
+    "truth_probes",
     "truth_variant_finding",
     "utils",
     "vcf_evaluate",
+    "vcf_record",
     "vcf_stats",
 ]
 
-from varifier import *
+
+def _get_version():
+    # importlib.metadata is itself slow to import, so only use it when the
+    # version is wanted
+    import importlib.metadata
+
+    try:
+        return importlib.metadata.version("varifier")
+    except importlib.metadata.PackageNotFoundError:
+        return "local"
+
+
+# Submodules are only imported when first used, because some of them import
+# dependencies that are slow to load (pysam, pymummer, Bio, ...). This means
+# that eg "varifier --help" does not load any of them, and each subcommand
+# only loads what it needs
+def __getattr__(name):
+    if name == "__version__":
+        globals()["__version__"] = _get_version()
+        return globals()["__version__"]
+    if name in __all__:
+        return importlib.import_module(f"varifier.{name}")
+    raise AttributeError(f"module 'varifier' has no attribute '{name}'")
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__ + ["__version__"])
@@ -5,6 +5,24 @@ import logging
 import varifier
 
 
+class _VersionAction(argparse.Action):
+    """Same as argparse's "version" action, except that the version is only
+    looked up when the option is used, because that is slow"""
+
+    def __init__(self, option_strings, dest, **kwargs):
+        super().__init__(
+            option_strings,
+            dest,
+            nargs=0,
+            default=argparse.SUPPRESS,
+            help="show program's version number and exit",
+        )
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        print(varifier.__version__)
+        parser.exit()
+
+
 def main(args=None):
     parser = argparse.ArgumentParser(
         prog="varifier",
@@ -12,7 +30,7 @@ def main(args=None):
         description="varifier: variant call adjudication",
     )
 
-    parser.add_argument("--version", action="version", version=varifier.__version__)
+    parser.add_argument("--version", action=_VersionAction)
     parser.add_argument(
         "--debug",
         help="More verbose logging, and less file cleaning",
@@ -49,14 +67,60 @@ def main(args=None):
         default=100,
         metavar="INT",
     )
+    subparser_make_truth_vcf.add_argument(
+        "--probe_hit_cache",
+        help="SQLite file of probe mapping hits, which is made if it does not exist. Probes already in the file (eg from a previous run using the same truth genome) are not mapped again",
+        metavar="FILENAME",
+    )
+    subparser_make_truth_vcf.add_argument(
+        "--probe_hit_cache_size",
+        help="Maximum number of probes to keep in the --probe_hit_cache file. The least recently used probes are removed [%(default)s]",
+        type=int,
+        default=1000000,
+        metavar="INT",
+    )
+    subparser_make_truth_vcf.add_argument(
+        "--local_probe_mapping",
+        help="When checking candidate truth variants, map their probes to only the region of the truth genome where the alignment of the truth to the reference puts them. Probes are mapped to the whole truth genome if that region is not known or the probe does not map there. A probe then only has to map uniquely in its region, so variants in repeats elsewhere in the genome can be evaluated",
+        action="store_true",
+    )
+    subparser_make_truth_vcf.add_argument(
+        "--max_flank_length",
+        help="Use adaptive probe flank lengths. Probes start with --flank_length either side of the variant, and for variants where the probe does not map uniquely to the truth genome (eg in repeats), the flank length is doubled until it maps or this length is reached. Suggest using with a smaller --flank_length, eg 50. Default is to only use --flank_length",
+        type=int,
+        metavar="INT",
+    )
     subparser_make_truth_vcf.add_argument(
         "--truth_mask",
         help="BED file of truth genome regions to mask. Any variants in the VCF matching to the mask are flagged and will not count towards precision or recall if the output VCF is used with vcf_eval",
         metavar="FILENAME",
     )
+    subparser_make_truth_vcf.add_argument(
+        "--threads",
+        help="Number of threads to use when mapping the truth genome to the reference [%(default)s]",
+        type=int,
+        default=1,
+        metavar="INT",
+    )
+    subparser_make_truth_vcf.add_argument(
+        "--resume",
+        help="If outdir already exists, resume a previous run, skipping any stages that were already completed using the same input files and options. Needs --keep all",
+        action="store_true",
+    )
+    subparser_make_truth_vcf.add_argument(
+        "--tmpdir",
+        help="Write intermediate files to a new directory inside this directory (eg on a local disk), instead of to outdir. When finished, the files chosen by --keep are moved to outdir. Cannot be used with --resume",
+        metavar="DIRNAME",
+    )
+    subparser_make_truth_vcf.add_argument(
+        "--keep",
+        help="Which files to keep in outdir. all: every file, including intermediate files. final: only the final VCF files and results. Intermediate files are deleted as soon as they have been used. none: only the results (04.truth.vcf) [%(default)s]",
+        choices=varifier.scratch.KEEP_CHOICES,
+        default="all",
+    )
 
     subparser_make_truth_vcf.add_argument("outdir", help="Name of output directory")
-    subparser_make_truth_vcf.set_defaults(func=varifier.tasks.make_truth_vcf.run)
+    subparser_make_truth_vcf.set_defaults(task="make_truth_vcf")
 
     # ------------------------ vcf_eval ----------------------------------------
     subparser_vcf_eval = subparsers.add_parser(
@@ -73,14 +137,72 @@ def main(args=None):
         default=100,
         metavar="INT",
     )
+    subparser_vcf_eval.add_argument(
+        "--probe_hit_cache",
+        help="SQLite file of probe mapping hits, which is made if it does not exist. Probes already in the file (eg from a previous run using the same truth genome) are not mapped again",
+        metavar="FILENAME",
+    )
+    subparser_vcf_eval.add_argument(
+        "--probe_hit_cache_size",
+        help="Maximum number of probes to keep in the --probe_hit_cache file. The least recently used probes are removed [%(default)s]",
+        type=int,
+        default=1000000,
+        metavar="INT",
+    )
+    subparser_vcf_eval.add_argument(
+        "--local_probe_mapping",
+        help="When making the truth VCF for recall (ie --truth_vcf not used), map the probes of candidate truth variants to only the region of the truth genome where the alignment of the truth to the reference puts them. When calculating recall, map the probes of truth variants to only the region of the reference with the calls applied where they should be, which is known from the changes made by the calls. Probes are mapped to the whole genome if that region is not known or the probe does not map there. A probe then only has to map uniquely in its region, so variants in repeats elsewhere in the genome can be evaluated",
+        action="store_true",
+    )
+    subparser_vcf_eval.add_argument(
+        "--max_flank_length",
+        help="Use adaptive probe flank lengths. Probes start with --flank_length either side of the variant, and for variants where the probe does not map uniquely to the truth genome (eg in repeats), the flank length is doubled until it maps or this length is reached. Suggest using with a smaller --flank_length, eg 50. Default is to only use --flank_length",
+        type=int,
+        metavar="INT",
+    )
     subparser_vcf_eval.add_argument(
         "--force", help="Replace outdir if it already exists", action="store_true"
     )
+    subparser_vcf_eval.add_argument(
+        "--threads",
+        help="Number of threads to use when mapping the truth genome to the reference [%(default)s]",
+        type=int,
+        default=1,
+        metavar="INT",
+    )
+    subparser_vcf_eval.add_argument(
+        "--resume",
+        help="If outdir already exists, resume a previous run, skipping any stages that were already completed using the same input files and options. Needs --keep all",
+        action="store_true",
+    )
+    subparser_vcf_eval.add_argument(
+        "--tmpdir",
+        help="Write intermediate files to a new directory inside this directory (eg on a local disk), instead of to outdir. When finished, the files chosen by --keep are moved to outdir. Cannot be used with --resume",
+        metavar="DIRNAME",
+    )
+    subparser_vcf_eval.add_argument(
+        "--keep",
+        help="Which files to keep in outdir. all: every file, including intermediate files. final: only the final VCF files (including the calls excluded by filtering) and results. Intermediate files are deleted as soon as they have been used. none: only the results (summary_stats.json) [%(default)s]",
+        choices=varifier.scratch.KEEP_CHOICES,
+        default="all",
+    )
     subparser_vcf_eval.add_argument(
         "--filter_pass",
         help="Defines how to handle FILTER column of input VCF file. Comma-separated list of filter names. A VCF line is kept if any of its FILTER entries are in the provided list. Put '.' in the list to keep records where the filter column is '.'. Default behaviour is to ignore the filter column and use all records",
         metavar="FILTER1[,FILTER2[,...]]",
     )
+    subparser_vcf_eval.add_argument(
+        "--filter_policy",
+        help="Evaluate the VCF file using more than one way of filtering it, sharing the probe mapping. Use this option once per filter policy. Each policy has a name, and optionally a list of filters that are used in the same way as --filter_pass. If there is no list of filters (ie just NAME), then the FILTER column is ignored for that policy. Results for each policy are written to outdir/filter_policies/NAME/, and summary_stats.json has the stats for all policies. Cannot be used with --filter_pass or --samples",
+        action="append",
+        metavar="NAME[=FILTER1[,FILTER2[,...]]]",
+    )
+    subparser_vcf_eval.add_argument(
+        "--stratify",
+        help="Also report the results for the variants in the regions of a BED file, in summary_stats.json. Use this option once per set of regions. Each set has a NAME, which is used in summary_stats.json. A variant is in the set if its REF allele intersects any region in the BED file. Precision uses the reference coords of the called variants, and recall uses the reference coords of the truth variants. Cannot be used with --samples or more than one truth genome",
+        action="append",
+        metavar="NAME=BED",
+    )
     subparser_vcf_eval.add_argument(
         "--ref_mask",
         help="BED file of ref regions to mask. Any variants in the VCF overlapping the mask are removed at the start of the pipeline",
@@ -102,18 +224,326 @@ def main(args=None):
         type=int,
         metavar="INT",
     )
+    subparser_vcf_eval.add_argument(
+        "--samples",
+        help="Comma-separated list of names of samples in vcf_file to evaluate, reading vcf_file only once. truth_fasta (and --truth_vcf if used) can then be one file used for all samples, or a comma-separated list of files, one per sample. Results for each sample are written to outdir/<sample name>/. Default is to evaluate the first sample only",
+        metavar="SAMPLE1[,SAMPLE2[,...]]",
+    )
+    subparser_vcf_eval.add_argument(
+        "--truth_names",
+        help="When not using --samples, truth_fasta can be a comma-separated list of FASTA files of more than one truth genome (eg different assemblies of the same sample). The VCF file is then evaluated against each of them, making the probes only once. --truth_vcf and --truth_mask can be one file for all truths, or a comma-separated list of files, one per truth. This option gives the names of the truths, used for the output directories outdir/truths/<name>/. Default is the FASTA filenames without their directories",
+        metavar="NAME1[,NAME2[,...]]",
+    )
     subparser_vcf_eval.add_argument(
         "--use_ref_calls",
         help="Include 0/0 genotype calls when calculating TPs and precision. By default they are ignored",
         action="store_true",
     )
-    subparser_vcf_eval.add_argument("truth_fasta", help="FASTA file of truth genome")
+    subparser_vcf_eval.add_argument(
+        "truth_fasta",
+        help="FASTA file of truth genome. Can be a comma-separated list of files (see --samples and --truth_names)",
+    )
     subparser_vcf_eval.add_argument(
         "vcf_fasta", help="FASTA file corresponding to vcf_file"
     )
     subparser_vcf_eval.add_argument("vcf_in", help="VCF file to evaluate")
     subparser_vcf_eval.add_argument("outdir", help="Name of output directory")
-    subparser_vcf_eval.set_defaults(func=varifier.tasks.vcf_eval.run)
+    subparser_vcf_eval.set_defaults(task="vcf_eval")
+
+    # ------------------------ vcf_eval_scatter --------------------------------
+    subparser_vcf_eval_scatter = subparsers.add_parser(
+        "vcf_eval_scatter",
+        help="Split vcf_eval into shards, to run on different machines",
+        usage="varifier vcf_eval_scatter [options] <truth_fasta> <vcf_fasta> <vcf_file> <outdir>",
+        description="Does the same as vcf_eval up to the probe mapping (filtering the VCF file, and making the truth VCF if --truth_vcf is not used), then splits the variants into shards. Each shard is written to outdir/shards/N/, which has a manifest.json file to use with vcf_eval_shard. Use vcf_eval_gather to combine the results of the shards",
+    )
+    subparser_vcf_eval_scatter.add_argument(
+        "--shards",
+        help="Number of shards to make. Fewer shards are made if there are not enough variants (or contigs, with --split_by contig) [%(default)s]",
+        type=int,
+        default=10,
+        metavar="INT",
+    )
+    subparser_vcf_eval_scatter.add_argument(
+        "--split_by",
+        help="How to split the variants. contig: each contig is in one shard. window: contigs can be split between shards, so that each shard has a similar number of variants. Variants near the edges of a shard are also put in the neighbouring shard, so that the probes are the same as in vcf_eval [%(default)s]",
+        choices=["contig", "window"],
+        default="window",
+    )
+    subparser_vcf_eval_scatter.add_argument(
+        "--flank_length",
+        help="Length of sequence to add either side of variant when making probe sequences [%(default)s]",
+        type=int,
+        default=100,
+        metavar="INT",
+    )
+    subparser_vcf_eval_scatter.add_argument(
+        "--max_flank_length",
+        help="Use adaptive probe flank lengths. Probes start with --flank_length either side of the variant, and for variants where the probe does not map uniquely to the truth genome (eg in repeats), the flank length is doubled until it maps or this length is reached. Suggest using with a smaller --flank_length, eg 50. Default is to only use --flank_length",
+        type=int,
+        metavar="INT",
+    )
+    subparser_vcf_eval_scatter.add_argument(
+        "--local_probe_mapping",
+        help="When making the truth VCF for recall (ie --truth_vcf not used), map the probes of candidate truth variants to only the region of the truth genome where the alignment of the truth to the reference puts them. Probes are mapped to the whole truth genome if that region is not known or the probe does not map there. A probe then only has to map uniquely in its region, so variants in repeats elsewhere in the genome can be evaluated",
+        action="store_true",
+    )
+    subparser_vcf_eval_scatter.add_argument(
+        "--probe_hit_cache",
+        help="SQLite file of probe mapping hits, which is made if it does not exist. Probes already in the file (eg from a previous run using the same truth genome) are not mapped again",
+        metavar="FILENAME",
+    )
+    subparser_vcf_eval_scatter.add_argument(
+        "--probe_hit_cache_size",
+        help="Maximum number of probes to keep in the --probe_hit_cache file. The least recently used probes are removed [%(default)s]",
+        type=int,
+        default=1000000,
+        metavar="INT",
+    )
+    subparser_vcf_eval_scatter.add_argument(
+        "--force", help="Replace outdir if it already exists", action="store_true"
+    )
+    subparser_vcf_eval_scatter.add_argument(
+        "--threads",
+        help="Number of threads to use when mapping the truth genome to the reference [%(default)s]",
+        type=int,
+        default=1,
+        metavar="INT",
+    )
+    subparser_vcf_eval_scatter.add_argument(
+        "--filter_pass",
+        help="Defines how to handle FILTER column of input VCF file. Comma-separated list of filter names. A VCF line is kept if any of its FILTER entries are in the provided list. Put '.' in the list to keep records where the filter column is '.'. Default behaviour is to ignore the filter column and use all records",
+        metavar="FILTER1[,FILTER2[,...]]",
+    )
+    subparser_vcf_eval_scatter.add_argument(
+        "--ref_mask",
+        help="BED file of ref regions to mask. Any variants in the VCF overlapping the mask are removed at the start of the pipeline",
+        metavar="FILENAME",
+    )
+    subparser_vcf_eval_scatter.add_argument(
+        "--truth_mask",
+        help="BED file of truth genome regions to mask. Any variants in the VCF matching to the mask are flagged and do not count towards precision or recall",
+        metavar="FILENAME",
+    )
+    subparser_vcf_eval_scatter.add_argument(
+        "--truth_vcf",
+        help="VCF file of variant calls between vcf_fasta and truth_fasta, where reference of this VCF file is truth_fasta. If provided, used to calculate recall",
+        metavar="FILENAME",
+    )
+    subparser_vcf_eval_scatter.add_argument(
+        "--max_recall_ref_len",
+        help="For recall, do not look for expected variants where REF length is more than this number. Default is no limit. This option will not work if you use --truth_vcf",
+        type=int,
+        metavar="INT",
+    )
+    subparser_vcf_eval_scatter.add_argument(
+        "--use_ref_calls",
+        help="Include 0/0 genotype calls when calculating TPs and precision. By default they are ignored",
+        action="store_true",
+    )
+    subparser_vcf_eval_scatter.add_argument(
+        "truth_fasta", help="FASTA file of truth genome"
+    )
+    subparser_vcf_eval_scatter.add_argument(
+        "vcf_fasta", help="FASTA file corresponding to vcf_file"
+    )
+    subparser_vcf_eval_scatter.add_argument("vcf_in", help="VCF file to evaluate")
+    subparser_vcf_eval_scatter.add_argument("outdir", help="Name of output directory")
+    subparser_vcf_eval_scatter.set_defaults(task="vcf_eval_scatter")
+
+    # ------------------------ vcf_eval_shard ----------------------------------
+    subparser_vcf_eval_shard = subparsers.add_parser(
+        "vcf_eval_shard",
+        help="Run one shard made by vcf_eval_scatter",
+        usage="varifier vcf_eval_shard [options] <manifest_json> <outdir>",
+        description="Run the probe mapping for one shard made by vcf_eval_scatter. Shards are independent of each other, and can be run on any machine that can read the files used by vcf_eval_scatter",
+    )
+    subparser_vcf_eval_shard.add_argument(
+        "--probe_hit_cache",
+        help="SQLite file of probe mapping hits, which is made if it does not exist. Probes already in the file (eg from a previous run using the same truth genome) are not mapped again",
+        metavar="FILENAME",
+    )
+    subparser_vcf_eval_shard.add_argument(
+        "--probe_hit_cache_size",
+        help="Maximum number of probes to keep in the --probe_hit_cache file. The least recently used probes are removed [%(default)s]",
+        type=int,
+        default=1000000,
+        metavar="INT",
+    )
+    subparser_vcf_eval_shard.add_argument(
+        "--force", help="Replace outdir if it already exists", action="store_true"
+    )
+    subparser_vcf_eval_shard.add_argument(
+        "manifest_json", help="manifest.json file of the shard"
+    )
+    subparser_vcf_eval_shard.add_argument("outdir", help="Name of output directory")
+    subparser_vcf_eval_shard.set_defaults(task="vcf_eval_shard")
+
+    # ------------------------ vcf_eval_gather ---------------------------------
+    subparser_vcf_eval_gather = subparsers.add_parser(
+        "vcf_eval_gather",
+        help="Combine the results of vcf_eval_shard",
+        usage="varifier vcf_eval_gather [options] <scatter_dir> <outdir> <shard_outdir> [shard_outdir ...]",
+        description="Combine the results of running vcf_eval_shard on every shard made by vcf_eval_scatter. The output files (including summary_stats.json) are the same as running vcf_eval",
+    )
+    subparser_vcf_eval_gather.add_argument(
+        "--force", help="Replace outdir if it already exists", action="store_true"
+    )
+    subparser_vcf_eval_gather.add_argument(
+        "scatter_dir", help="Output directory of vcf_eval_scatter"
+    )
+    subparser_vcf_eval_gather.add_argument("outdir", help="Name of output directory")
+    subparser_vcf_eval_gather.add_argument(
+        "shard_outdirs",
+        help="Output directories of vcf_eval_shard, one per shard, in any order",
+        nargs="+",
+        metavar="shard_outdir",
+    )
+    subparser_vcf_eval_gather.set_defaults(task="vcf_eval_gather")
+
+    # ------------------------ benchmark ---------------------------------------
+    subparser_benchmark = subparsers.add_parser(
+        "benchmark",
+        help="Measure run time and memory on synthetic genomes",
+        usage="varifier benchmark [options] <outdir>",
+        description="Make synthetic reference and truth genomes of different sizes, and run make_truth_vcf and vcf_eval on each one. Reports the time and peak memory of each step, the time of each stage, and how they scale with genome size, in outdir/benchmark.json. Does not need any input files or network access",
+    )
+    subparser_benchmark.add_argument(
+        "--genome_sizes",
+        help="Comma-separated list of genome sizes to test. Suffixes k, M, G can be used, eg 1M,4.4M [%(default)s]",
+        default="100k,1M",
+        metavar="SIZE[,SIZE,...]",
+    )
+    subparser_benchmark.add_argument(
+        "--snp_rate",
+        help="Number of SNPs per base in the truth genome [%(default)s]",
+        type=float,
+        default=0.001,
+        metavar="FLOAT",
+    )
+    subparser_benchmark.add_argument(
+        "--indel_rate",
+        help="Number of indels (1-10bp) per base in the truth genome [%(default)s]",
+        type=float,
+        default=0.0002,
+        metavar="FLOAT",
+    )
+    subparser_benchmark.add_argument(
+        "--sv_rate",
+        help="Number of structural variants (50-1000bp insertions and deletions) per base in the truth genome [%(default)s]",
+        type=float,
+        default=0.00001,
+        metavar="FLOAT",
+    )
+    subparser_benchmark.add_argument(
+        "--cluster_fraction",
+        help="Fraction of variants that are put close to (2-20bp from) the previous variant [%(default)s]",
+        type=float,
+        default=0.1,
+        metavar="FLOAT",
+    )
+    subparser_benchmark.add_argument(
+        "--repeat_fraction",
+        help="Fraction of the reference genome made of 1kb repeats, each with 4 copies [%(default)s]",
+        type=float,
+        default=0.05,
+        metavar="FLOAT",
+    )
+    subparser_benchmark.add_argument(
+        "--call_fraction",
+        help="Fraction of truth variants that are in the VCF file given to vcf_eval [%(default)s]",
+        type=float,
+        default=0.9,
+        metavar="FLOAT",
+    )
+    subparser_benchmark.add_argument(
+        "--false_call_rate",
+        help="Number of false SNP calls added to the VCF file given to vcf_eval, per truth variant [%(default)s]",
+        type=float,
+        default=0.1,
+        metavar="FLOAT",
+    )
+    subparser_benchmark.add_argument(
+        "--seed",
+        help="Seed for the random number generator [%(default)s]",
+        type=int,
+        default=42,
+        metavar="INT",
+    )
+    subparser_benchmark.add_argument(
+        "--flank_length",
+        help="Length of sequence to add either side of variant when making probe sequences [%(default)s]",
+        type=int,
+        default=100,
+        metavar="INT",
+    )
+    subparser_benchmark.add_argument(
+        "--max_flank_length",
+        help="Use adaptive probe flank lengths, up to this length. See vcf_eval --help",
+        type=int,
+        metavar="INT",
+    )
+    subparser_benchmark.add_argument(
+        "--threads",
+        help="Number of threads to use when mapping the truth genome to the reference [%(default)s]",
+        type=int,
+        default=1,
+        metavar="INT",
+    )
+    subparser_benchmark.add_argument(
+        "--force", help="Replace outdir if it already exists", action="store_true"
+    )
+    subparser_benchmark.add_argument("outdir", help="Name of output directory")
+    subparser_benchmark.set_defaults(task="benchmark")
+
+    # ------------------------ serve -------------------------------------------
+    subparser_serve = subparsers.add_parser(
+        "serve",
+        help="Run a server that evaluates VCF files, keeping genomes and indexes in memory",
+        usage="varifier serve [options] <--port INT|--socket FILENAME>",
+        description='Run a server that evaluates VCF files in the same way as vcf_eval. Reference and truth sequences, masks and probe mapping indexes are loaded the first time a job needs them, and then kept in memory for later jobs. A job is submitted with "POST /eval", where the body is a JSON object of options of varifier.vcf_evaluate.evaluate_vcf() (vcf_to_eval, vcf_ref_fasta and truth_ref_fasta are required; flank_length defaults to 100; options that delete or reuse files, such as force and resume, cannot be used; if outdir is not given then no files are kept). The response is the summary stats JSON. "GET /status" reports the jobs and what is loaded. Use truth_vcf in jobs, otherwise the truth VCF is made again by each job. Example: curl --unix-socket varifier.sock -d \'{"vcf_to_eval": "calls.vcf", "vcf_ref_fasta": "ref.fa", "truth_ref_fasta": "truth.fa", "truth_vcf": "truth.vcf"}\' http://localhost/eval',
+    )
+    subparser_serve.add_argument(
+        "--port",
+        help="Listen on this port, on localhost (127.0.0.1) only",
+        type=int,
+        metavar="INT",
+    )
+    subparser_serve.add_argument(
+        "--socket",
+        help="Listen on this unix socket file (instead of using --port)",
+        metavar="FILENAME",
+    )
+    subparser_serve.add_argument(
+        "--workers",
+        help="Number of jobs to run at the same time [%(default)s]",
+        type=int,
+        default=1,
+        metavar="INT",
+    )
+    subparser_serve.add_argument(
+        "--preload",
+        help="FASTA file(s) to load and index when the server starts, instead of when the first job uses them. Can be used more than once",
+        action="append",
+        metavar="FILENAME",
+    )
+    subparser_serve.add_argument(
+        "--preload_mask",
+        help="BED file(s) of masks to load when the server starts. Can be used more than once",
+        action="append",
+        metavar="FILENAME",
+    )
+    subparser_serve.add_argument(
+        "--tmpdir",
+        help="Directory for the output of jobs that have no outdir. Default is the system temporary directory",
+        metavar="DIRNAME",
+    )
+    subparser_serve.add_argument(
+        "--outdir",
+        help="Directory for the output of jobs that have an outdir. The outdir of a job must be the name of a new directory, which is made inside this directory. If not given, jobs cannot have an outdir",
+        metavar="DIRNAME",
+    )
+    subparser_serve.set_defaults(task="serve")
 
     args = parser.parse_args()
 
@@ -122,8 +552,9 @@ def main(args=None):
         format="%(asctime)s [%(levelname)s]: %(message)s", level=log_level
     )
 
-    if hasattr(args, "func"):
-        args.func(args)
+    if hasattr(args, "task"):
+        # Only import the modules needed by the task that is being run
+        getattr(varifier.tasks, args.task).run(args)
     else:
         parser.print_help()
 
@@ -0,0 +1,392 @@
+import concurrent.futures
+import json
+import logging
+import math
+import multiprocessing
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+
+import pyfastaq
+
+import varifier
+from varifier import checkpoint
+
+# Each byte of random data is turned into one of ACGT
+_random_byte_to_nucleotide = bytes.maketrans(bytes(range(256)), b"ACGT" * 64)
+
+_vcf_header_lines = [
+    "##fileformat=VCFv4.2",
+    '##FILTER=<ID=PASS,Description="All filters passed">',
+    '##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">',
+]
+
+
+def _random_seq(rng, length):
+    if length == 0:
+        return ""
+    # This is what rng.randbytes() does, but that needs python 3.9
+    random_bytes = rng.getrandbits(8 * length).to_bytes(length, "little")
+    return random_bytes.translate(_random_byte_to_nucleotide).decode()
+
+
+def _make_ref_seq(rng, genome_size, repeat_fraction, repeat_length, repeat_copies):
+    """Returns a random sequence of length genome_size. About repeat_fraction
+    of it is made of repeats of length repeat_length, with each repeat
+    having repeat_copies identical copies, at random positions"""
+    copies = int(genome_size * repeat_fraction) // repeat_length
+    copies -= copies % repeat_copies
+    repeats = [_random_seq(rng, repeat_length) for _ in range(copies // repeat_copies)]
+    repeats = [x for x in repeats for _ in range(repeat_copies)]
+    rng.shuffle(repeats)
+    unique_length = genome_size - len(repeats) * repeat_length
+    cuts = sorted(rng.randrange(unique_length + 1) for _ in repeats)
+    cuts = [0] + cuts + [unique_length]
+    unique = _random_seq(rng, unique_length)
+    seq = [unique[cuts[0] : cuts[1]]]
+    for i, repeat in enumerate(repeats):
+        seq.append(repeat)
+        seq.append(unique[cuts[i + 1] : cuts[i + 2]])
+    return "".join(seq)
+
+
+def _make_variants(
+    rng,
+    ref_seq,
+    snp_rate,
+    indel_rate,
+    sv_rate,
+    cluster_fraction,
+    max_indel_length,
+    sv_lengths,
+):
+    """Returns a sorted list of non-overlapping variants (0-based position,
+    ref allele, alt allele) in ref_seq. Each rate is the expected number of
+    variants of that type per base. Each variant is put close to the
+    previous one with probability cluster_fraction"""
+    variant_types = ["snp"] * round(len(ref_seq) * snp_rate)
+    variant_types += ["indel"] * round(len(ref_seq) * indel_rate)
+    variant_types += ["sv"] * round(len(ref_seq) * sv_rate)
+    rng.shuffle(variant_types)
+    variants = []
+    position = None
+    for variant_type in variant_types:
+        if variant_type == "snp":
+            length = 0
+        elif variant_type == "indel":
+            length = rng.randint(1, max_indel_length)
+        else:
+            length = rng.randint(*sv_lengths)
+        if position is not None and rng.random() < cluster_fraction:
+            position += rng.randint(2, 20)
+        else:
+            position = rng.randrange(len(ref_seq))
+        if position + length + 1 >= len(ref_seq):
+            position = None
+            continue
+
+        if variant_type == "snp":
+            ref = ref_seq[position]
+            alt = rng.choice([x for x in "ACGT" if x != ref])
+        elif rng.random() < 0.5:
+            ref = ref_seq[position]
+            alt = ref + _random_seq(rng, length)
+        else:
+            ref = ref_seq[position : position + length + 1]
+            alt = ref[0]
+        variants.append((position, ref, alt))
+
+    return _remove_overlaps(variants)
+
+
+def _remove_overlaps(variants):
+    """Returns the variants sorted by position, without those that overlap
+    (or are next to) a variant that is earlier in the genome"""
+    kept = []
+    for variant in sorted(variants):
+        if len(kept) == 0 or kept[-1][0] + len(kept[-1][1]) < variant[0]:
+            kept.append(variant)
+    return kept
+
+
+def _write_vcf(seq_name, seq_length, variants, outfile):
+    with open(outfile, "w") as f:
+        print(*_vcf_header_lines, sep="\n", file=f)
+        print(f"##contig=<ID={seq_name},length={seq_length}>", file=f)
+        print("#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tsample", file=f)
+        for position, ref, alt in variants:
+            print(
+                seq_name,
+                position + 1,
+                ".",
+                ref,
+                alt,
+                ".",
+                "PASS",
+                ".",
+                "GT",
+                "1/1",
+                sep="\t",
+                file=f,
+            )
+
+
+def make_synthetic_genomes(
+    outdir,
+    genome_size,
+    snp_rate=0.001,
+    indel_rate=0.0002,
+    sv_rate=0.00001,
+    cluster_fraction=0.1,
+    repeat_fraction=0.05,
+    repeat_length=1000,
+    repeat_copies=4,
+    max_indel_length=10,
+    sv_lengths=(50, 1000),
+    call_fraction=0.9,
+    false_call_rate=0.1,
+    seed=42,
+):
+    """Makes a random reference genome of length genome_size, and a truth
+    genome that is the reference with random variants applied, in the
+    directory outdir. Also makes a VCF file of calls to evaluate, which
+    has (on average) call_fraction of the truth variants, plus false SNP
+    calls, false_call_rate times the number of truth variants. Files made:
+    ref.fa, truth.fa, truth_variants.vcf (the variants applied to the
+    reference), calls.vcf. Returns a dictionary of the number of variants"""
+    rng = random.Random(seed)
+    os.mkdir(outdir)
+    ref_seq = _make_ref_seq(
+        rng, genome_size, repeat_fraction, repeat_length, repeat_copies
+    )
+    variants = _make_variants(
+        rng,
+        ref_seq,
+        snp_rate,
+        indel_rate,
+        sv_rate,
+        cluster_fraction,
+        max_indel_length,
+        sv_lengths,
+    )
+    _write_vcf(
+        "ref", len(ref_seq), variants, os.path.join(outdir, "truth_variants.vcf")
+    )
+    # Same as recall.apply_variants_to_seqs(), but joins the pieces of the
+    # sequence instead of editing it, which is much faster for large genomes
+    truth_seq = []
+    previous_end = 0
+    for position, ref, alt in variants:
+        truth_seq.append(ref_seq[previous_end:position])
+        truth_seq.append(alt)
+        previous_end = position + len(ref)
+    truth_seq.append(ref_seq[previous_end:])
+    truth_seq = "".join(truth_seq)
+    with open(os.path.join(outdir, "ref.fa"), "w") as f:
+        print(pyfastaq.sequences.Fasta("ref", ref_seq), file=f)
+    with open(os.path.join(outdir, "truth.fa"), "w") as f:
+        print(pyfastaq.sequences.Fasta("truth", truth_seq), file=f)
+
+    calls = [x for x in variants if rng.random() < call_fraction]
+    for _ in range(round(len(variants) * false_call_rate)):
+        position = rng.randrange(len(ref_seq))
+        ref = ref_seq[position]
+        calls.append((position, ref, rng.choice([x for x in "ACGT" if x != ref])))
+    calls = _remove_overlaps(calls)
+    _write_vcf("ref", len(ref_seq), calls, os.path.join(outdir, "calls.vcf"))
+    truth_set = set(variants)
+    return {
+        "truth_variants": len(variants),
+        "calls": len(calls),
+        "true_calls": len([x for x in calls if x in truth_set]),
+    }
+
+
+def _peak_memory_mb():
+    """Returns the peak memory of this process, or of its largest finished
+    child process (eg MUMmer when making the truth VCF), whichever is
+    bigger"""
+    peak = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+    # ru_maxrss is in bytes on macOS, but kilobytes on linux
+    if sys.platform == "darwin":
+        peak /= 1024
+    return round(peak / 1024, 1)
+
+
+def _init_worker(log_level):
+    logging.basicConfig(
+        format="%(asctime)s [%(levelname)s]: %(message)s", level=log_level
+    )
+
+
+def _run_step(step, outdir, kwargs):
+    """Runs one step of the benchmark, and returns its time, peak memory and
+    the time of each checkpointed stage. This is run in a new process, so
+    that the peak memory is only from this step"""
+    # Imported here so that their import time is not counted as part of
+    # the step time
+    from varifier import truth_variant_finding, vcf_evaluate
+
+    funcs = {
+        "make_truth_vcf": truth_variant_finding.make_truth_vcf,
+        "vcf_eval": vcf_evaluate.evaluate_vcf,
+    }
+    start_time = time.perf_counter()
+    with checkpoint.record_stage_times() as stage_times:
+        funcs[step](outdir=outdir, **kwargs)
+    return {
+        "seconds": round(time.perf_counter() - start_time, 3),
+        "peak_memory_mb": _peak_memory_mb(),
+        "stages": {
+            os.path.relpath(filename, outdir): round(seconds, 3)
+            for filename, seconds in stage_times
+        },
+    }
+
+
+def _run_step_in_new_process(step, outdir, kwargs):
+    context = multiprocessing.get_context("spawn")
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=1,
+        mp_context=context,
+        initializer=_init_worker,
+        initargs=(logging.getLogger().getEffectiveLevel(),),
+    ) as executor:
+        return executor.submit(_run_step, step, outdir, kwargs).result()
+
+
+def scaling_exponent(sizes, values):
+    """Returns the exponent k that best fits values = c * sizes^k, using
+    least squares on the logs of sizes and values. Returns None if there are
+    fewer than two different sizes, or any value is not positive"""
+    if len(set(sizes)) < 2 or any(x <= 0 for x in values):
+        return None
+    xs = [math.log(x) for x in sizes]
+    ys = [math.log(y) for y in values]
+    x_mean = sum(xs) / len(xs)
+    y_mean = sum(ys) / len(ys)
+    numerator = sum((x - x_mean) * (y - y_mean) for x, y in zip(xs, ys))
+    denominator = sum((x - x_mean) ** 2 for x in xs)
+    return round(numerator / denominator, 3)
+
+
+def _scaling(runs):
+    """Returns the scaling exponents of time and peak memory of each step,
+    and the time of each stage, across the list of runs"""
+    sizes = [x["genome_size"] for x in runs]
+    scaling = {}
+    for step in runs[0]["steps"]:
+        results = [x["steps"][step] for x in runs]
+        stage_names = [
+            name
+            for name in results[0]["stages"]
+            if all(name in x["stages"] for x in results)
+        ]
+        scaling[step] = {
+            "seconds": scaling_exponent(sizes, [x["seconds"] for x in results]),
+            "peak_memory_mb": scaling_exponent(
+                sizes, [x["peak_memory_mb"] for x in results]
+            ),
+            "stages": {
+                name: scaling_exponent(sizes, [x["stages"][name] for x in results])
+                for name in stage_names
+            },
+        }
+    return scaling
+
+
+def run_benchmark(
+    outdir,
+    genome_sizes,
+    flank_length=100,
+    max_flank_length=None,
+    threads=1,
+    seed=42,
+    force=False,
+    **genome_options,
+):
+    """Makes synthetic genomes (using make_synthetic_genomes(), with
+    genome_options) of each length in the list genome_sizes. For each one,
+    runs make_truth_vcf and vcf_eval, measuring the time and peak memory of
+    each. Writes everything in outdir, with the results (including the
+    scaling exponents across the genome sizes) in outdir/benchmark.json,
+    and returns the results. Nothing is downloaded, and no external data is
+    needed"""
+    if force:
+        subprocess.check_output(f"rm -rf {outdir}", shell=True)
+    os.mkdir(outdir)
+    runs = []
+    for genome_size in sorted(genome_sizes):
+        logging.info(f"Benchmarking genome size {genome_size}")
+        run_dir = os.path.join(outdir, str(genome_size))
+        data_dir = os.path.join(run_dir, "data")
+        os.mkdir(run_dir)
+        start_time = time.perf_counter()
+        counts = make_synthetic_genomes(
+            data_dir, genome_size, seed=seed, **genome_options
+        )
+        generate_seconds = round(time.perf_counter() - start_time, 3)
+        ref_fasta = os.path.join(data_dir, "ref.fa")
+        truth_fasta = os.path.join(data_dir, "truth.fa")
+        truth_dir = os.path.join(run_dir, "make_truth_vcf")
+        steps = {}
+        steps["make_truth_vcf"] = _run_step_in_new_process(
+            "make_truth_vcf",
+            truth_dir,
+            {
+                "ref_fasta": ref_fasta,
+                "truth_fasta": truth_fasta,
+                "flank_length": flank_length,
+                "max_flank_length": max_flank_length,
+                "threads": threads,
+            },
+        )
+        eval_dir = os.path.join(run_dir, "vcf_eval")
+        steps["vcf_eval"] = _run_step_in_new_process(
+            "vcf_eval",
+            eval_dir,
+            {
+                "vcf_to_eval": os.path.join(data_dir, "calls.vcf"),
+                "vcf_ref_fasta": ref_fasta,
+                "truth_ref_fasta": truth_fasta,
+                "flank_length": flank_length,
+                "truth_vcf": os.path.join(truth_dir, "04.truth.vcf"),
+                "max_flank_length": max_flank_length,
+                "threads": threads,
+            },
+        )
+        with open(os.path.join(eval_dir, "summary_stats.json")) as f:
+            summary_stats = json.load(f)
+        runs.append(
+            {
+                "genome_size": genome_size,
+                "variant_counts": counts,
+                "generate_seconds": generate_seconds,
+                "steps": steps,
+                "summary_stats": summary_stats,
+            }
+        )
+
+    results = {
+        "varifier_version": varifier.__version__,
+        "options": {
+            "flank_length": flank_length,
+            "max_flank_length": max_flank_length,
+            "threads": threads,
+            "seed": seed,
+            **genome_options,
+        },
+        "runs": runs,
+        "scaling": _scaling(runs),
+    }
+    benchmark_json = os.path.join(outdir, "benchmark.json")
+    with open(benchmark_json, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    logging.info(f"Benchmark results written to {benchmark_json}")
+    return results
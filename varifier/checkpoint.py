@@ -0,0 +1,120 @@
+import contextlib
+import functools
+import hashlib
+import json
+import logging
+import os
+import time
+
+# When not None, run_stage() adds a tuple (first output file, seconds taken)
+# to this list for each stage that it runs. See record_stage_times()
+_stage_times = None
+
+
+@functools.lru_cache(maxsize=None)
+def _file_md5(filename, size, mtime_ns):
+    # size and mtime_ns are only here so that the cache is invalidated
+    # if the file changes
+    md5 = hashlib.md5()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(1048576), b""):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def file_md5(filename):
+    """Returns the md5 sum of a file. Results are cached, keyed by
+    filename, size and modification time, so that files used by more than
+    one stage (eg the reference FASTA) are only read once per process"""
+    stat = os.stat(filename)
+    return _file_md5(os.path.abspath(filename), stat.st_size, stat.st_mtime_ns)
+
+
+def _json_default(x):
+    if isinstance(x, (set, frozenset)):
+        return sorted(x)
+    raise TypeError(f"Cannot serialize object of type {type(x)} for checkpoint")
+
+
+def _fingerprint(outfiles, infiles, params):
+    """Returns a dictionary describing a stage: md5 sums of its input and
+    output files, and the parameters used. Input files that are None are
+    ignored, so that optional inputs can be passed straight through"""
+    return {
+        "inputs": {x: file_md5(x) for x in infiles if x is not None},
+        "outputs": {x: file_md5(x) for x in outfiles},
+        "params": json.loads(json.dumps(params, sort_keys=True, default=_json_default)),
+    }
+
+
+def checkpoint_file(outfile):
+    return f"{outfile}.checkpoint.json"
+
+
+def stage_is_done(outfiles, infiles, params=None):
+    """Returns True if the stage that makes outfiles was previously completed,
+    using the same input files and parameters. Returns False if the stage
+    needs (re)running"""
+    marker = checkpoint_file(outfiles[0])
+    if not (os.path.exists(marker) and all(os.path.exists(x) for x in outfiles)):
+        return False
+
+    with open(marker) as f:
+        previous = json.load(f)
+
+    try:
+        current = _fingerprint(outfiles, infiles, params)
+    except FileNotFoundError:
+        return False
+    return previous["fingerprint"] == current
+
+
+def mark_stage_done(outfiles, infiles, params=None, result=None):
+    """Writes a checkpoint file that records the stage that made outfiles
+    as complete. result can be any JSON-serializable value returned by the
+    stage, which is given back when the stage is skipped on resuming"""
+    marker = checkpoint_file(outfiles[0])
+    data = {
+        "fingerprint": _fingerprint(outfiles, infiles, params),
+        "result": result,
+    }
+    tmp_marker = f"{marker}.tmp"
+    with open(tmp_marker, "w") as f:
+        json.dump(data, f, indent=2, sort_keys=True, default=_json_default)
+    os.replace(tmp_marker, marker)
+
+
+def run_stage(outfiles, infiles, params, resume, func, *args, **kwargs):
+    """Runs func(*args, **kwargs), which makes the files outfiles from the
+    files infiles. If resume is True and the stage was already completed
+    with the same inputs and params, then func is not run, and the value it
+    returned last time is returned instead. Otherwise func is run and a
+    checkpoint file is written when it finishes"""
+    marker = checkpoint_file(outfiles[0])
+    if resume and stage_is_done(outfiles, infiles, params=params):
+        logging.info(f"Skipping stage because already complete: {outfiles[0]}")
+        with open(marker) as f:
+            return json.load(f)["result"]
+
+    if os.path.exists(marker):
+        os.unlink(marker)
+    start_time = time.perf_counter()
+    result = func(*args, **kwargs)
+    if _stage_times is not None:
+        _stage_times.append((outfiles[0], time.perf_counter() - start_time))
+    mark_stage_done(outfiles, infiles, params=params, result=result)
+    return result
+
+
+@contextlib.contextmanager
+def record_stage_times():
+    """Context manager that yields a list. Each stage that is run (not
+    skipped) by run_stage() inside the context adds a tuple
+    (first output file, seconds taken) to the list"""
+    global _stage_times
+    previous = _stage_times
+    _stage_times = []
+    try:
+        yield _stage_times
+    finally:
+        _stage_times = previous
@@ -1,12 +1,10 @@
-from operator import attrgetter
+from operator import itemgetter
 import logging
 import os
 import subprocess
 
-import pyfastaq
 import pymummer
-from cluster_vcf_records import vcf_record
-from varifier import utils
+import pysam
 
 dnadiff_output_extensions = [
     "1coords",
@@ -30,114 +28,97 @@ def _run_dnadiff(ref_fasta, query_fasta, outprefix):
     logging.info(f"dnadiff command finished ({command})")
 
 
+_complement_trans = str.maketrans("ATCGatcg", "TAGCtagc")
+
+
+def _snps_file_variants(snps_file):
+    """Yields pymummer.variant.Variant objects from a .snps file, one at a
+    time. Consecutive indel lines are combined into one variant, the same
+    as pymummer.snp_file.get_all_variants(), but without loading the whole
+    file"""
+    variant = None
+    for snp in pymummer.snp_file.reader(snps_file):
+        if variant is None or not variant.update_indel(snp):
+            if variant is not None:
+                yield variant
+            variant = pymummer.variant.Variant(snp)
+
+    if variant is not None:
+        yield variant
+
+
 def _snps_file_to_vcf(snps_file, query_fasta, outfile):
     """Loads the .snps file made by dnadiff.
     query_fasta = fasta file of query sequences.
     Writes a new VCF file unmerged records."""
-    vcf_records = {}
-    variants = pymummer.snp_file.get_all_variants(snps_file)
-    query_seqs = utils.file_to_dict_of_seqs(query_fasta)
+    # The .snps file is sorted by position in the dnadiff reference, which
+    # is our truth genome, but the VCF is w.r.t. the query. So we still need
+    # to sort, but only store the position and VCF line of each record
+    vcf_lines = {}
+    query_fasta = pysam.FastaFile(query_fasta)
 
-    for variant in variants:
+    for variant in _snps_file_variants(snps_file):
         # If the variant is reversed, it means that either the ref or query had to be
         # reverse complemented when aligned by mummer. Need to do the appropriate
         # reverse (complement) fixes so the VCF has the correct REF and ALT sequences
         if variant.reverse:
-            qry_seq = pyfastaq.sequences.Fasta("x", variant.qry_base)
-            qry_seq.revcomp()
-            variant.qry_base = "".join(reversed(qry_seq.seq))
-            ref_seq = pyfastaq.sequences.Fasta("x", variant.ref_base)
-            ref_seq.revcomp()
-            variant.ref_base = ref_seq.seq
+            variant.qry_base = variant.qry_base.translate(_complement_trans)
+            variant.ref_base = variant.ref_base.translate(_complement_trans)[::-1]
 
         if variant.var_type == pymummer.variant.SNP:
-            new_record = vcf_record.VcfRecord(
-                "\t".join(
-                    [
-                        variant.qry_name,
-                        str(variant.qry_start + 1),
-                        ".",
-                        variant.qry_base,
-                        variant.ref_base,
-                        ".",
-                        ".",
-                        "SVTYPE=DNADIFF_SNP",
-                        "GT",
-                        "1/1",
-                    ]
-                )
-            )
+            pos = variant.qry_start
+            ref = variant.qry_base
+            alt = variant.ref_base
+            svtype = "DNADIFF_SNP"
         elif variant.var_type == pymummer.variant.DEL:
             # The query has sequence missing, compared to the
             # reference. We're making VCF records w.r.t. the
             # query, so this is an insertion. So need to
             # get the nucleotide before the insertion as well.
-            new_record = vcf_record.VcfRecord(
-                "\t".join(
-                    [
-                        variant.qry_name,
-                        str(variant.qry_start + 1),
-                        ".",
-                        query_seqs[variant.qry_name][variant.qry_start],
-                        query_seqs[variant.qry_name][variant.qry_start]
-                        + variant.ref_base,
-                        ".",
-                        ".",
-                        "SVTYPE=DNADIFF_INS",
-                        "GT",
-                        "1/1",
-                    ]
-                )
-            )
+            pos = variant.qry_start
+            ref = query_fasta.fetch(variant.qry_name, pos, pos + 1)
+            alt = ref + variant.ref_base
+            svtype = "DNADIFF_INS"
         elif variant.var_type == pymummer.variant.INS:
             # The ref has sequence missing, compared to the
             # query. We're making VCF records w.r.t. the
             # query, so this is a deletion. So need to
             # get the nucleotide before the deletion as well.
-            new_record = vcf_record.VcfRecord(
-                "\t".join(
-                    [
-                        variant.qry_name,
-                        str(variant.qry_start),
-                        ".",
-                        query_seqs[variant.qry_name][variant.qry_start - 1]
-                        + variant.qry_base,
-                        query_seqs[variant.qry_name][variant.qry_start - 1],
-                        ".",
-                        ".",
-                        "SVTYPE=DNADIFF_DEL",
-                        "GT",
-                        "1/1",
-                    ]
-                )
-            )
+            pos = variant.qry_start - 1
+            alt = query_fasta.fetch(variant.qry_name, pos, pos + 1)
+            ref = alt + variant.qry_base
+            svtype = "DNADIFF_DEL"
         else:
             raise Exception("Unknown variant type: " + str(variant))
 
-        assert (
-            new_record.REF
-            == query_seqs[new_record.CHROM][
-                new_record.POS : new_record.POS + len(new_record.REF)
+        assert ref == query_fasta.fetch(variant.qry_name, pos, pos + len(ref))
+
+        line = "\t".join(
+            [
+                variant.qry_name,
+                str(pos + 1),
+                ".",
+                ref,
+                alt,
+                ".",
+                ".",
+                f"SVTYPE={svtype}",
+                "GT",
+                "1/1",
             ]
         )
-
-        if new_record.CHROM not in vcf_records:
-            vcf_records[new_record.CHROM] = []
-
-        vcf_records[new_record.CHROM].append(new_record)
-
-    for vcf_list in vcf_records.values():
-        vcf_list.sort(key=attrgetter("POS"))
+        vcf_lines.setdefault(variant.qry_name, []).append((pos, line))
 
     with open(outfile, "w") as f:
         print("##fileformat=VCFv4.2", file=f)
-        for seq in query_seqs.values():
-            print(f"##contig=<ID={seq.id},length={len(seq)}>", file=f)
+        for name, length in zip(query_fasta.references, query_fasta.lengths):
+            print(f"##contig=<ID={name},length={length}>", file=f)
         print("#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tsample", file=f)
 
-        for key, vcf_list in sorted(vcf_records.items()):
-            for record in vcf_list:
-                print(record, file=f)
+        for name, lines in sorted(vcf_lines.items()):
+            lines.sort(key=itemgetter(0))
+            for _, line in lines:
+                print(line, file=f)
 
 
 def make_truth_vcf(ref_fasta, truth_fasta, outfile, debug=False):
@@ -1,7 +1,38 @@
+import collections
+
 import pyfastaq
 
 from varifier import edit_distance
 
+# Same complement as pyfastaq.sequences.Fasta.revcomp()
+_complement = str.maketrans("ATCGatcg", "TAGCtagc")
+
+# What Probe needs to know about the allele in one mappy hit, worked out in
+# one walk along the cigar by Probe.alignment(). Everything is in the
+# orientation of the probe, so reverse strand hits are flipped.
+#  hit: the mappy hit.
+#  contains_allele: whether the hit contains the allele, plus at least one
+#    base either side.
+#  allele_matches, allele_positions: from Probe.allele_match_counts().
+#  allele_n_columns: number of allele positions before the start of the hit.
+#  allele_ops: tuple of (length, cigar operator) of the alignment columns of
+#    the rest of the allele. None if the hit ends before the allele does.
+#  truth_start, truth_end: 0-based inclusive coords of the truth bases in
+#    those columns, or None if there are none.
+ProbeAlignment = collections.namedtuple(
+    "ProbeAlignment",
+    [
+        "hit",
+        "contains_allele",
+        "allele_matches",
+        "allele_positions",
+        "allele_n_columns",
+        "allele_ops",
+        "truth_start",
+        "truth_end",
+    ],
+)
+
 
 class Probe:
     def __init__(self, seq, allele_start, allele_end):
@@ -18,68 +49,150 @@ class Probe:
     def allele_seq(self):
         return self.seq[self.allele_start : self.allele_end + 1]
 
-    def map_hit_includes_allele(self, map_hit):
+    def alignment(self, map_hit):
+        """Returns the ProbeAlignment of the mappy minimap2 hit map_hit
+        (which must have the extended cigar string, not the 'normal' cigar
+        string). If map_hit is already a ProbeAlignment, it is returned.
+        The methods of this class that take a hit can also be given its
+        ProbeAlignment, so that the cigar is only walked once per hit"""
+        if isinstance(map_hit, ProbeAlignment):
+            return map_hit
+
+        # Example cigar to remind which way round I and D are:
+        # read: AGT--TGATCAAGTAC
+        #  ref: AGTGATGATC----AC
+        # cigar: 3M2D5M4I2M
+        # Cigar operators:
+        # 1  I  Insertion in query (pad in ref)
+        # 2  D  Deletion in query (pad in query)
+        # 7  =  Match
+        # 8  X  Mismatch
         if map_hit.strand == -1:
             start = len(self.seq) - map_hit.q_en
             end = len(self.seq) - map_hit.q_st
+            cigar = reversed(map_hit.cigar)
         else:
             start = map_hit.q_st
             end = map_hit.q_en
+            cigar = map_hit.cigar
+        contains_allele = start < self.allele_start and self.allele_end < end
 
-        return start < self.allele_start and self.allele_end < end
-
-    def allele_match_counts(self, map_hit):
-        """Given a mappy minimap2 hit, works out how many positions in the
-        alignment between the allele and the reference match.
-        Returns a tuple: (matching bases, total positions).
-        The minimap2 hit must have the extended cigar string, not the 'normal'
-        cigar string."""
-        if map_hit.NM == 0:
-            l = self.allele_end - self.allele_start + 1
-            return l, l
-
-        # If there are mismatches, then we can use the extended cigar string to
-        # work out how many of those mismatches are in the allele.
-        # Example cigar to remind which way round I and D are:
-        # read: AGT--TGATCAAGTAC
-        #  ref: AGTGATGATC----AC
-        # cigar: 3M2D5M4I2M
+        # probe_pos is the position in the probe of the next probe base in
+        # the cigar, and truth_pos is the number of truth bases so far
         probe_pos = map_hit.q_st
-        total_positions = 0
+        truth_pos = 0
+        truth_start = truth_end = None
         matches = 0
+        total_positions = 0
+        allele_ops = []
+        n_columns = max(0, min(probe_pos, self.allele_end + 1) - self.allele_start)
 
-        if map_hit.strand == -1:
-            map_hit.cigar.reverse()
-
-        for length, operator in map_hit.cigar:
+        for length, operator in cigar:
             if probe_pos > self.allele_end:
                 break
 
-            if operator == 7 or operator == 8:  # 7,8 are "=","X"  == match/mismatch
-                for i in range(length):
-                    if self.allele_start <= probe_pos <= self.allele_end:
-                        if operator == 7:
-                            matches += 1
-                        total_positions += 1
-                    probe_pos += 1
-                    if probe_pos > self.allele_end:
-                        break
-            elif operator == 1:  # 1 = I = insertion
-                if self.allele_start <= probe_pos <= self.allele_end:
+            if operator == 2:  # 2 = D = deletion
+                if self.allele_start <= probe_pos:
                     total_positions += length
-                probe_pos += length
-            elif operator == 2:  # 2 = D = deletion
-                if self.allele_start <= probe_pos <= self.allele_end:
+                if self.allele_start < probe_pos:
+                    allele_ops.append((length, operator))
+                    if truth_start is None:
+                        truth_start = truth_pos
+                    truth_end = truth_pos + length - 1
+                truth_pos += length
+            elif operator in {1, 7, 8}:  # 1 = I = insertion, 7,8 are "=","X"
+                if operator == 1 and self.allele_start <= probe_pos:
                     total_positions += length
+                first = max(probe_pos, self.allele_start)
+                last = min(probe_pos + length, self.allele_end + 1)
+                if first < last:
+                    allele_ops.append((last - first, operator))
+                    if operator != 1:
+                        total_positions += last - first
+                        if operator == 7:
+                            matches += last - first
+                        if truth_start is None:
+                            truth_start = truth_pos + first - probe_pos
+                        truth_end = truth_pos + last - probe_pos - 1
+                probe_pos += length
+                if operator != 1:
+                    truth_pos += length
             else:
                 raise RuntimeError(
                     f"Unexpected cigar operator number {operator} with length {length} from cigar"
                 )
 
-        if map_hit.strand == -1:
-            map_hit.cigar.reverse()
+        if map_hit.NM == 0:
+            matches = total_positions = self.allele_end - self.allele_start + 1
+        if probe_pos <= self.allele_end:
+            allele_ops = None
+        else:
+            allele_ops = tuple(allele_ops)
+        if truth_start is not None:
+            if map_hit.strand == -1:
+                truth_start, truth_end = (
+                    map_hit.r_en - truth_end - 1,
+                    map_hit.r_en - truth_start - 1,
+                )
+            else:
+                truth_start += map_hit.r_st
+                truth_end += map_hit.r_st
+
+        return ProbeAlignment(
+            map_hit,
+            contains_allele,
+            matches,
+            total_positions,
+            n_columns,
+            allele_ops,
+            truth_start,
+            truth_end,
+        )
+
+    def map_hit_includes_allele(self, map_hit):
+        return self.alignment(map_hit).contains_allele
 
-        return matches, total_positions
+    def allele_match_counts(self, map_hit):
+        """Given a mappy minimap2 hit, works out how many positions in the
+        alignment between the allele and the reference match.
+        Returns a tuple: (matching bases, total positions).
+        The minimap2 hit must have the extended cigar string, not the 'normal'
+        cigar string."""
+        alignment = self.alignment(map_hit)
+        return alignment.allele_matches, alignment.allele_positions
+
+    def allele_alignment_strings(self, map_hit, ref_seq):
+        """Returns a tuple of the alignment strings (with dashes for gaps) of
+        the allele and the matching part of ref_seq, in the orientation of
+        the probe. The same as the allele part of the strings made by
+        padded_probe_or_ref_seq(). Returns None if map_hit ends before the
+        allele does"""
+        alignment = self.alignment(map_hit)
+        if alignment.allele_ops is None:
+            return None
+        if alignment.truth_start is None:
+            ref_allele = ""
+        else:
+            ref_allele = ref_seq[alignment.truth_start : alignment.truth_end + 1]
+            if alignment.hit.strand == -1:
+                ref_allele = ref_allele.translate(_complement)[::-1]
+
+        probe_strings = ["N" * alignment.allele_n_columns]
+        ref_strings = ["N" * alignment.allele_n_columns]
+        probe_pos = self.allele_start + alignment.allele_n_columns
+        ref_pos = 0
+        for length, operator in alignment.allele_ops:
+            if operator == 1:
+                ref_strings.append("-" * length)
+            else:
+                ref_strings.append(ref_allele[ref_pos : ref_pos + length])
+                ref_pos += length
+            if operator == 2:
+                probe_strings.append("-" * length)
+            else:
+                probe_strings.append(self.seq[probe_pos : probe_pos + length])
+                probe_pos += length
+        return "".join(probe_strings), "".join(ref_strings)
 
     def padded_probe_or_ref_seq(self, map_hit, ref_seq=None, ref_mask=None):
         """Returns a tuple: (padded seq string, mask list of bools).
@@ -165,20 +278,15 @@ class Probe:
         return None, None
 
     def edit_distance_vs_ref(self, map_hit, ref_seq, ref_mask=None):
-        padded_probe_seq, _ = self.padded_probe_or_ref_seq(map_hit)
-        padded_ref_seq, padded_ref_mask = self.padded_probe_or_ref_seq(
-            map_hit, ref_seq=ref_seq, ref_mask=ref_mask
-        )
-        start, end = self.padded_seq_allele_start_end_coords(padded_probe_seq)
-        if start == None:
+        alignment = self.alignment(map_hit)
+        strings = self.allele_alignment_strings(alignment, ref_seq)
+        if strings is None:
             return -1, False
-        probe_allele = padded_probe_seq[start : end + 1]
-        ref_allele = padded_ref_seq[start : end + 1]
-        if ref_mask is None:
+        if ref_mask is None or alignment.truth_start is None:
             in_mask = False
         else:
-            in_mask = any(padded_ref_mask[start : end + 1])
-        return (
-            edit_distance.edit_distance_from_aln_strings(probe_allele, ref_allele),
-            in_mask,
-        )
+            in_mask = any(
+                i in ref_mask
+                for i in range(alignment.truth_start, alignment.truth_end + 1)
+            )
+        return edit_distance.edit_distance_from_aln_strings(*strings), in_mask
@@ -0,0 +1,115 @@
+import hashlib
+import json
+import logging
+import sqlite3
+
+from varifier import checkpoint
+
+
+def cache_namespace(truth_fasta, mapper_options):
+    """Returns the key used to separate hits from different truth genomes and
+    mapper options in the same cache file"""
+    key = json.dumps([checkpoint.file_md5(truth_fasta), mapper_options], sort_keys=True)
+    return hashlib.md5(key.encode()).hexdigest()
+
+
+class ProbeHitCache:
+    """Cache of probe sequence -> probe hits, stored in a SQLite database
+    file so that it can be used across runs. Hits are tuples of the values
+    needed by evaluate_vcf_record(): (ctg, r_st, r_en, q_st, q_en, strand,
+    cigar, mapq, NM). The file can hold hits for more than one truth genome
+    and set of mapper options, which are kept separate by namespace (see
+    cache_namespace()). When closed, the least recently used probes are
+    removed so that at most max_entries probes are kept"""
+
+    def __init__(self, filename, namespace, max_entries=1000000, flush_every=10000):
+        self.filename = filename
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.flush_every = flush_every
+        self.conn = sqlite3.connect(filename, timeout=60)
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS hits (
+                namespace TEXT NOT NULL,
+                probe TEXT NOT NULL,
+                hits TEXT NOT NULL,
+                last_used INTEGER NOT NULL,
+                PRIMARY KEY (namespace, probe)
+            )""")
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS hits_last_used ON hits (last_used)"
+        )
+        self.conn.commit()
+        # Reads and writes are batched: new hits, and probes that were used,
+        # are only written to the database when flushed
+        self.new_hits = {}
+        self.used = set()
+        self.clock = self.conn.execute(
+            "SELECT COALESCE(MAX(last_used), 0) FROM hits"
+        ).fetchone()[0]
+        self.hit_count = 0
+        self.miss_count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def get(self, probe_seq):
+        """Returns list of hit tuples for probe_seq, or None if not cached"""
+        hits = self.new_hits.get(probe_seq)
+        if hits is None:
+            row = self.conn.execute(
+                "SELECT hits FROM hits WHERE namespace=? AND probe=?",
+                (self.namespace, probe_seq),
+            ).fetchone()
+            if row is None:
+                self.miss_count += 1
+                return None
+            hits = [tuple(x) for x in json.loads(row[0])]
+            self.used.add(probe_seq)
+        self.hit_count += 1
+        return hits
+
+    def put(self, probe_seq, hits):
+        self.new_hits[probe_seq] = [tuple(x) for x in hits]
+        if len(self.new_hits) + len(self.used) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        self.clock += 1
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO hits VALUES (?, ?, ?, ?)",
+            [
+                (self.namespace, probe, json.dumps(hits), self.clock)
+                for probe, hits in self.new_hits.items()
+            ],
+        )
+        self.conn.executemany(
+            "UPDATE hits SET last_used=? WHERE namespace=? AND probe=?",
+            [(self.clock, self.namespace, probe) for probe in self.used],
+        )
+        self.conn.commit()
+        self.new_hits = {}
+        self.used = set()
+
+    def evict(self):
+        """Removes least recently used probes, leaving at most max_entries"""
+        self.conn.execute(
+            """DELETE FROM hits WHERE rowid IN (
+                SELECT rowid FROM hits ORDER BY last_used DESC LIMIT -1 OFFSET ?
+            )""",
+            (self.max_entries,),
+        )
+        self.conn.commit()
+
+    def close(self):
+        if self.conn is None:
+            return
+        self.flush()
+        self.evict()
+        self.conn.close()
+        self.conn = None
+        logging.debug(
+            f"Probe hit cache {self.filename}: {self.hit_count} hits, {self.miss_count} misses"
+        )
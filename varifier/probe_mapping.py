@@ -1,9 +1,14 @@
+import collections
+import concurrent.futures
+import heapq
+import itertools
 import operator
+import os
+import tempfile
 
 import mappy
-from cluster_vcf_records import vcf_file_read
 
-from varifier import edit_distance, probe, utils
+from varifier import edit_distance, probe, probe_hit_cache, registry, vcf_record
 
 
 def get_flanking_variants(vcf_records, record_index, end_pos, left=True):
@@ -92,19 +97,66 @@ def make_probes(ref_seqs, vcf_records, record_index, flank_length):
 
 
 def get_probes_and_vcf_records(
-    vcf_file, ref_seqs, flank_length, use_fail_conflict=False
+    vcf_file,
+    ref_seqs,
+    flank_length,
+    use_fail_conflict=False,
+    max_flank_length=None,
+    need_longer_probe=None,
 ):
     """For each line of the input VCF file, yields a
     tuple (vcf_record, alt probe sequence).
     vcf_file = name of VCF file.
     ref_seqs = dictionary of sequence name -> sequence.
-    flank_length = number of nucleotides to add either side of variant sequence."""
-    header_lines, vcf_records = vcf_file_read.vcf_file_to_list(vcf_file)
+    flank_length = number of nucleotides to add either side of variant sequence.
+    max_flank_length, need_longer_probe = if both are not None, then
+      need_longer_probe(vcf_record, alt_probe) is called on each alt probe. While it
+      returns True, the flank length is doubled (up to max_flank_length)
+      and the probes remade."""
+    header_lines, vcf_records = vcf_record.vcf_file_to_list(vcf_file)
     yield header_lines
+    yield from probes_for_vcf_records(
+        vcf_records,
+        ref_seqs,
+        flank_length,
+        max_flank_length=max_flank_length,
+        need_longer_probe=need_longer_probe,
+    )
+
+
+def probes_for_vcf_records(
+    vcf_records,
+    ref_seqs,
+    flank_length,
+    max_flank_length=None,
+    need_longer_probe=None,
+    initial_probes=None,
+):
+    """Same as get_probes_and_vcf_records(), but takes a list of VcfRecords
+    (sorted by CHROM then POS) instead of a VCF file, and does not yield
+    header lines. initial_probes can be a list of (ref probe, alt probe)
+    made with flank_length, one per record, which are used instead of
+    making them again"""
+    for i, record in enumerate(vcf_records):
+        flank = flank_length
+        if initial_probes is None:
+            ref_probe, alt_probe = make_probes(ref_seqs, vcf_records, i, flank)
+        else:
+            ref_probe, alt_probe = initial_probes[i]
+        while (
+            max_flank_length is not None
+            and need_longer_probe is not None
+            and flank < max_flank_length
+            and need_longer_probe(record, alt_probe)
+        ):
+            flank = min(2 * flank, max_flank_length)
+            new_ref_probe, new_alt_probe = make_probes(ref_seqs, vcf_records, i, flank)
+            if new_alt_probe.seq == alt_probe.seq:
+                # Hit the ends of the reference sequence
+                break
+            ref_probe, alt_probe = new_ref_probe, new_alt_probe
 
-    for i, vcf_record in enumerate(vcf_records):
-        ref_probe, alt_probe = make_probes(ref_seqs, vcf_records, i, flank_length)
-        yield vcf_record, ref_probe, alt_probe
+        yield record, ref_probe, alt_probe
 
 
 def probe_hits_to_best_allele_counts(probe, hits, debug_outfile=None):
@@ -116,6 +168,43 @@ def probe_hits_to_best_allele_counts(probe, hits, debug_outfile=None):
     return best
 
 
+def map_probe(mapper, probe_seq, hit_cache=None, max_cache_size=1000, disk_cache=None):
+    """Returns list of hits from mapping probe_seq with mapper. If hit_cache
+    is an OrderedDict, it is used to remember the hits of the most recently
+    mapped max_cache_size distinct probe sequences, so that identical probes
+    (eg from duplicated records, or from split multi-allelic sites) are only
+    mapped once. If disk_cache is a probe_hit_cache.ProbeHitCache, then
+    hits are looked up there before mapping, and new hits are added to it"""
+    if hit_cache is not None:
+        hits = hit_cache.get(probe_seq)
+        if hits is not None:
+            hit_cache.move_to_end(probe_seq)
+            return hits
+
+    if disk_cache is None:
+        hits = list(mapper.map(probe_seq, MD=True))
+    else:
+        hits = disk_cache.get(probe_seq)
+        if hits is None:
+            hits = [hit_to_tuple(x) for x in mapper.map(probe_seq, MD=True)]
+            disk_cache.put(probe_seq, hits)
+        hits = [ProbeHit(*x) for x in hits]
+
+    if hit_cache is not None:
+        hit_cache[probe_seq] = hits
+        if len(hit_cache) > max_cache_size:
+            hit_cache.popitem(last=False)
+    return hits
+
+
+def filter_alt_hits(alt_probe, hits):
+    """Returns the ProbeAlignments of the hits of the alt probe that can be
+    used for evaluating the allele: they must contain the allele, and have
+    mapq > 0"""
+    alignments = [alt_probe.alignment(x) for x in hits if x.mapq > 0]
+    return [x for x in alignments if x.contains_allele]
+
+
 def hit_debug_string(hit, map_probe):
     contain = map_probe.map_hit_includes_allele(hit)
     return "\t".join(
@@ -142,13 +231,19 @@ def evaluate_vcf_record(
     map_outfile=None,
     use_fail_conflict=False,
     truth_mask=None,
+    hit_cache=None,
+    disk_cache=None,
+    edit_dist_allele_v_ref=None,
 ):
-    edit_dist_allele_v_ref = edit_distance.edit_distance_between_seqs(
-        ref_probe.allele_seq(), alt_probe.allele_seq()
-    )
+    if edit_dist_allele_v_ref is None:
+        edit_dist_allele_v_ref = edit_distance.edit_distance_between_seqs(
+            ref_probe.allele_seq(), alt_probe.allele_seq()
+        )
     vcf_record.set_format_key_value("VFR_ED_RA", str(edit_dist_allele_v_ref))
 
-    alt_hits = list(mapper.map(alt_probe.seq, MD=True))
+    alt_hits = map_probe(
+        mapper, alt_probe.seq, hit_cache=hit_cache, disk_cache=disk_cache
+    )
 
     if map_outfile is not None:
         print("VCF", vcf_record, sep="\t", file=map_outfile)
@@ -167,19 +262,22 @@ def evaluate_vcf_record(
                 file=map_outfile,
             )
 
-    alt_hits = [
-        x for x in alt_hits if alt_probe.map_hit_includes_allele(x) and x.mapq > 0
-    ]
-    alt_match, alt_allele_length, alt_best_hit = probe_hits_to_best_allele_counts(
-        alt_probe, alt_hits, debug_outfile=map_outfile
+    # Each hit's alignment is only worked out once, and then used for the
+    # allele match counts and edit distances
+    alt_alignments = filter_alt_hits(alt_probe, alt_hits)
+    alt_match, alt_allele_length, alt_best = probe_hits_to_best_allele_counts(
+        alt_probe, alt_alignments, debug_outfile=map_outfile
     )
 
     if alt_match is None:
         vcf_record.set_format_key_value("VFR_RESULT", "FP_PROBE_UNMAPPED")
         vcf_record.set_format_key_value("VFR_ED_SCORE", "0")
         return
+    alt_best_hit = alt_best.hit
 
-    ref_hits = list(mapper.map(ref_probe.seq, MD=True))
+    ref_hits = map_probe(
+        mapper, ref_probe.seq, hit_cache=hit_cache, disk_cache=disk_cache
+    )
     if map_outfile is not None:
         print("VCF", vcf_record, sep="\t", file=map_outfile)
         print(
@@ -197,30 +295,29 @@ def evaluate_vcf_record(
                 file=map_outfile,
             )
 
-    ref_hits = [
-        x
+    ref_alignments = [
+        ref_probe.alignment(x)
         for x in ref_hits
-        if ref_probe.map_hit_includes_allele(x)
-        and alt_best_hit.ctg == x.ctg
-        and x.r_st == alt_best_hit.r_st
-        and x.mapq > 0
+        if alt_best_hit.ctg == x.ctg and x.r_st == alt_best_hit.r_st and x.mapq > 0
     ]
+    ref_alignments = [x for x in ref_alignments if x.contains_allele]
+    ref_alignments.sort(key=lambda x: x.hit.NM)
+    ref_hits = [x.hit for x in ref_alignments]
 
     if len(ref_hits) == 0:
         best_ref_hit = None
         ref_allele_in_mask = False
     else:
-        ref_hits.sort(key=operator.attrgetter("NM"))
         best_ref_hit = ref_hits[0]
         mask = None if truth_mask is None else truth_mask[best_ref_hit.ctg]
         edit_dist_ref_allele, ref_allele_in_mask = ref_probe.edit_distance_vs_ref(
-            best_ref_hit, truth_seqs[best_ref_hit.ctg], ref_mask=mask,
+            ref_alignments[0], truth_seqs[best_ref_hit.ctg], ref_mask=mask,
         )
         vcf_record.set_format_key_value("VFR_ED_TR", str(edit_dist_ref_allele))
 
     mask = None if truth_mask is None else truth_mask[alt_best_hit.ctg]
     edit_dist_alt_allele, alt_allele_in_mask = alt_probe.edit_distance_vs_ref(
-        alt_best_hit, truth_seqs[alt_best_hit.ctg], ref_mask=mask,
+        alt_best, truth_seqs[alt_best_hit.ctg], ref_mask=mask,
     )
     vcf_record.set_format_key_value("VFR_ED_TA", str(edit_dist_alt_allele))
     vcf_record.set_format_key_value("VFR_ALLELE_LEN", str(alt_allele_length))
@@ -243,6 +340,400 @@ def evaluate_vcf_record(
         print("FINISH:", vcf_record, file=map_outfile)
 
 
+# Some notes on the mapper options...
+#
+# From the docs: score is the "scoring system. It is a tuple/list consisting
+# of 4, 6 or 7 positive integers. The first 4 elements specify match scoring,
+# mismatch penalty, gap open and gap extension penalty. The 5th and 6th
+# elements, if present, set long-gap open and long-gap extension penalty.
+# The 7th sets a mismatch penalty involving ambiguous bases."
+# The default mappy Python API do not work. In the tests, results in mappings
+# that make FPs turn into TPs.
+# The options 1,1,5,3 are actually the defaults from bowtie2 and seem to work.
+#
+# k=15 and w=10 are the CLI defaults. On the test data, these values result
+# in the probes near the start of the genome getting mapped, whereas those
+# probes do not get mapped using whatever the Python defaults are.
+#
+# extra_flags=0x4000000 turns on extended cigars, which we use to more easily
+# determine where the matches and mismatches are between the probe and truth
+# reference.
+probe_mapper_options = {
+    "k": 15,
+    "w": 10,
+    "preset": "sr",
+    "n_threads": 1,
+    "extra_flags": 0x4000000,
+    "scoring": [1, 1, 5, 3],
+}
+
+
+def get_probe_mapper(truth_ref_fasta):
+    """Returns the (shared) mappy.Aligner used to map probes to
+    truth_ref_fasta"""
+    return registry.get_aligner(truth_ref_fasta, **probe_mapper_options)
+
+
+class ProbeHit:
+    """Has the same attributes as a mappy.Alignment that are used by
+    varifier. Used for hits that did not come straight from mappy"""
+
+    __slots__ = (
+        "ctg",
+        "r_st",
+        "r_en",
+        "q_st",
+        "q_en",
+        "strand",
+        "cigar",
+        "mapq",
+        "NM",
+    )
+
+    def __init__(self, ctg, r_st, r_en, q_st, q_en, strand, cigar, mapq, NM):
+        self.ctg = ctg
+        self.r_st = r_st
+        self.r_en = r_en
+        self.q_st = q_st
+        self.q_en = q_en
+        self.strand = strand
+        self.cigar = cigar
+        self.mapq = mapq
+        self.NM = NM
+
+
+def hit_to_tuple(hit):
+    """Returns tuple of the values of a mappy.Alignment (or ProbeHit) that are
+    used by varifier, which can be turned back into a hit by ProbeHit(*tuple)"""
+    return tuple(getattr(hit, x) for x in ProbeHit.__slots__)
+
+
+def _compare_to_truth(query, truth):
+    """Returns (cigar, NM) of query against the whole of truth, without
+    dynamic programming: matching as much as possible of their starts and
+    ends, leaving the differences in the middle as mismatches plus one
+    insertion or deletion. This is the same as the alignment minimap2 finds
+    for a single SNP or indel, which is what a probe of a variant has"""
+    max_length = min(len(query), len(truth))
+    start = 0
+    while start < max_length and query[start] == truth[start]:
+        start += 1
+    end = 0
+    while end < max_length - start and query[-1 - end] == truth[-1 - end]:
+        end += 1
+    q_middle = query[start : len(query) - end]
+    t_middle = truth[start : len(truth) - end]
+    ops = [7 if q == t else 8 for q, t in zip(q_middle, t_middle)]
+    cigar = []
+    for op, group in itertools.groupby([7] * start + ops):
+        cigar.append([len(list(group)), op])
+    if len(q_middle) > len(t_middle):
+        cigar.append([len(q_middle) - len(t_middle), 1])
+    elif len(q_middle) < len(t_middle):
+        cigar.append([len(t_middle) - len(q_middle), 2])
+    if end > 0:
+        if cigar[-1][1] == 7:
+            cigar[-1][0] += end
+        else:
+            cigar.append([end, 7])
+    NM = sum(length for length, op in cigar if op != 7)
+    return cigar, NM
+
+
+def _find_all(seq, sub):
+    """Returns list of the start positions of sub in seq"""
+    found = []
+    i = seq.find(sub)
+    while i != -1:
+        found.append(i)
+        i = seq.find(sub, i + 1)
+    return found
+
+
+class WindowMapper:
+    """Maps probes to only the region start-end (0-based, inclusive) of the
+    truth sequence ctg, instead of to the whole truth genome. Has the same
+    map() method as mappy.Aligner, so can be used by evaluate_vcf_record().
+    The region is short, so no index is built: a probe is found by looking
+    for the probe itself in the region, or else for its first and last
+    anchor_length bases. The probe is then compared directly with the region
+    between them (see _compare_to_truth()). Returns no hits if neither is
+    found, so that the caller can fall back to mapping to the whole genome"""
+
+    def __init__(self, truth_seqs, ctg, start, end, anchor_length=15):
+        self.ctg = ctg
+        self.start = max(0, start)
+        self.seq = str(truth_seqs[ctg][self.start : end + 1]).upper()
+        self.anchor_length = anchor_length
+
+    def _strand_hits(self, query, strand):
+        length = len(query)
+        found = _find_all(self.seq, query)
+        if len(found) > 0:
+            return [(x, x + length, strand, [[length, 7]], 0) for x in found]
+
+        anchor_length = min(self.anchor_length, length // 2)
+        if anchor_length == 0:
+            return []
+        starts = _find_all(self.seq, query[:anchor_length])
+        ends = _find_all(self.seq, query[-anchor_length:])
+        if len(starts) != 1 or len(ends) != 1 or ends[0] < starts[0]:
+            return []
+        r_st = starts[0]
+        r_en = ends[0] + anchor_length
+        cigar, NM = _compare_to_truth(query, self.seq[r_st:r_en])
+        return [(r_st, r_en, strand, cigar, NM)]
+
+    def hit_at(self, seq, pos):
+        """Returns a ProbeHit if seq is exactly the same as the truth
+        sequence starting at pos (in the coords of the whole sequence, not
+        of the window), or None if not"""
+        seq = seq.upper()
+        offset = pos - self.start
+        if offset < 0 or self.seq[offset : offset + len(seq)] != seq:
+            return None
+        return ProbeHit(
+            self.ctg, pos, pos + len(seq), 0, len(seq), 1, [[len(seq), 7]], 60, 0
+        )
+
+    def map(self, seq, MD=True):
+        seq = seq.upper()
+        revcomp = seq.translate(probe._complement)[::-1]
+        found = self._strand_hits(seq, 1) + self._strand_hits(revcomp, -1)
+        # Like minimap2, mapq is zero when the probe has more than one hit
+        mapq = 60 if len(found) == 1 else 0
+        for r_st, r_en, strand, cigar, NM in found:
+            yield ProbeHit(
+                self.ctg,
+                r_st + self.start,
+                r_en + self.start,
+                0,
+                len(seq),
+                strand,
+                cigar,
+                mapq,
+                NM,
+            )
+
+
+def get_probe_mapper_for_seqs(seqs):
+    """Same as get_probe_mapper(), but for a dictionary of sequence name ->
+    sequence instead of a FASTA file"""
+    # mappy can only index a single sequence from memory, so write them
+    # to a temporary FASTA file. The index is kept in memory, so the file is
+    # not needed after the index is built
+    with tempfile.TemporaryDirectory() as tmpdir:
+        fasta = os.path.join(tmpdir, "seqs.fa")
+        with open(fasta, "w") as f:
+            for name, seq in seqs.items():
+                print(f">{name}", seq[:], sep="\n", file=f)
+        aligner = mappy.Aligner(fn_idx_in=fasta, **probe_mapper_options)
+    if not aligner:
+        raise Exception("Error building index from sequences")
+    return aligner
+
+
+class LazyMapper:
+    """Has the same map() method as mappy.Aligner, but the mapper is only
+    made (by calling make_mapper()) the first time a probe is mapped. This
+    means that the index of the whole truth genome is not built when every
+    probe is mapped to a WindowMapper, or has its hits in a cache"""
+
+    def __init__(self, make_mapper):
+        self.make_mapper = make_mapper
+        self.mapper = None
+
+    def map(self, seq, MD=True):
+        if self.mapper is None:
+            self.mapper = self.make_mapper()
+        return self.mapper.map(seq, MD=MD)
+
+
+annotation_header_lines = [
+    '##FORMAT=<ID=VFR_IN_MASK,Number=1,Type=String,Description="Whether or not the variant is in the truth genome mask">',
+    '##FORMAT=<ID=VFR_RESULT,Number=1,Type=String,Description="FP, TP, or Partial_TP when part of the allele matches the truth reference">',
+    '##FORMAT=<ID=VFR_ALLELE_LEN,Number=1,Type=Integer,Description="Number of positions in allele that were checked if they match the truth">',
+    '##FORMAT=<ID=VFR_ALLELE_MATCH_COUNT,Number=1,Type=String,Description="Number of positions in allele that match the truth">',
+    '##FORMAT=<ID=VFR_ALLELE_MATCH_FRAC,Number=1,Type=String,Description="Fraction of positions in allele that match the truth">',
+    '##FORMAT=<ID=VFR_ED_RA,Number=1,Type=String,Description="Edit distance between ref and alt allele (using the called allele where more than one alt)">',
+    '##FORMAT=<ID=VFR_ED_TR,Number=1,Type=String,Description="Edit distance between truth and ref allele">',
+    '##FORMAT=<ID=VFR_ED_TA,Number=1,Type=String,Description="Edit distance between truth and alt allele">',
+    '##FORMAT=<ID=VFR_ED_SCORE,Number=1,Type=String,Description="Edit distance score">',
+]
+
+
+def annotated_vcf_records(
+    vcf_in,
+    vcf_ref_fasta,
+    truth_ref_fasta,
+    flank_length,
+    f_map=None,
+    use_fail_conflict=False,
+    truth_mask=None,
+    hit_cache=None,
+    max_flank_length=None,
+    truth_windows=None,
+    disk_cache=None,
+    precomputed_probes=None,
+):
+    """Generator that annotates each record of vcf_in using probe mapping.
+    First yields the list of header lines for the annotated VCF file, then
+    yields each annotated VcfRecord. f_map is an open file handle for
+    debugging output, or None.
+    If max_flank_length is not None, then probes start with flank_length,
+    and are only made longer (up to max_flank_length) for records where the
+    alt probe has no usable hits, eg because it is in a repeat.
+    truth_windows can be a function that takes (ref name, start, end) of a
+    record and returns (truth name, start, end) of where that region is
+    in the truth genome, or None if not known. When a region is known, probes
+    are first mapped to just that part of the truth genome, falling back to
+    mapping to the whole truth genome if the alt probe has no usable hits.
+    Note that a hit is only required to be unique (mapq > 0) within the
+    region, so a variant in a repeat can be evaluated when it has a known
+    region, but not when it is mapped to the whole truth genome.
+    disk_cache can be a probe_hit_cache.ProbeHitCache, which is used for
+    probes that are mapped to the whole truth genome.
+    precomputed_probes: see annotate_vcf_records()"""
+    header_lines, vcf_records = vcf_record.vcf_file_to_list(vcf_in)
+    yield header_lines[:-1] + annotation_header_lines + header_lines[-1:]
+    yield from annotate_vcf_records(
+        vcf_records,
+        registry.get_seqs(vcf_ref_fasta),
+        registry.get_seqs(truth_ref_fasta),
+        LazyMapper(lambda: get_probe_mapper(truth_ref_fasta)),
+        flank_length,
+        f_map=f_map,
+        use_fail_conflict=use_fail_conflict,
+        truth_mask=truth_mask,
+        hit_cache=hit_cache,
+        max_flank_length=max_flank_length,
+        truth_windows=truth_windows,
+        disk_cache=disk_cache,
+        precomputed_probes=precomputed_probes,
+    )
+
+
+def annotate_vcf_records(
+    vcf_records,
+    vcf_ref_seqs,
+    truth_ref_seqs,
+    mapper,
+    flank_length,
+    f_map=None,
+    use_fail_conflict=False,
+    truth_mask=None,
+    hit_cache=None,
+    max_flank_length=None,
+    truth_windows=None,
+    disk_cache=None,
+    precomputed_probes=None,
+):
+    """Same as annotated_vcf_records(), but works in memory: takes a list of
+    VcfRecords (sorted by CHROM then POS), dictionaries of sequence name ->
+    sequence for the VCF and truth references, and a mapper for the truth
+    genome (eg from get_probe_mapper()). Yields each annotated VcfRecord,
+    and no header lines. precomputed_probes can be a list of tuples
+    (ref probe, alt probe, edit distance between ref and alt alleles), one
+    per record, eg from truth_probes.load_truth_probes()"""
+    if precomputed_probes is None:
+        initial_probes = None
+        edit_distances = itertools.repeat(None)
+    else:
+        assert len(precomputed_probes) == len(vcf_records)
+        initial_probes = [x[:2] for x in precomputed_probes]
+        edit_distances = [x[2] for x in precomputed_probes]
+    if hit_cache is None:
+        hit_cache = collections.OrderedDict()
+    window_pad = 2 * max(flank_length, max_flank_length or 0)
+    # (record, WindowMapper or None, hit cache, truth start of the record)
+    # for the current record
+    window = [None, None, None, None]
+
+    def choose_mapper(record, alt_probe):
+        """Returns tuple (mapper, hit cache, disk cache) to use for the record.
+        The window mapper only knows about its own region, so its mapq values
+        say whether a hit is unique in the region, not in the whole genome.
+        The alt probe is first looked up directly at the truth position of
+        the record, which is where it is when the window is exact (eg from
+        recall.mutated_ref_windows()), so that the window is only searched
+        when the probe is not there"""
+        if truth_windows is None:
+            return mapper, hit_cache, disk_cache
+        if window[0] is not record:
+            region = truth_windows(record.CHROM, record.POS, record.ref_end_pos())
+            if region is None:
+                window[:] = [record, None, None, None]
+            else:
+                ctg, start, end = region
+                window_mapper = WindowMapper(
+                    truth_ref_seqs, ctg, start - window_pad, end + window_pad
+                )
+                window[:] = [record, window_mapper, collections.OrderedDict(), start]
+        if window[1] is not None:
+            if alt_probe.seq not in window[2]:
+                hit = window[1].hit_at(
+                    alt_probe.seq, window[3] - alt_probe.allele_start
+                )
+                if hit is not None:
+                    window[2][alt_probe.seq] = [hit]
+            hits = map_probe(window[1], alt_probe.seq, hit_cache=window[2])
+            if len(filter_alt_hits(alt_probe, hits)) > 0:
+                return window[1], window[2], None
+        return mapper, hit_cache, disk_cache
+
+    def need_longer_probe(record, alt_probe):
+        record_mapper, record_cache, record_disk_cache = choose_mapper(
+            record, alt_probe
+        )
+        hits = map_probe(
+            record_mapper,
+            alt_probe.seq,
+            hit_cache=record_cache,
+            disk_cache=record_disk_cache,
+        )
+        return len(filter_alt_hits(alt_probe, hits)) == 0
+
+    probes_and_vcf_records = probes_for_vcf_records(
+        vcf_records,
+        vcf_ref_seqs,
+        flank_length,
+        max_flank_length=max_flank_length,
+        need_longer_probe=need_longer_probe,
+        initial_probes=initial_probes,
+    )
+
+    for (record, ref_probe, alt_probe), edit_dist in zip(
+        probes_and_vcf_records, edit_distances
+    ):
+        record_mapper, record_cache, record_disk_cache = choose_mapper(
+            record, alt_probe
+        )
+        evaluate_vcf_record(
+            record_mapper,
+            record,
+            ref_probe,
+            alt_probe,
+            vcf_ref_seqs[record.CHROM],
+            truth_ref_seqs,
+            map_outfile=f_map,
+            use_fail_conflict=use_fail_conflict,
+            truth_mask=truth_mask,
+            hit_cache=record_cache,
+            disk_cache=record_disk_cache,
+            edit_dist_allele_v_ref=edit_dist,
+        )
+        yield record
+
+
+def open_probe_hit_cache(filename, truth_ref_fasta, max_entries):
+    """Returns a ProbeHitCache for mapping probes to truth_ref_fasta, using
+    the cache file filename. Returns None if filename is None"""
+    if filename is None:
+        return None
+    namespace = probe_hit_cache.cache_namespace(truth_ref_fasta, probe_mapper_options)
+    return probe_hit_cache.ProbeHitCache(filename, namespace, max_entries=max_entries)
+
+
 def annotate_vcf_with_probe_mapping(
     vcf_in,
     vcf_ref_fasta,
@@ -254,81 +745,199 @@ def annotate_vcf_with_probe_mapping(
     use_ref_calls=False,
     debug=False,
     truth_mask=None,
+    max_flank_length=None,
+    truth_windows=None,
+    probe_hit_cache=None,
+    probe_hit_cache_size=1000000,
+    precomputed_probes=None,
 ):
-    vcf_ref_seqs = utils.file_to_dict_of_seqs(vcf_ref_fasta)
-    truth_ref_seqs = utils.file_to_dict_of_seqs(truth_ref_fasta)
-    probes_and_vcf_reader = get_probes_and_vcf_records(
-        vcf_in, vcf_ref_seqs, flank_length, use_fail_conflict=use_fail_conflict,
-    )
-
-    # Some notes on the mapper options...
-    #
-    # From the docs: score is the "scoring system. It is a tuple/list consisting
-    # of 4, 6 or 7 positive integers. The first 4 elements specify match scoring,
-    # mismatch penalty, gap open and gap extension penalty. The 5th and 6th
-    # elements, if present, set long-gap open and long-gap extension penalty.
-    # The 7th sets a mismatch penalty involving ambiguous bases."
-    # The default mappy Python API do not work. In the tests, results in mappings
-    # that make FPs turn into TPs.
-    # The options 1,1,5,3 are actually the defaults from bowtie2 and seem to work.
-    #
-    # k=15 and w=10 are the CLI defaults. On the test data, these values result
-    # in the probes near the start of the genome getting mapped, whereas those
-    # probes do not get mapped using whatever the Python defaults are.
-    #
-    # extra_flags=0x4000000 turns on extended cigars, which we use to more easily
-    # determine where the matches and mismatches are between the probe and truth
-    # reference.
-    mapper = mappy.Aligner(
-        fn_idx_in=truth_ref_fasta,
-        k=15,
-        w=10,
-        preset="sr",
-        n_threads=1,
-        extra_flags=0x4000000,
-        scoring=[1, 1, 5, 3],
-    )
-    header_lines = next(probes_and_vcf_reader)
-
     if map_outfile is not None:
         f_map = open(map_outfile, "w")
     else:
         f_map = None
+    disk_cache = open_probe_hit_cache(
+        probe_hit_cache, truth_ref_fasta, probe_hit_cache_size
+    )
 
-    new_header_lines = [
-        '##FORMAT=<ID=VFR_IN_MASK,Number=1,Type=String,Description="Whether or not the variant is in the truth genome mask">',
-        '##FORMAT=<ID=VFR_RESULT,Number=1,Type=String,Description="FP, TP, or Partial_TP when part of the allele matches the truth reference">',
-        '##FORMAT=<ID=VFR_ALLELE_LEN,Number=1,Type=Integer,Description="Number of positions in allele that were checked if they match the truth">',
-        '##FORMAT=<ID=VFR_ALLELE_MATCH_COUNT,Number=1,Type=String,Description="Number of positions in allele that match the truth">',
-        '##FORMAT=<ID=VFR_ALLELE_MATCH_FRAC,Number=1,Type=String,Description="Fraction of positions in allele that match the truth">',
-        '##FORMAT=<ID=VFR_ED_RA,Number=1,Type=String,Description="Edit distance between ref and alt allele (using the called allele where more than one alt)">',
-        '##FORMAT=<ID=VFR_ED_TR,Number=1,Type=String,Description="Edit distance between truth and ref allele">',
-        '##FORMAT=<ID=VFR_ED_TA,Number=1,Type=String,Description="Edit distance between truth and alt allele">',
-        '##FORMAT=<ID=VFR_ED_SCORE,Number=1,Type=String,Description="Edit distance score">',
-    ]
+    annotated_records = annotated_vcf_records(
+        vcf_in,
+        vcf_ref_fasta,
+        truth_ref_fasta,
+        flank_length,
+        f_map=f_map,
+        use_fail_conflict=use_fail_conflict,
+        truth_mask=truth_mask,
+        max_flank_length=max_flank_length,
+        truth_windows=truth_windows,
+        disk_cache=disk_cache,
+        precomputed_probes=precomputed_probes,
+    )
 
     with open(vcf_out, "w") as f_vcf:
-        print(
-            *header_lines[:-1],
-            *new_header_lines,
-            header_lines[-1],
-            sep="\n",
-            file=f_vcf,
+        print(*next(annotated_records), sep="\n", file=f_vcf)
+        for vcf_record in annotated_records:
+            print(vcf_record, file=f_vcf)
+
+    if map_outfile is not None:
+        f_map.close()
+    if disk_cache is not None:
+        disk_cache.close()
+
+
+def annotate_vcf_files_with_probe_mapping(
+    vcfs_in,
+    vcf_ref_fasta,
+    truth_ref_fastas,
+    flank_length,
+    vcfs_out,
+    use_fail_conflict=False,
+    truth_mask=None,
+    max_flank_length=None,
+    probe_hit_cache=None,
+    probe_hit_cache_size=1000000,
+    map_outfiles=None,
+):
+    """Same as annotate_vcf_with_probe_mapping(), but for a list of VCF
+    files vcfs_in (all using reference vcf_ref_fasta), and corresponding lists
+    of truth FASTA files and output files. The files are annotated together,
+    in order of reference position. VCF files that have the same truth FASTA
+    share their probe hits, so a probe that is the same in more than one file
+    (eg the same call in different samples) is only mapped once.
+    map_outfiles can be a list of debugging output files, one per VCF file"""
+    hit_caches = {x: collections.OrderedDict() for x in truth_ref_fastas}
+    disk_caches = {
+        x: open_probe_hit_cache(probe_hit_cache, x, probe_hit_cache_size)
+        for x in truth_ref_fastas
+    }
+    contig_order = {name: i for i, name in enumerate(registry.get_seqs(vcf_ref_fasta))}
+    if map_outfiles is None:
+        map_files = [None] * len(vcfs_in)
+    else:
+        map_files = [open(x, "w") for x in map_outfiles]
+    generators = [
+        annotated_vcf_records(
+            vcf_in,
+            vcf_ref_fasta,
+            truth_fasta,
+            flank_length,
+            f_map=f_map,
+            use_fail_conflict=use_fail_conflict,
+            truth_mask=truth_mask,
+            hit_cache=hit_caches[truth_fasta],
+            max_flank_length=max_flank_length,
+            disk_cache=disk_caches[truth_fasta],
         )
+        for vcf_in, truth_fasta, f_map in zip(vcfs_in, truth_ref_fastas, map_files)
+    ]
+    out_files = [open(x, "w") for x in vcfs_out]
+    for generator, f in zip(generators, out_files):
+        print(*next(generator), sep="\n", file=f)
 
-        for (vcf_record, ref_probe, alt_probe) in probes_and_vcf_reader:
-            evaluate_vcf_record(
+    def keyed_records(i, generator):
+        for record in generator:
+            yield (contig_order.get(record.CHROM, -1), record.POS), i, record
+
+    merged = heapq.merge(*[keyed_records(i, x) for i, x in enumerate(generators)])
+    for _, i, record in merged:
+        print(record, file=out_files[i])
+
+    for f in out_files + [x for x in map_files if x is not None]:
+        f.close()
+    for disk_cache in disk_caches.values():
+        if disk_cache is not None:
+            disk_cache.close()
+
+
+def annotate_vcf_with_probe_mapping_to_truths(
+    vcf_in,
+    vcf_ref_fasta,
+    truth_ref_fastas,
+    flank_length,
+    vcfs_out,
+    use_fail_conflict=False,
+    truth_masks=None,
+    max_flank_length=None,
+    probe_hit_cache=None,
+    probe_hit_cache_size=1000000,
+    threads=1,
+    map_outfiles=None,
+):
+    """Same as annotate_vcf_with_probe_mapping(), but annotates vcf_in
+    against each truth genome in the list truth_ref_fastas, writing the
+    results to the corresponding file in the list vcfs_out. truth_masks and
+    map_outfiles (if used) are lists of masks and debugging output files,
+    one per truth genome. The VCF file is only read,
+    and the probes only made, once. The probes are then mapped to the truth
+    genomes using up to threads at once. If max_flank_length is used, then
+    probes depend on the truth genome, so are made separately for each one"""
+    if truth_masks is None:
+        truth_masks = [None] * len(truth_ref_fastas)
+    if map_outfiles is None:
+        map_outfiles = [None] * len(truth_ref_fastas)
+    header_lines, vcf_records = vcf_record.vcf_file_to_list(vcf_in)
+    header_lines = header_lines[:-1] + annotation_header_lines + header_lines[-1:]
+    vcf_ref_seqs = registry.get_seqs(vcf_ref_fasta)
+    if max_flank_length is None:
+        probes = list(probes_for_vcf_records(vcf_records, vcf_ref_seqs, flank_length))
+    else:
+        probes = None
+
+    def annotate(truth_fasta, truth_mask, vcf_out, map_outfile):
+        truth_seqs = registry.get_seqs(truth_fasta)
+        f_map = None if map_outfile is None else open(map_outfile, "w")
+        mapper = LazyMapper(lambda: get_probe_mapper(truth_fasta))
+        # Each thread has its own caches. The disk cache must be opened in
+        # the thread that uses it
+        disk_cache = open_probe_hit_cache(
+            probe_hit_cache, truth_fasta, probe_hit_cache_size
+        )
+        hit_cache = collections.OrderedDict()
+        # Records are annotated in place, so each truth needs its own copies
+        records = [vcf_record.VcfRecord(str(x)) for x in vcf_records]
+        if probes is None:
+            annotated = annotate_vcf_records(
+                records,
+                vcf_ref_seqs,
+                truth_seqs,
                 mapper,
-                vcf_record,
-                ref_probe,
-                alt_probe,
-                vcf_ref_seqs[vcf_record.CHROM],
-                truth_ref_seqs,
-                map_outfile=f_map,
+                flank_length,
+                f_map=f_map,
                 use_fail_conflict=use_fail_conflict,
                 truth_mask=truth_mask,
+                hit_cache=hit_cache,
+                max_flank_length=max_flank_length,
+                disk_cache=disk_cache,
             )
-            print(vcf_record, file=f_vcf)
-
-    if map_outfile is not None:
-        f_map.close()
+        else:
+            annotated = records
+            for record, (_, ref_probe, alt_probe) in zip(records, probes):
+                evaluate_vcf_record(
+                    mapper,
+                    record,
+                    ref_probe,
+                    alt_probe,
+                    vcf_ref_seqs[record.CHROM],
+                    truth_seqs,
+                    map_outfile=f_map,
+                    use_fail_conflict=use_fail_conflict,
+                    truth_mask=truth_mask,
+                    hit_cache=hit_cache,
+                    disk_cache=disk_cache,
+                )
+
+        with open(vcf_out, "w") as f:
+            print(*header_lines, sep="\n", file=f)
+            for record in annotated:
+                print(record, file=f)
+        if f_map is not None:
+            f_map.close()
+        if disk_cache is not None:
+            disk_cache.close()
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+        futures = [
+            executor.submit(annotate, *x)
+            for x in zip(truth_ref_fastas, truth_masks, vcfs_out, map_outfiles)
+        ]
+        for future in futures:
+            future.result()
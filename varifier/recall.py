@@ -1,19 +1,28 @@
+import bisect
 import logging
 import operator
 import os
 
 import pyfastaq
-from cluster_vcf_records import vcf_file_read
 
-from varifier import probe_mapping, truth_variant_finding, utils
+from varifier import (
+    checkpoint,
+    registry,
+    scratch,
+    truth_probes,
+    vcf_record,
+)
 
 
 def _vcf_file_to_dict(vcf_file):
     """Loads VCF file. Returns a dictionary of sequence name -> sorted list
     by position of variants"""
-    records = {}
+    header_lines, vcf_records = vcf_record.vcf_file_to_list(vcf_file)
+    return _vcf_records_to_dict(vcf_records)
+
 
-    header_lines, vcf_records = vcf_file_read.vcf_file_to_list(vcf_file)
+def _vcf_records_to_dict(vcf_records):
+    records = {}
     for record in vcf_records:
         if record.CHROM not in records:
             records[record.CHROM] = []
@@ -25,53 +34,147 @@ def _vcf_file_to_dict(vcf_file):
     return records
 
 
-def apply_variants_to_genome(ref_fasta, vcf_file, out_fasta):
+def apply_variants_to_genome(ref_fasta, vcf_file, out_fasta, vcf_records=None):
     """Takes the variants in vcf_file, and applies them to the associated
     reference genome in ref_fasta. Writes a new file out_fasta that has those
-    variants applied"""
-    ref_sequences = utils.file_to_dict_of_seqs(ref_fasta)
-    vcf_dict = _vcf_file_to_dict(vcf_file)
+    variants applied. If vcf_records (a list of the VcfRecords in vcf_file)
+    is given, it is used instead of reading vcf_file"""
+    ref_sequences = registry.get_seqs(ref_fasta)
+    if vcf_records is None:
+        vcf_records = _vcf_file_to_dict(vcf_file)
+    mutated_seqs = apply_variants_to_seqs(ref_sequences, vcf_records)
     with open(out_fasta, "w") as f:
-        for ref_name, vcf_records in sorted(vcf_dict.items()):
-            old_seq = ref_sequences[ref_name]
-            new_seq = list(old_seq.seq)
-            previous_ref_start = None
-            # Applying indels messes up the coords of any subsequent variant,
-            # so start at the end and work backwards
-            for vcf_record in reversed(vcf_records):
-                genotype = set(vcf_record.FORMAT["GT"].split("/"))
-                assert len(genotype) == 1
-                allele_index = int(genotype.pop())
-                if allele_index == 0:
-                    continue
-
-                # Some tools report two (or more) variants that overlap.
-                # No clear "right" option here.
-                # If the current record overlaps the previous one, ignore it.
-                # We could try to be cleverer about this (take best records
-                # based on likelihoods or whatever else), but every tool is
-                # different so no sane consistent way of doing this across tools
-                if (
-                    previous_ref_start is not None
-                    and vcf_record.ref_end_pos() >= previous_ref_start
-                ):
-                    logging.warn(
-                        f"Skipping this record when calculating recall because it overlaps another record: {vcf_record}"
-                    )
-                    continue
-
-                previous_ref_start = vcf_record.POS
-                allele = vcf_record.ALT[allele_index - 1]
-                start, end = vcf_record.POS, vcf_record.ref_end_pos() + 1
-                assert old_seq[start:end] == "".join(new_seq[start:end])
-                new_seq[start:end] = [allele]
-            new_seq = pyfastaq.sequences.Fasta(f"{ref_name}.mutated", "".join(new_seq))
-            print(new_seq, file=f)
+        for name, seq in mutated_seqs.items():
+            print(pyfastaq.sequences.Fasta(name, seq), file=f)
 
 
-def get_recall(
+def apply_variants_to_seqs(ref_sequences, vcf_records):
+    """Same as apply_variants_to_genome(), but in memory. ref_sequences is a
+    dictionary of sequence name -> sequence. vcf_records is either a list
+    of VcfRecords, or a dictionary made by _vcf_records_to_dict(). Returns a
+    dictionary of mutated sequence name -> mutated sequence, only for the
+    sequences that have variants, named <name>.mutated"""
+    if isinstance(vcf_records, dict):
+        vcf_dict = vcf_records
+    else:
+        vcf_dict = _vcf_records_to_dict(vcf_records)
+
+    mutated_seqs = {}
+    for ref_name, vcf_records in sorted(vcf_dict.items()):
+        old_seq = ref_sequences[ref_name]
+        new_seq = list(old_seq[:])
+        # Applying indels messes up the coords of any subsequent variant,
+        # so start at the end and work backwards
+        for start, end, allele in _edits_to_apply(vcf_records):
+            assert old_seq[start:end] == "".join(new_seq[start:end])
+            new_seq[start:end] = [allele]
+        mutated_seqs[f"{ref_name}.mutated"] = "".join(new_seq)
+    return mutated_seqs
+
+
+def _edits_to_apply(vcf_records, warn=True):
+    """Takes a list of VcfRecords from one reference sequence, sorted by
+    POS. Yields tuple (start, end, allele) of each change that
+    apply_variants_to_seqs() makes to the sequence, meaning replace
+    start - (end - 1) with allele. Yields them from last to first.
+    If warn is True, logs a warning for each record that is skipped"""
+    previous_ref_start = None
+    for vcf_record in reversed(vcf_records):
+        genotype = set(vcf_record.FORMAT["GT"].split("/"))
+        assert len(genotype) == 1
+        allele_index = int(genotype.pop())
+        if allele_index == 0:
+            continue
+
+        # Some tools report two (or more) variants that overlap.
+        # No clear "right" option here.
+        # If the current record overlaps the previous one, ignore it.
+        # We could try to be cleverer about this (take best records
+        # based on likelihoods or whatever else), but every tool is
+        # different so no sane consistent way of doing this across tools
+        if (
+            previous_ref_start is not None
+            and vcf_record.ref_end_pos() >= previous_ref_start
+        ):
+            if warn:
+                logging.warn(
+                    f"Skipping this record when calculating recall because it overlaps another record: {vcf_record}"
+                )
+            continue
+
+        previous_ref_start = vcf_record.POS
+        allele = vcf_record.ALT[allele_index - 1]
+        yield vcf_record.POS, vcf_record.ref_end_pos() + 1, allele
+
+
+def mutated_ref_windows(vcf_records):
+    """Takes the VcfRecords used to make a mutated genome with
+    apply_variants_to_seqs() (a list, or a dictionary made by
+    _vcf_records_to_dict()). Returns a function that takes a region
+    (ref name, start, end) of the reference (0-based, inclusive coords),
+    and returns the same region (mutated name, start, end) of the mutated
+    genome, or None if that sequence has no variants. The positions are
+    found from the offsets of the changes that were made to the reference,
+    instead of by mapping. A position inside a changed allele goes to the
+    start of the new allele"""
+    if isinstance(vcf_records, dict):
+        vcf_dict = vcf_records
+    else:
+        vcf_dict = _vcf_records_to_dict(vcf_records)
+
+    # For each sequence, the ref start and end of each change, and the total
+    # change in length from all changes up to and including it
+    offsets = {}
+    for ref_name, records in vcf_dict.items():
+        starts, ends, total_offsets = [], [], []
+        total = 0
+        for start, end, allele in reversed(list(_edits_to_apply(records, False))):
+            total += len(allele) - (end - start)
+            starts.append(start)
+            ends.append(end)
+            total_offsets.append(total)
+        offsets[ref_name] = starts, ends, total_offsets
+
+    def mutated_pos(ref_name, pos):
+        starts, ends, total_offsets = offsets[ref_name]
+        i = bisect.bisect_right(starts, pos) - 1
+        if i < 0:
+            return pos
+        if pos < ends[i]:
+            return starts[i] + (total_offsets[i - 1] if i > 0 else 0)
+        return pos + total_offsets[i]
+
+    def mutated_window(ref_name, start, end):
+        if ref_name not in offsets:
+            return None
+        return (
+            f"{ref_name}.mutated",
+            mutated_pos(ref_name, start),
+            mutated_pos(ref_name, end),
+        )
+
+    return mutated_window
+
+
+def make_mutated_ref(
+    ref_fasta, vcf_to_test, mutated_ref_fasta, resume=False, vcf_records=None
+):
+    """Runs apply_variants_to_genome() as a checkpointed stage"""
+    checkpoint.run_stage(
+        [mutated_ref_fasta],
+        [ref_fasta, vcf_to_test],
+        None,
+        resume,
+        apply_variants_to_genome,
+        ref_fasta,
+        vcf_to_test,
+        mutated_ref_fasta,
+        vcf_records=vcf_records,
+    )
+
+
+def get_truth_vcf(
     ref_fasta,
-    vcf_to_test,
     outdir,
     flank_length,
     truth_fasta=None,
@@ -79,11 +182,24 @@ def get_recall(
     debug=False,
     truth_mask=None,
     max_ref_len=None,
+    resume=False,
+    threads=1,
+    max_flank_length=None,
+    local_probe_mapping=False,
+    probe_hit_cache=None,
+    probe_hit_cache_size=1000000,
+    keep="all",
+    truth_mask_bed_file=None,
 ):
-    os.mkdir(outdir)
-
+    """Returns the name of the truth VCF file to use for recall. This is
+    truth_vcf if it is not None, otherwise it is made from truth_fasta in
+    outdir/truth_vcf/"""
     if truth_vcf is None:
         assert truth_fasta is not None
+        # Imported here because making the truth VCF needs dependencies that
+        # are slow to load (and MUMmer), which are not needed otherwise
+        from varifier import truth_variant_finding
+
         truth_outdir = os.path.join(outdir, "truth_vcf")
         truth_vcf = truth_variant_finding.make_truth_vcf(
             ref_fasta,
@@ -93,21 +209,177 @@ def get_recall(
             debug=debug,
             truth_mask=truth_mask,
             max_ref_len=max_ref_len,
+            resume=resume,
+            threads=threads,
+            max_flank_length=max_flank_length,
+            local_probe_mapping=local_probe_mapping,
+            probe_hit_cache=probe_hit_cache,
+            probe_hit_cache_size=probe_hit_cache_size,
+            keep=keep,
+            truth_mask_bed_file=truth_mask_bed_file,
         )
     else:
         assert truth_fasta is None
+    return truth_vcf
 
-    mutated_ref_fasta = os.path.join(outdir, "ref_with_mutations_added.fa")
-    apply_variants_to_genome(ref_fasta, vcf_to_test, mutated_ref_fasta)
 
-    vcf_out = os.path.join(outdir, "recall.vcf")
-    map_outfile = os.path.join(outdir, "probe_map_debug.txt") if debug else None
-    probe_mapping.annotate_vcf_with_probe_mapping(
-        truth_vcf,
+def get_recall(
+    ref_fasta,
+    vcf_to_test,
+    outdir,
+    flank_length,
+    truth_fasta=None,
+    truth_vcf=None,
+    debug=False,
+    truth_mask=None,
+    max_ref_len=None,
+    resume=False,
+    threads=1,
+    max_flank_length=None,
+    local_probe_mapping=False,
+    probe_hit_cache=None,
+    probe_hit_cache_size=1000000,
+    keep="all",
+    mutated_ref_fasta=None,
+    ref_mask_bed_file=None,
+    strata_bed_files=None,
+    vcf_records=None,
+    truth_mask_bed_file=None,
+):
+    """Annotates the truth VCF (made from truth_fasta if truth_vcf is None)
+    for recall of the calls in vcf_to_test. Returns tuple (name of the
+    annotated VCF file, recall summary stats). If mutated_ref_fasta is given,
+    it should be the output of apply_variants_to_genome() for vcf_to_test,
+    and is used instead of making it again (eg when vcf_to_test is compared
+    to more than one truth genome). It is then left for the caller to delete.
+    vcf_records can be the list of VcfRecords in vcf_to_test, so that the
+    file is not read again.
+    If ref_mask_bed_file is given, truth variants in the mask are not
+    counted, and the returned VCF file is the annotated VCF after masking
+    (the one before masking is then only kept if keep is "all").
+    strata_bed_files can be a dictionary of stratum name -> BED file, to
+    add the stats of each stratum to the summary stats (see
+    vcf_evaluate.evaluate_vcf()).
+    If local_probe_mapping is True, then truth probes are first mapped to
+    just the region of the mutated genome where they should be, which is
+    known from the changes made to the reference (see
+    mutated_ref_windows()), instead of to the whole mutated genome. The
+    probes then only need to map uniquely in their region (see
+    probe_mapping.annotated_vcf_records())"""
+    # Imported here because vcf_evaluate imports this module
+    from varifier import vcf_evaluate
+
+    scratch.check_can_resume(resume, keep)
+    if not (resume and os.path.exists(outdir)):
+        os.mkdir(outdir)
+
+    truth_vcf = get_truth_vcf(
         ref_fasta,
-        mutated_ref_fasta,
+        outdir,
         flank_length,
-        vcf_out,
-        map_outfile=map_outfile,
+        truth_fasta=truth_fasta,
+        truth_vcf=truth_vcf,
+        debug=debug,
+        truth_mask=truth_mask,
+        max_ref_len=max_ref_len,
+        resume=resume,
+        threads=threads,
+        max_flank_length=max_flank_length,
+        local_probe_mapping=local_probe_mapping,
+        probe_hit_cache=probe_hit_cache,
+        probe_hit_cache_size=probe_hit_cache_size,
+        keep=keep,
+        truth_mask_bed_file=truth_mask_bed_file,
     )
-    return vcf_out
+
+    made_mutated_ref = mutated_ref_fasta is None
+    if made_mutated_ref:
+        mutated_ref_fasta = os.path.join(outdir, "ref_with_mutations_added.fa")
+        make_mutated_ref(
+            ref_fasta, vcf_to_test, mutated_ref_fasta, resume, vcf_records=vcf_records
+        )
+
+    if strata_bed_files is None:
+        strata_bed_files = {}
+    vcf_out = os.path.join(outdir, "recall.vcf")
+    masked_vcf_out = f"{vcf_out}.masked.vcf"
+    if ref_mask_bed_file is None:
+        outfiles = [vcf_out]
+    elif keep == "all":
+        outfiles = [vcf_out, masked_vcf_out]
+    else:
+        outfiles = [masked_vcf_out]
+
+    def annotate():
+        if local_probe_mapping:
+            if vcf_records is None:
+                called = _vcf_file_to_dict(vcf_to_test)
+            else:
+                called = vcf_records
+            truth_windows = mutated_ref_windows(called)
+        else:
+            truth_windows = None
+        header_lines, records = vcf_record.vcf_file_to_list(truth_vcf)
+        return vcf_evaluate._annotate_and_summarise(
+            header_lines,
+            records,
+            registry.get_seqs(ref_fasta),
+            mutated_ref_fasta,
+            flank_length,
+            vcf_out if vcf_out in outfiles else None,
+            for_recall=True,
+            masked_vcf_out=masked_vcf_out,
+            ref_mask=(
+                None
+                if ref_mask_bed_file is None
+                else registry.get_mask(ref_mask_bed_file)
+            ),
+            map_outfile=(
+                os.path.join(outdir, "probe_map_debug.txt") if debug else None
+            ),
+            max_flank_length=max_flank_length,
+            # The probe hit cache is not used for mapping to the mutated
+            # genome. It is different in every run, so its hits could never
+            # be used again, and would push useful hits out of the cache
+            probe_hit_cache=None,
+            precomputed_probes=truth_probes.load_truth_probes(
+                truth_vcf, ref_fasta, flank_length
+            ),
+            truth_windows=truth_windows,
+            strata=(
+                None
+                if len(strata_bed_files) == 0
+                else {
+                    name: registry.get_bed_intervals(bed_file)
+                    for name, bed_file in strata_bed_files.items()
+                }
+            ),
+        )
+
+    try:
+        recall_stats = checkpoint.run_stage(
+            outfiles,
+            [
+                truth_vcf,
+                ref_fasta,
+                mutated_ref_fasta,
+                ref_mask_bed_file,
+                *strata_bed_files.values(),
+            ],
+            {
+                "flank_length": flank_length,
+                "max_flank_length": max_flank_length,
+                "local_probe_mapping": local_probe_mapping,
+                "strata": strata_bed_files,
+            },
+            resume,
+            annotate,
+        )
+    finally:
+        # The mutated genome is only used here, so don't keep it in memory,
+        # even if there was an error (eg in a long-running server)
+        if made_mutated_ref:
+            registry.forget(mutated_ref_fasta)
+    if made_mutated_ref:
+        scratch.remove_intermediate_files(keep, mutated_ref_fasta)
+    return outfiles[-1], recall_stats
@@ -0,0 +1,115 @@
+import json
+import logging
+import os
+import threading
+
+import mappy
+
+from varifier import utils
+
+# Process-wide store of loaded sequences, masks and mappy aligners, so that
+# each file is only parsed and indexed once per process. Keys are tuples
+# (kind, absolute path, size, mtime, params). Everything handed out by this
+# module is shared, so must be treated as read-only by the caller.
+_registry = {}
+_lock = threading.Lock()
+# Key -> lock held while that key is being loaded. Loading is done without
+# holding _lock, so that building one index does not block getting anything
+# else from the registry
+_loading = {}
+
+
+def _file_key(filename):
+    stat = os.stat(filename)
+    return os.path.abspath(filename), stat.st_size, stat.st_mtime_ns
+
+
+def _get(kind, filename, params, loader):
+    path, size, mtime = _file_key(filename)
+    key = (kind, path, size, mtime, params)
+    with _lock:
+        if key in _registry:
+            return _registry[key]
+        key_lock = _loading.setdefault(key, threading.Lock())
+
+    # If another thread is already loading the same key, this waits for it
+    # to finish, and then uses what it loaded
+    with key_lock:
+        with _lock:
+            if key in _registry:
+                return _registry[key]
+        logging.debug(f"Loading {kind} from {filename}")
+        try:
+            value = loader()
+            with _lock:
+                # If the file has changed since it was last loaded, forget
+                # everything loaded from the old version(s). Other things
+                # loaded from this version (eg aligners with different
+                # options) are kept
+                for old_key in [
+                    k for k in _registry if k[1] == path and k[2:4] != (size, mtime)
+                ]:
+                    del _registry[old_key]
+                _registry[key] = value
+        finally:
+            # Also done if loading failed, so that the lock is not kept
+            with _lock:
+                _loading.pop(key, None)
+        return value
+
+
+def get_seqs(filename):
+    """Returns the dictionary of sequence name -> pyfastaq.sequences.Fasta
+    made by utils.file_to_dict_of_seqs(filename). Only loaded the first
+    time it is needed"""
+    return _get("seqs", filename, None, lambda: utils.file_to_dict_of_seqs(filename))
+
+
+def get_aligner(filename, **kwargs):
+    """Returns a mappy.Aligner for the FASTA file filename, made using
+    mappy.Aligner(fn_idx_in=filename, **kwargs). Only built the first time
+    it is needed for the same file and kwargs"""
+
+    def make_aligner():
+        aligner = mappy.Aligner(fn_idx_in=filename, **kwargs)
+        if not aligner:
+            raise Exception(f"Error loading/building index for {filename}")
+        return aligner
+
+    params = json.dumps(kwargs, sort_keys=True)
+    return _get("aligner", filename, params, make_aligner)
+
+
+def get_mask(filename):
+    """Returns the mask made by utils.load_mask_bed_file(filename). Only
+    loaded the first time it is needed"""
+    return _get("mask", filename, None, lambda: utils.load_mask_bed_file(filename))
+
+
+def get_bed_intervals(filename):
+    """Returns the intervals made by utils.load_bed_intervals(filename).
+    Only loaded the first time it is needed"""
+    return _get(
+        "bed_intervals", filename, None, lambda: utils.load_bed_intervals(filename)
+    )
+
+
+def loaded():
+    """Returns a sorted list of (kind, absolute path) of everything that is
+    currently loaded"""
+    with _lock:
+        return sorted((k[0], k[1]) for k in _registry)
+
+
+def forget(filename):
+    """Removes everything that was loaded from filename"""
+    path = os.path.abspath(filename)
+    with _lock:
+        for key in [k for k in _registry if k[1] == path]:
+            del _registry[key]
+
+
+def clear():
+    """Removes everything from the registry"""
+    with _lock:
+        _registry.clear()
@@ -0,0 +1,92 @@
+import contextlib
+import logging
+import os
+import shutil
+import tempfile
+
+from varifier import checkpoint
+
+# What to keep in the output directory when a run finishes:
+#  all = every file, including intermediate files (the default).
+#  final = the final results, eg the annotated VCF files, the VCF of calls
+#    that were excluded by filtering, and summary stats.
+#    Intermediate files are deleted as soon as they have been used.
+#  none = only the main result file(s), eg summary_stats.json.
+KEEP_CHOICES = ["none", "final", "all"]
+
+
+def remove_intermediate_files(keep, *filenames):
+    """Unless keep is "all", deletes each file in filenames, and the
+    checkpoint file that goes with it. Files that do not exist are ignored"""
+    if keep == "all":
+        return
+    assert keep in KEEP_CHOICES
+    for filename in filenames:
+        for x in filename, checkpoint.checkpoint_file(filename):
+            if os.path.exists(x):
+                logging.debug(f"Deleting intermediate file {x}")
+                os.unlink(x)
+
+
+def check_can_resume(resume, keep, tmpdir=None):
+    """Raises an error if resume is True, but the files needed to resume are
+    not kept. Stages are only skipped if their output files are still there,
+    so deleting intermediate files would make every resumed run start again
+    from the first stage that made one of them"""
+    if not resume:
+        return
+    if tmpdir is not None:
+        raise Exception(
+            "Cannot resume when using a temporary directory, because intermediate files are not kept between runs"
+        )
+    if keep != "all":
+        raise Exception(
+            f'Cannot resume when keep is "{keep}", because intermediate files are deleted. Resuming needs keep to be "all"'
+        )
+
+
+def _remove_all_except(directory, keep_files):
+    """Deletes everything in directory, except the files keep_files (which
+    are relative to directory). Empty directories are removed"""
+    for root, dirs, files in os.walk(directory, topdown=False):
+        for filename in files:
+            path = os.path.join(root, filename)
+            if os.path.relpath(path, directory) not in keep_files:
+                os.unlink(path)
+        if root != directory and len(os.listdir(root)) == 0:
+            os.rmdir(root)
+
+
+@contextlib.contextmanager
+def output_dir(outdir, tmpdir=None, keep="all", resume=False, force=False, results=()):
+    """Context manager that makes the output directory outdir and yields the
+    name of the directory where files should be written.
+    If tmpdir is None, that is outdir. Otherwise files are written to a new
+    directory inside tmpdir, which is moved into outdir when the context
+    exits without an error, and always deleted afterwards.
+    If keep is "none", then at the end all files except results (paths
+    relative to outdir) are deleted"""
+    assert keep in KEEP_CHOICES
+    check_can_resume(resume, keep, tmpdir=tmpdir)
+    if force:
+        shutil.rmtree(outdir, ignore_errors=True)
+
+    if tmpdir is None:
+        if not (resume and os.path.exists(outdir)):
+            os.mkdir(outdir)
+        yield outdir
+        if keep == "none":
+            _remove_all_except(outdir, set(results))
+        return
+
+    os.mkdir(outdir)
+    workdir = tempfile.mkdtemp(prefix="varifier.", dir=tmpdir)
+    logging.info(f"Writing intermediate files to temporary directory {workdir}")
+    try:
+        yield workdir
+        if keep == "none":
+            _remove_all_except(workdir, set(results))
+        for filename in os.listdir(workdir):
+            shutil.move(os.path.join(workdir, filename), outdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
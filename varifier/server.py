@@ -0,0 +1,307 @@
+import concurrent.futures
+import http.client
+import http.server
+import json
+import logging
+import os
+import signal
+import socket
+import socketserver
+import tempfile
+import threading
+
+import varifier
+from varifier import probe_mapping, registry, vcf_evaluate
+
+# A job is a JSON object of evaluate_vcf() arguments. Only these arguments
+# can be used, and the first three must be given. Anything that deletes or
+# reuses existing files (eg force, resume), or writes outside the server's
+# directories (eg tmpdir, probe_hit_cache) is not allowed. outdir is
+# optional, and is the name of a new directory inside the server's outdir.
+# If there is no outdir, the job is run in a temporary directory that is
+# deleted afterwards
+_required_job_keys = ["vcf_to_eval", "vcf_ref_fasta", "truth_ref_fasta"]
+_allowed_job_keys = _required_job_keys + [
+    "flank_length",
+    "outdir",
+    "truth_vcf",
+    "debug",
+    "ref_mask_bed_file",
+    "truth_mask_bed_file",
+    "discard_ref_calls",
+    "max_recall_ref_len",
+    "filter_pass",
+    "threads",
+    "max_flank_length",
+    "local_probe_mapping",
+    "keep",
+    "filter_policies",
+    "strata_bed_files",
+]
+_default_flank_length = 100
+_host = "127.0.0.1"
+
+
+def _job_kwargs(job, outdir_root=None):
+    """Checks that job (decoded from JSON) is a valid job and returns the
+    keyword arguments for evaluate_vcf() that it describes. outdir_root is
+    the directory where jobs can make their output directory"""
+    if not isinstance(job, dict):
+        raise Exception("Job must be a JSON object")
+    not_allowed = sorted(set(job) - set(_allowed_job_keys))
+    if len(not_allowed) > 0:
+        raise Exception(f"Option(s) not allowed in job: {', '.join(not_allowed)}")
+    missing = [x for x in _required_job_keys if x not in job]
+    if len(missing) > 0:
+        raise Exception(f"Missing option(s) in job: {', '.join(missing)}")
+
+    kwargs = dict(job)
+    kwargs.setdefault("flank_length", _default_flank_length)
+    if kwargs.get("outdir") is not None:
+        if outdir_root is None:
+            raise Exception("outdir cannot be used, because the server has no outdir")
+        outdir = kwargs["outdir"]
+        if (
+            not isinstance(outdir, str)
+            or outdir in {"", ".", ".."}
+            or os.sep in outdir
+            or (os.altsep is not None and os.altsep in outdir)
+        ):
+            raise Exception(f"outdir must be the name of a directory, got: {outdir}")
+        kwargs["outdir"] = os.path.join(outdir_root, outdir)
+        if os.path.lexists(kwargs["outdir"]):
+            raise Exception(f"outdir already exists: {outdir}")
+    if kwargs.get("filter_pass") is not None:
+        kwargs["filter_pass"] = set(kwargs["filter_pass"])
+    if kwargs.get("filter_policies") is not None:
+        kwargs["filter_policies"] = {
+            name: None if filter_pass is None else set(filter_pass)
+            for name, filter_pass in kwargs["filter_policies"].items()
+        }
+    for key in "vcf_to_eval", "vcf_ref_fasta", "truth_ref_fasta", "truth_vcf":
+        if kwargs.get(key) is not None and not os.path.exists(kwargs[key]):
+            raise Exception(f"File not found: {kwargs[key]}")
+    return kwargs
+
+
+def run_job(kwargs, tmpdir=None):
+    """Runs evaluate_vcf(**kwargs) and returns the summary stats. If
+    kwargs has no outdir, a temporary directory in tmpdir is used"""
+    if kwargs.get("outdir") is not None:
+        vcf_evaluate.evaluate_vcf(**kwargs)
+        with open(os.path.join(kwargs["outdir"], "summary_stats.json")) as f:
+            return json.load(f)
+
+    with tempfile.TemporaryDirectory(prefix="varifier.serve.", dir=tmpdir) as d:
+        return run_job({**kwargs, "outdir": os.path.join(d, "eval")})
+
+
+def preload(fasta_files=None, mask_bed_files=None):
+    """Loads the sequences and probe mapping index of each FASTA file, and
+    each mask BED file, so that the first job that uses them does not have
+    to wait"""
+    for filename in fasta_files or []:
+        logging.info(f"Loading sequences and index of {filename}")
+        registry.get_seqs(filename)
+        probe_mapping.get_probe_mapper(filename)
+    for filename in mask_bed_files or []:
+        logging.info(f"Loading mask {filename}")
+        registry.get_mask(filename)
+
+
+class _RequestHandler(http.server.BaseHTTPRequestHandler):
+    """Handles the requests "POST /eval" (body is a job, response is the
+    summary stats) and "GET /status". Errors are returned as a JSON object
+    {"error": message}"""
+
+    def _send_json(self, code, data):
+        body = json.dumps(data, indent=2).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path != "/status":
+            self._send_json(404, {"error": f"Not found: {self.path}"})
+            return
+        self._send_json(200, self.server.status())
+
+    def do_POST(self):
+        if self.path != "/eval":
+            self._send_json(404, {"error": f"Not found: {self.path}"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            kwargs = _job_kwargs(
+                json.loads(self.rfile.read(length)),
+                outdir_root=self.server.outdir_root,
+            )
+        except Exception as e:
+            self._send_json(400, {"error": str(e)})
+            return
+
+        try:
+            summary_stats = self.server.submit(kwargs).result()
+        except Exception as e:
+            logging.exception(f"Job failed: {kwargs['vcf_to_eval']}")
+            self._send_json(500, {"error": str(e)})
+            return
+        self._send_json(200, summary_stats)
+
+    def log_message(self, format, *args):
+        # The default writes to stderr, using the client address, which
+        # does not exist for a unix socket
+        logging.debug("Request: " + format % args)
+
+
+class _ServerMixin:
+    """Runs jobs on a pool of worker threads. They are threads and not
+    processes, so that every job uses the same loaded sequences and
+    indexes in the registry"""
+
+    daemon_threads = True
+
+    def setup_jobs(self, workers, tmpdir, outdir_root):
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        self.workers = workers
+        self.tmpdir = tmpdir
+        self.outdir_root = outdir_root
+        self.job_counts = {"queued": 0, "running": 0, "done": 0, "failed": 0}
+        self.job_counts_lock = threading.Lock()
+
+    def _count(self, from_key, to_key):
+        with self.job_counts_lock:
+            self.job_counts[from_key] -= 1
+            self.job_counts[to_key] += 1
+
+    def _run(self, kwargs):
+        self._count("queued", "running")
+        try:
+            summary_stats = run_job(kwargs, tmpdir=self.tmpdir)
+        except Exception:
+            self._count("running", "failed")
+            raise
+        self._count("running", "done")
+        return summary_stats
+
+    def submit(self, kwargs):
+        with self.job_counts_lock:
+            self.job_counts["queued"] += 1
+        return self.executor.submit(self._run, kwargs)
+
+    def status(self):
+        with self.job_counts_lock:
+            jobs = dict(self.job_counts)
+        return {
+            "varifier_version": varifier.__version__,
+            "workers": self.workers,
+            "jobs": jobs,
+            "loaded": [{"kind": x, "file": y} for x, y in registry.loaded()],
+        }
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=True)
+
+
+class _TCPServer(_ServerMixin, http.server.ThreadingHTTPServer):
+    pass
+
+
+class _UnixServer(
+    _ServerMixin, socketserver.ThreadingMixIn, socketserver.UnixStreamServer
+):
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+
+
+def make_server(port=None, socket_path=None, workers=1, tmpdir=None, outdir=None):
+    """Returns a server that evaluates jobs, listening on localhost:port or
+    on the unix socket socket_path. Use port=0 to pick a free port, which is
+    then in server.server_address. There is no authentication, so the
+    server only listens on the loopback interface. If outdir is given, it is
+    made if needed, and jobs can write their output in a new directory
+    inside it"""
+    if (port is None) == (socket_path is None):
+        raise Exception("Must give exactly one of port and socket_path")
+    if outdir is not None:
+        os.makedirs(outdir, exist_ok=True)
+        outdir = os.path.abspath(outdir)
+    if socket_path is None:
+        server = _TCPServer((_host, port), _RequestHandler)
+    else:
+        if os.path.exists(socket_path):
+            raise Exception(f"Socket file {socket_path} already exists")
+        server = _UnixServer(socket_path, _RequestHandler)
+    server.setup_jobs(workers, tmpdir, outdir)
+    return server
+
+
+def _stop_on_sigterm(signum, frame):
+    raise KeyboardInterrupt
+
+
+def serve(port=None, socket_path=None, workers=1, tmpdir=None, outdir=None):
+    """Runs a server from make_server() until it is interrupted or gets
+    SIGTERM"""
+    signal.signal(signal.SIGTERM, _stop_on_sigterm)
+    server = make_server(
+        port=port,
+        socket_path=socket_path,
+        workers=workers,
+        tmpdir=tmpdir,
+        outdir=outdir,
+    )
+    address = socket_path if socket_path is not None else f"{_host}:{port}"
+    logging.info(f"Listening on {address} with {workers} worker(s)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logging.info("Interrupted. Stopping server")
+    finally:
+        server.server_close()
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path, timeout=None):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+def _request(method, path, data=None, port=None, socket_path=None):
+    if socket_path is None:
+        connection = http.client.HTTPConnection(_host, port)
+    else:
+        connection = _UnixHTTPConnection(socket_path)
+    try:
+        body = None if data is None else json.dumps(data)
+        connection.request(
+            method, path, body=body, headers={"Content-Type": "application/json"}
+        )
+        response = connection.getresponse()
+        got = json.loads(response.read())
+    finally:
+        connection.close()
+    if response.status != 200:
+        raise Exception(f"Server error ({response.status}): {got['error']}")
+    return got
+
+
+def submit_job(job, port=None, socket_path=None):
+    """Sends job to a server from serve(), waits for it to finish and
+    returns the summary stats"""
+    return _request("POST", "/eval", data=job, port=port, socket_path=socket_path)
+
+
+def server_status(port=None, socket_path=None):
+    """Returns the status of a server from serve()"""
+    return _request("GET", "/status", port=port, socket_path=socket_path)
@@ -1,3 +1,17 @@
-__all__ = ["make_truth_vcf", "vcf_eval"]
+import importlib
 
-from varifier.tasks import *
+__all__ = [
+    "benchmark",
+    "make_truth_vcf",
+    "serve",
+    "vcf_eval",
+    "vcf_eval_gather",
+    "vcf_eval_scatter",
+    "vcf_eval_shard",
+]
+
+
+def __getattr__(name):
+    if name in __all__:
+        return importlib.import_module(f"varifier.tasks.{name}")
+    raise AttributeError(f"module 'varifier.tasks' has no attribute '{name}'")
@@ -0,0 +1,30 @@
+from varifier import benchmark
+
+_size_suffixes = {"k": 10**3, "m": 10**6, "g": 10**9}
+
+
+def _parse_genome_size(size):
+    """Returns the genome size in bp from a string, eg 5000, 4.4M or 3G"""
+    multiplier = _size_suffixes.get(size[-1].lower(), 1)
+    if multiplier > 1:
+        size = size[:-1]
+    return int(float(size) * multiplier)
+
+
+def run(options):
+    benchmark.run_benchmark(
+        options.outdir,
+        [_parse_genome_size(x) for x in options.genome_sizes.split(",")],
+        flank_length=options.flank_length,
+        max_flank_length=options.max_flank_length,
+        threads=options.threads,
+        seed=options.seed,
+        force=options.force,
+        snp_rate=options.snp_rate,
+        indel_rate=options.indel_rate,
+        sv_rate=options.sv_rate,
+        cluster_fraction=options.cluster_fraction,
+        repeat_fraction=options.repeat_fraction,
+        call_fraction=options.call_fraction,
+        false_call_rate=options.false_call_rate,
+    )
@@ -1,18 +1,21 @@
-from varifier import truth_variant_finding, utils
+from varifier import truth_variant_finding
 
 
 def run(options):
-    if options.truth_mask is None:
-        mask = None
-    else:
-        mask = utils.load_mask_bed_file(options.truth_mask)
-
     truth_variant_finding.make_truth_vcf(
         options.ref_fasta,
         options.truth_fasta,
         options.outdir,
         options.flank_length,
         debug=options.debug,
-        truth_mask=mask,
+        truth_mask_bed_file=options.truth_mask,
         max_ref_len=options.max_recall_ref_len,
+        resume=options.resume,
+        threads=options.threads,
+        max_flank_length=options.max_flank_length,
+        local_probe_mapping=options.local_probe_mapping,
+        probe_hit_cache=options.probe_hit_cache,
+        probe_hit_cache_size=options.probe_hit_cache_size,
+        tmpdir=options.tmpdir,
+        keep=options.keep,
     )
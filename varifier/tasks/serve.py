@@ -0,0 +1,14 @@
+from varifier import server
+
+
+def run(options):
+    if (options.port is None) == (options.socket is None):
+        raise Exception("Must use exactly one of --port and --socket")
+    server.preload(fasta_files=options.preload, mask_bed_files=options.preload_mask)
+    server.serve(
+        port=options.port,
+        socket_path=options.socket,
+        workers=options.workers,
+        tmpdir=options.tmpdir,
+        outdir=options.outdir,
+    )
@@ -1,22 +1,150 @@
+import os
+
 from varifier import vcf_evaluate
 
 
+def _per_sample_files(samples, filenames, option_name):
+    """Returns dictionary of sample name -> filename. filenames is a
+    comma-separated string of one filename, used for all samples, or one
+    filename per sample"""
+    filenames = filenames.split(",")
+    if len(filenames) == 1:
+        filenames *= len(samples)
+    elif len(filenames) != len(samples):
+        raise Exception(
+            f"Got {len(samples)} samples but {len(filenames)} files for {option_name}. Must give one file, or one file per sample"
+        )
+    return dict(zip(samples, filenames))
+
+
+def _filter_policies(policy_strings):
+    """Returns dictionary of policy name -> filter_pass, made from the
+    strings given to --filter_policy, which are NAME or NAME=FILTER1,..."""
+    policies = {}
+    for policy in policy_strings:
+        name, eq, filters = policy.partition("=")
+        # The name is used as a directory name
+        if name in {"", ".", ".."} or os.sep in name or name in policies:
+            raise Exception(
+                f"Missing, duplicate or bad filter policy name (it cannot be . or .. or contain {os.sep}): {policy}"
+            )
+        policies[name] = set(filters.split(",")) if eq else None
+    return policies
+
+
+def _strata(stratify_strings):
+    """Returns dictionary of stratum name -> BED file, made from the strings
+    given to --stratify, which are NAME=BED"""
+    strata = {}
+    for stratum in stratify_strings:
+        name, eq, bed_file = stratum.partition("=")
+        if name == "" or not eq or bed_file == "" or name in strata:
+            raise Exception(
+                f"Each --stratify must be NAME=BED, with a different NAME. Got: {stratum}"
+            )
+        strata[name] = bed_file
+    return strata
+
+
 def run(options):
     filter_pass = (
         None if options.filter_pass is None else set(options.filter_pass.split(","))
     )
-    vcf_evaluate.evaluate_vcf(
+    kwargs = {
+        "debug": options.debug,
+        "force": options.force,
+        "resume": options.resume,
+        "threads": options.threads,
+        "max_flank_length": options.max_flank_length,
+        "local_probe_mapping": options.local_probe_mapping,
+        "probe_hit_cache": options.probe_hit_cache,
+        "probe_hit_cache_size": options.probe_hit_cache_size,
+        "tmpdir": options.tmpdir,
+        "keep": options.keep,
+        "filter_pass": filter_pass,
+        "ref_mask_bed_file": options.ref_mask,
+        "truth_mask_bed_file": options.truth_mask,
+        "discard_ref_calls": not options.use_ref_calls,
+        "max_recall_ref_len": options.max_recall_ref_len,
+    }
+
+    if options.filter_policy is not None:
+        if options.samples is not None:
+            raise Exception("Cannot use --filter_policy with --samples")
+        kwargs["filter_policies"] = _filter_policies(options.filter_policy)
+
+    strata = None if options.stratify is None else _strata(options.stratify)
+    truth_fastas = options.truth_fasta.split(",")
+    if strata is not None and (
+        options.samples is not None
+        or len(truth_fastas) > 1
+        or options.truth_names is not None
+    ):
+        raise Exception(
+            "--stratify can only be used with one sample and one truth genome"
+        )
+    if options.samples is None and (
+        len(truth_fastas) > 1 or options.truth_names is not None
+    ):
+        if options.filter_policy is not None:
+            raise Exception("Cannot use --filter_policy with more than one truth")
+        if options.truth_names is None:
+            names = [os.path.basename(x) for x in truth_fastas]
+        else:
+            names = options.truth_names.split(",")
+        if len(set(names)) != len(names):
+            raise Exception(
+                f"Duplicate truth names {names}. Use --truth_names to give each truth a different name"
+            )
+        truth_fastas = _per_sample_files(names, options.truth_fasta, "truth_fasta")
+        kwargs["truth_mask_bed_files"] = (
+            None
+            if options.truth_mask is None
+            else _per_sample_files(names, options.truth_mask, "--truth_mask")
+        )
+        del kwargs["truth_mask_bed_file"]
+        vcf_evaluate.evaluate_vcf_against_truths(
+            options.vcf_in,
+            options.vcf_fasta,
+            truth_fastas,
+            options.flank_length,
+            options.outdir,
+            truth_vcfs=(
+                None
+                if options.truth_vcf is None
+                else _per_sample_files(names, options.truth_vcf, "--truth_vcf")
+            ),
+            **kwargs,
+        )
+        return
+
+    if options.samples is None:
+        vcf_evaluate.evaluate_vcf(
+            options.vcf_in,
+            options.vcf_fasta,
+            options.truth_fasta,
+            options.flank_length,
+            options.outdir,
+            truth_vcf=options.truth_vcf,
+            strata_bed_files=strata,
+            **kwargs,
+        )
+        return
+
+    samples = options.samples.split(",")
+    if len(set(samples)) != len(samples):
+        raise Exception(f"Duplicate sample names in {options.samples}")
+    truth_fastas = _per_sample_files(samples, options.truth_fasta, "truth_fasta")
+    if options.truth_vcf is None:
+        truth_vcfs = None
+    else:
+        truth_vcfs = _per_sample_files(samples, options.truth_vcf, "--truth_vcf")
+    vcf_evaluate.evaluate_multi_sample_vcf(
         options.vcf_in,
         options.vcf_fasta,
-        options.truth_fasta,
+        truth_fastas,
         options.flank_length,
         options.outdir,
-        truth_vcf=options.truth_vcf,
-        debug=options.debug,
-        force=options.force,
-        filter_pass=filter_pass,
-        ref_mask_bed_file=options.ref_mask,
-        truth_mask_bed_file=options.truth_mask,
-        discard_ref_calls=not options.use_ref_calls,
-        max_recall_ref_len=options.max_recall_ref_len,
+        truth_vcfs=truth_vcfs,
+        **kwargs,
     )
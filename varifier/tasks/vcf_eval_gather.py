@@ -0,0 +1,10 @@
+from varifier import vcf_evaluate
+
+
+def run(options):
+    vcf_evaluate.gather_vcf_eval(
+        options.scatter_dir,
+        options.shard_outdirs,
+        options.outdir,
+        force=options.force,
+    )
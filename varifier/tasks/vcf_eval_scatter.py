@@ -0,0 +1,29 @@
+from varifier import vcf_evaluate
+
+
+def run(options):
+    filter_pass = (
+        None if options.filter_pass is None else set(options.filter_pass.split(","))
+    )
+    vcf_evaluate.scatter_vcf_eval(
+        options.vcf_in,
+        options.vcf_fasta,
+        options.truth_fasta,
+        options.flank_length,
+        options.outdir,
+        options.shards,
+        split_by=options.split_by,
+        truth_vcf=options.truth_vcf,
+        debug=options.debug,
+        force=options.force,
+        ref_mask_bed_file=options.ref_mask,
+        truth_mask_bed_file=options.truth_mask,
+        discard_ref_calls=not options.use_ref_calls,
+        max_recall_ref_len=options.max_recall_ref_len,
+        filter_pass=filter_pass,
+        threads=options.threads,
+        max_flank_length=options.max_flank_length,
+        local_probe_mapping=options.local_probe_mapping,
+        probe_hit_cache=options.probe_hit_cache,
+        probe_hit_cache_size=options.probe_hit_cache_size,
+    )
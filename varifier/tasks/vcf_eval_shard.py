@@ -0,0 +1,11 @@
+from varifier import vcf_evaluate
+
+
+def run(options):
+    vcf_evaluate.evaluate_vcf_shard(
+        options.manifest_json,
+        options.outdir,
+        force=options.force,
+        probe_hit_cache=options.probe_hit_cache,
+        probe_hit_cache_size=options.probe_hit_cache_size,
+    )
@@ -0,0 +1,116 @@
+import gzip
+import json
+import logging
+import os
+import struct
+
+from varifier import (
+    checkpoint,
+    edit_distance,
+    probe,
+    probe_mapping,
+    registry,
+    vcf_record,
+)
+
+# The probes of a truth VCF file only depend on the truth VCF, its
+# reference and the flank length, not on the VCF file being evaluated. So
+# they can be made once (when the truth VCF is made) and saved, instead of
+# being made again every time recall is calculated.
+# File format (gzipped): the magic line, then the length of the JSON header
+# and the header, then for each VCF record: lengths of the left flank, ref
+# allele, alt allele and right flank, the edit distance between the ref
+# and alt alleles, then the left flank, ref allele, alt allele and right
+# flank sequences.
+_MAGIC = b"VARIFIER_TRUTH_PROBES\n"
+_VERSION = 1
+_RECORD_STRUCT = struct.Struct("<IIIII")
+
+
+def probes_file(vcf_file):
+    """Returns the name of the truth probes file that goes with vcf_file"""
+    return f"{vcf_file}.probes"
+
+
+def _header(vcf_file, ref_fasta, flank_length, record_count):
+    return {
+        "version": _VERSION,
+        "vcf_md5": checkpoint.file_md5(vcf_file),
+        "ref_md5": checkpoint.file_md5(ref_fasta),
+        "flank_length": flank_length,
+        "records": record_count,
+    }
+
+
+def write_truth_probes(vcf_file, ref_fasta, flank_length, outfile):
+    """Makes the probes for each record of the truth VCF file vcf_file,
+    and writes them, with the edit distance between the ref and alt
+    alleles, to outfile"""
+    header_lines, vcf_records = vcf_record.vcf_file_to_list(vcf_file)
+    probes = probe_mapping.probes_for_vcf_records(
+        vcf_records, registry.get_seqs(ref_fasta), flank_length
+    )
+    header = json.dumps(
+        _header(vcf_file, ref_fasta, flank_length, len(vcf_records)), sort_keys=True
+    ).encode()
+    with gzip.open(outfile, "wb") as f:
+        f.write(_MAGIC)
+        f.write(struct.pack("<I", len(header)))
+        f.write(header)
+        for _, ref_probe, alt_probe in probes:
+            left = ref_probe.seq[: ref_probe.allele_start]
+            right = ref_probe.seq[ref_probe.allele_end + 1 :]
+            ref_allele = ref_probe.allele_seq()
+            alt_allele = alt_probe.allele_seq()
+            edit_dist = edit_distance.edit_distance_between_seqs(ref_allele, alt_allele)
+            f.write(
+                _RECORD_STRUCT.pack(
+                    len(left), len(ref_allele), len(alt_allele), len(right), edit_dist
+                )
+            )
+            f.write((left + ref_allele + alt_allele + right).encode())
+
+
+def load_truth_probes(vcf_file, ref_fasta, flank_length, filename=None):
+    """Returns a list of tuples (ref probe, alt probe, edit distance between
+    ref and alt alleles), one for each record of vcf_file, loaded from the
+    file filename made by write_truth_probes() (default is
+    probes_file(vcf_file)). Returns None if the file does not exist, or was
+    not made from the same vcf_file, ref_fasta and flank_length"""
+    if filename is None:
+        filename = probes_file(vcf_file)
+    if not os.path.exists(filename):
+        return None
+    with gzip.open(filename, "rb") as f:
+        try:
+            magic = f.read(len(_MAGIC))
+        except (OSError, EOFError):
+            magic = None
+        if magic != _MAGIC:
+            logging.warning(f"Not a truth probes file, ignoring: {filename}")
+            return None
+        (header_length,) = struct.unpack("<I", f.read(4))
+        header = json.loads(f.read(header_length))
+        if header != _header(vcf_file, ref_fasta, flank_length, header["records"]):
+            logging.warning(
+                f"Truth probes file {filename} does not match the truth VCF {vcf_file}, reference or flank length. Ignoring it and making probes instead"
+            )
+            return None
+        probes = []
+        for _ in range(header["records"]):
+            lengths = _RECORD_STRUCT.unpack(f.read(_RECORD_STRUCT.size))
+            left_len, ref_len, alt_len, right_len, edit_dist = lengths
+            seqs = f.read(left_len + ref_len + alt_len + right_len).decode()
+            left = seqs[:left_len]
+            ref_allele = seqs[left_len : left_len + ref_len]
+            alt_allele = seqs[left_len + ref_len : left_len + ref_len + alt_len]
+            right = seqs[left_len + ref_len + alt_len :]
+            ref_probe = probe.Probe(
+                left + ref_allele + right, left_len, left_len + ref_len - 1
+            )
+            alt_probe = probe.Probe(
+                left + alt_allele + right, left_len, left_len + alt_len - 1
+            )
+            probes.append((ref_probe, alt_probe, edit_dist))
+    logging.info(f"Loaded truth probes from {filename}")
+    return probes
@@ -1,69 +1,403 @@
+import bisect
+import collections
+import concurrent.futures
 import copy
+import heapq
 import logging
+from operator import itemgetter
 import os
-import shutil
-import subprocess
+import re
 
-import pysam
-import pysam.bcftools
+import mappy
 
-from cluster_vcf_records import vcf_file_read, vcf_merge
+from cluster_vcf_records import vcf_file_read
 
-from varifier import dnadiff, probe_mapping, utils
+from varifier import (
+    checkpoint,
+    dnadiff,
+    probe_mapping,
+    registry,
+    scratch,
+    truth_probes,
+    vcf_record,
+)
 
+_cs_regex = re.compile(r"([:*+-])(\d+|[A-Za-z]+)")
 
-def _check_dependencies_in_path():
-    programs = ["minimap2", "paftools.js", "k8"]
-    found_all = True
-    for program in programs:
-        if shutil.which(program) is None:
-            found_all = False
-            logging.error(f"Not found in PATH: {program}")
 
-    if not found_all:
-        raise RuntimeError("Some required programs not found in $PATH. Cannot continue")
+def _map_truth_to_ref(ref_fasta, truth_fasta, threads=1):
+    """Maps the truth genome sequences to the reference using mappy. This is
+    the same as "minimap2 -c --cs ref_fasta truth_fasta", but in-process.
+    Truth sequences are mapped in parallel using threads threads.
+    Returns a list of hits, sorted by reference name then start position.
+    Each hit is a tuple: (ref name, ref start, ref end, query name, query start,
+    query end, strand, alignment block length, mapq, cs string)"""
+    aligner = registry.get_aligner(ref_fasta, n_threads=threads)
 
+    def map_seq(name, seq):
+        buf = mappy.ThreadBuffer()
+        return [
+            (
+                hit.ctg,
+                hit.r_st,
+                hit.r_en,
+                name,
+                hit.q_st,
+                hit.q_en,
+                hit.strand,
+                hit.blen,
+                hit.mapq,
+                hit.cs,
+            )
+            for hit in aligner.map(seq, buf=buf, cs=True)
+        ]
 
-def _truth_using_minimap2_paftools(ref_fasta, truth_fasta, vcf_file):
-    _check_dependencies_in_path()
-    minimap2_cmd = f"minimap2 -c --cs {ref_fasta} {truth_fasta} | sort -k6,6 -k8,8n"
-    paftools_cmd = f"paftools.js call -l50 -L50 -f {ref_fasta} -"
-    cmd = f"{minimap2_cmd} | {paftools_cmd} > {vcf_file}"
-    logging.info(f"Running minimap2/paftools with command: {cmd}")
-    subprocess.check_output(cmd, shell=True)
-    logging.info(f"minimap2/paftools finished ({cmd})")
+    names_and_seqs = [(x[0], x[1]) for x in mappy.fastx_read(truth_fasta)]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+        hits = executor.map(map_seq, *zip(*names_and_seqs))
+        hits = [hit for seq_hits in hits for hit in seq_hits]
+
+    hits.sort(key=itemgetter(0, 1))
+    return hits
+
+
+def _call_variants_from_hits(hits, min_cov_len=50, min_var_len=50, min_mapq=5):
+    """Yields variants from the cs strings of sorted hits made by
+    _map_truth_to_ref(). This is the same as "paftools.js call", where
+    min_cov_len, min_var_len and min_mapq are the options -l, -L and -q.
+    Each variant is a list: [ref name, ref start, ref end, coverage, mapq,
+    ref allele, alt allele, query name, query start, strand]. Insertions have
+    ref allele "-", and deletions have alt allele "-". Coverage is the number
+    of alignments that overlap the variant. Like paftools.js, mismatches
+    where either base is "n" are skipped"""
+    out = collections.deque()
+    previous_alns = []
+
+    for ctg, r_st, r_en, qname, q_st, q_en, strand, blen, mapq, cs in hits:
+        if blen < min_cov_len or mapq < min_mapq:
+            continue
+        x = r_st
+
+        # Any variants before this alignment can't get any more coverage
+        while len(out) > 0 and (out[0][0] != ctg or out[0][2] <= x):
+            yield out.popleft()
+
+        for variant in out:
+            if variant[1] >= x and variant[2] <= r_en:
+                variant[3] += 1
+
+        previous_alns = [a for a in previous_alns if a[0] == ctg and a[2] > x]
+
+        if blen >= min_var_len and cs is not None:
+            rev = strand == -1
+            y = q_en if rev else q_st
+            for op, op_string in _cs_regex.findall(cs):
+                if op in "*+-":
+                    cov = 1 + sum(1 for a in previous_alns if a[2] > x)
+
+                if op == ":":
+                    length = int(op_string)
+                    x += length
+                    y += -length if rev else length
+                elif op == "*":
+                    if rev:
+                        y -= 1
+                    if op_string[0] != "n" and op_string[1] != "n":
+                        out.append(
+                            [
+                                ctg,
+                                x,
+                                x + 1,
+                                cov,
+                                mapq,
+                                op_string[0],
+                                op_string[1],
+                                qname,
+                                y,
+                                strand,
+                            ]
+                        )
+                    if not rev:
+                        y += 1
+                    x += 1
+                elif op == "+":
+                    length = len(op_string)
+                    if rev:
+                        y -= length
+                    out.append([ctg, x, x, cov, mapq, "-", op_string, qname, y, strand])
+                    if not rev:
+                        y += length
+                elif op == "-":
+                    length = len(op_string)
+                    out.append(
+                        [
+                            ctg,
+                            x,
+                            x + length,
+                            cov,
+                            mapq,
+                            op_string,
+                            "-",
+                            qname,
+                            y,
+                            strand,
+                        ]
+                    )
+                    x += length
+
+        previous_alns.append((ctg, r_st, r_en))
+
+    yield from out
+
+
+def _truth_using_minimap2(ref_fasta, truth_fasta, vcf_file, threads=1, hits=None):
+    """Makes a VCF file of variants between ref_fasta and truth_fasta. Gives
+    the same output as the shell pipeline
+    "minimap2 -c --cs ref_fasta truth_fasta | sort -k6,6 -k8,8n | paftools.js call -l50 -L50 -f ref_fasta -",
+    but without needing minimap2, k8 or paftools.js installed.
+    hits can be the output of _map_truth_to_ref(), if it was already run"""
+    if hits is None:
+        logging.info(f"Mapping {truth_fasta} to {ref_fasta} with minimap2 (mappy)")
+        hits = _map_truth_to_ref(ref_fasta, truth_fasta, threads=threads)
+    ref_seqs = registry.get_seqs(ref_fasta)
+
+    with open(vcf_file, "w") as f:
+        print("##fileformat=VCFv4.1", file=f)
+        for name, seq in ref_seqs.items():
+            print(f"##contig=<ID={name},length={len(seq)}>", file=f)
+        print(
+            '##INFO=<ID=QNAME,Number=1,Type=String,Description="Query name">',
+            '##INFO=<ID=QSTART,Number=1,Type=Integer,Description="Query start">',
+            '##INFO=<ID=QSTRAND,Number=1,Type=String,Description="Query strand">',
+            '##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">',
+            "#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tsample",
+            sep="\n",
+            file=f,
+        )
+
+        for variant in _call_variants_from_hits(hits):
+            ctg, start, _, cov, mapq, ref, alt, qname, qstart, strand = variant
+            # Only want variants where the truth has one alignment
+            if cov != 1:
+                continue
+            if ref != "-" and alt != "-":  # SNP
+                pos = start + 1
+            elif start > 0:
+                pre = ref_seqs[ctg][start - 1].upper()
+                pos = start
+                ref = pre if ref == "-" else pre + ref
+                alt = pre if alt == "-" else pre + alt
+            else:
+                continue
+            strand = "+" if strand == 1 else "-"
+            print(
+                ctg,
+                pos,
+                ".",
+                ref.upper(),
+                alt.upper(),
+                mapq,
+                ".",
+                f"QNAME={qname};QSTART={qstart + 1};QSTRAND={strand}",
+                "GT",
+                "1/1",
+                sep="\t",
+                file=f,
+            )
+
+    logging.info(f"Finished calling variants from minimap2 mapping to {vcf_file}")
+
+
+def _ref_to_truth_windows(hits, min_mapq=5):
+    """Takes the hits from _map_truth_to_ref(). Returns a function that
+    takes a region (ref name, start, end) of the reference (0-based, inclusive
+    coords). It returns the matching region (truth name, start, end) of the
+    truth genome, using the alignments in the hits, or None if the region is
+    not in exactly one alignment with mapq at least min_mapq"""
+    alignments = collections.defaultdict(list)
+    for ctg, r_st, r_en, qname, q_st, q_en, strand, _, mapq, cs in hits:
+        if mapq < min_mapq:
+            continue
+        # Position in ref and offset in (aligned strand of) the query at the
+        # start of the alignment and after each indel, so that ref positions
+        # can be converted to query positions
+        ref_starts = [r_st]
+        q_offsets = [0]
+        r_pos = r_st
+        q_offset = 0
+        for op, val in _cs_regex.findall(cs):
+            if op == ":":
+                r_pos += int(val)
+                q_offset += int(val)
+            elif op == "*":
+                r_pos += 1
+                q_offset += 1
+            else:
+                if op == "+":
+                    q_offset += len(val)
+                else:
+                    r_pos += len(val)
+                ref_starts.append(r_pos)
+                q_offsets.append(q_offset)
+        alignments[ctg].append(
+            (r_st, r_en, qname, q_st, q_en, strand, ref_starts, q_offsets)
+        )
+
+    def ref_to_truth_pos(alignment, ref_pos):
+        r_st, r_en, qname, q_st, q_en, strand, ref_starts, q_offsets = alignment
+        i = bisect.bisect_right(ref_starts, ref_pos) - 1
+        q_offset = q_offsets[i] + ref_pos - ref_starts[i]
+        if i + 1 < len(q_offsets):
+            # Position is in a deletion from the truth
+            q_offset = min(q_offset, q_offsets[i + 1])
+        return q_st + q_offset if strand == 1 else q_en - 1 - q_offset
+
+    # Sort the alignments by ref start, so that the ones containing a region
+    # are found by bisecting instead of looking at every alignment. An
+    # alignment can only contain the region if it starts at most its length
+    # before the end of the region
+    alignment_starts = {}
+    max_lengths = {}
+    for ctg, ctg_alignments in alignments.items():
+        ctg_alignments.sort(key=itemgetter(0))
+        alignment_starts[ctg] = [x[0] for x in ctg_alignments]
+        max_lengths[ctg] = max(x[1] - x[0] for x in ctg_alignments)
+
+    def truth_window(ctg, start, end):
+        if ctg not in alignments:
+            return None
+        starts = alignment_starts[ctg]
+        first = bisect.bisect_right(starts, end - max_lengths[ctg])
+        last = bisect.bisect_right(starts, start)
+        found = [x for x in alignments[ctg][first:last] if end < x[1]]
+        if len(found) != 1:
+            return None
+        positions = [ref_to_truth_pos(found[0], x) for x in (start, end)]
+        return found[0][2], min(positions), max(positions)
+
+    return truth_window
+
+
+def _sorted_vcf_file_variants(vcf_file):
+    """Yields tuples (CHROM, POS, REF, list of ALTs) from a VCF file, where
+    POS is 0-based. Raises an error if the file is not sorted by CHROM, then
+    by POS"""
+    previous = None
+    with vcf_file_read.open_vcf_file_for_reading(vcf_file) as f:
+        for line in f:
+            if line.startswith("#"):
+                continue
+            chrom, pos, _, ref, alts, _ = line.split("\t", maxsplit=5)
+            pos = int(pos) - 1
+            if previous is not None and (chrom, pos) < previous:
+                raise RuntimeError(
+                    f"VCF file not sorted by CHROM then POS: {vcf_file}. Cannot continue"
+                )
+            previous = chrom, pos
+            yield chrom, pos, ref, alts.split(",")
 
 
 def _merge_vcf_files_for_probe_mapping(list_of_vcf_files, ref_fasta, vcf_out):
-    ref_seqs = utils.file_to_dict_of_seqs(ref_fasta)
-    # This makes a merged file, where two different ALTs at the same place
-    # result in one record with a list of ALTs. For probe mapping, we want
-    # a separate record for each allele. Also need genotype to be "1/1"
-    vcf_merge.merge_vcf_files(list_of_vcf_files, ref_seqs, vcf_out)
-    header_lines, vcf_records = vcf_file_read.vcf_file_to_list(vcf_out)
+    """Merges the sorted VCF files in list_of_vcf_files, in one pass.
+    Different ALTs at the same place (same CHROM, POS and REF) are
+    combined, and then written as a separate record for each allele, with
+    the same ID and genotype "1/1". For probe mapping, we want a separate
+    record for each allele. Records that do not match ref_fasta are ignored.
+    Only the sites near the current position are held in memory"""
+    ref_seqs = registry.get_seqs(ref_fasta)
+    ref_seq_name = None
+    ref_seq = None
+    # Sites that have been seen but not written yet. They are kept until
+    # all input files have moved past them. Dict of (CHROM, POS) ->
+    # REF -> set of ALTs, plus a heap of the (CHROM, POS) keys
+    sites = {}
+    site_keys = []
+    site_id = 0
+
+    def write_sites(f, before=None):
+        nonlocal site_id
+        while len(site_keys) > 0 and (before is None or site_keys[0] < before):
+            key = heapq.heappop(site_keys)
+            chrom, pos = key
+            for ref, alts in sorted(sites.pop(key).items()):
+                for alt in sorted(alts):
+                    print(
+                        chrom,
+                        pos + 1,
+                        site_id,
+                        ref,
+                        alt,
+                        ".",
+                        "PASS",
+                        ".",
+                        "GT",
+                        "1/1",
+                        sep="\t",
+                        file=f,
+                    )
+                site_id += 1
+
     with open(vcf_out, "w") as f:
         print("##fileformat=VCFv4.2", file=f)
-        for seq in ref_seqs.values():
-            print(f"##contig=<ID={seq.id},length={len(seq)}>", file=f)
+        for name, seq in ref_seqs.items():
+            print(f"##contig=<ID={name},length={len(seq)}>", file=f)
         print('##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">', file=f)
         print("#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tsample", file=f)
 
-        for i, record in enumerate(vcf_records):
-            for alt in record.ALT:
-                new_record = copy.copy(record)
-                new_record.ID = str(i)
-                new_record.ALT = [alt]
-                new_record.INFO = {}
-                new_record.FILTER = set(["PASS"])
-                new_record.FORMAT = {"GT": "1/1"}
-                print(new_record, file=f)
+        variants = heapq.merge(
+            *[_sorted_vcf_file_variants(x) for x in list_of_vcf_files],
+            key=lambda x: (x[0], x[1]),
+        )
+        for chrom, pos, ref, alts in variants:
+            # Removing start nucleotides only ever increases POS, so any site
+            # before this variant cannot get any more ALTs
+            write_sites(f, before=(chrom, pos))
+            alts = [x for x in alts if x != "*"]
+            if len(alts) == 0:
+                continue
+            elif pos < 0:
+                logging.warning(
+                    f"VCF record with negative POS. Ignoring: {chrom} {pos + 1}"
+                )
+                continue
+            elif chrom not in ref_seqs:
+                logging.warning(
+                    f"CHROM not recognised in VCF record. Ignoring: {chrom} {pos + 1}"
+                )
+                continue
+
+            if len(ref) > 1 and len(alts) == 1:
+                i = 0
+                while i < len(ref) and i < len(alts[0]) and ref[i] == alts[0][i]:
+                    i += 1
+                if i > 0:
+                    ref = ref[i - 1 :]
+                    alts = [alts[0][i - 1 :]]
+                    pos += i - 1
+
+            if chrom != ref_seq_name:
+                ref_seq_name = chrom
+                ref_seq = ref_seqs[chrom].seq
+            if ref_seq[pos : pos + len(ref)] != ref:
+                logging.warning(
+                    f"REF string does not match reference seq. Ignoring: {chrom} {pos + 1} {ref}"
+                )
+                continue
+
+            key = chrom, pos
+            if key not in sites:
+                sites[key] = {}
+                heapq.heappush(site_keys, key)
+            sites[key].setdefault(ref, set()).update(alts)
+
+        write_sites(f)
 
 
 def _filter_fps_and_long_vars_from_probe_mapped_vcf(vcf_in, vcf_out, max_ref_len):
     """vcf_in should be file made by _merge_vcf_files_for_probe_mapping, and
     then annotated using probe_mapping.annotate_vcf_with_probe_mapping().
     Outputs a new VCF file that only contains the TPs, based on probe mapping"""
-    header_lines, vcf_records = vcf_file_read.vcf_file_to_list(vcf_in)
+    header_lines, vcf_records = vcf_record.vcf_file_to_list(vcf_in)
     with open(vcf_out, "w") as f:
         for line in header_lines:
             if (
@@ -102,18 +436,165 @@ def _filter_fps_and_long_vars_from_probe_mapped_vcf(vcf_in, vcf_out, max_ref_len
                 print(records[0], file=f)
 
 
-def _bcftools_norm(ref_fasta, vcf_in, vcf_out):
-    """Runs bcftools norm, to normalise variants and remove
-    duplicates. Experimenting has shown that you have to run it twice,
-    so that duplicates get removed properly."""
-    # The "-o" option doesn't get passed to pysam's bcftools wrapper.
-    # Instead it returns a string that is the new vcf file
-    options = ["-c", "x", "-d", "any", "-f", ref_fasta]
-    with open(vcf_out, "w") as f:
-        print(pysam.bcftools.norm(*options, vcf_in), end="", file=f)
-    vcf_string = pysam.bcftools.norm(*options, vcf_out)
-    with open(vcf_out, "w") as f:
-        print(vcf_string, end="", file=f)
+def _normalise_alleles(ref_seq, pos, ref, alt):
+    """Returns normalised (pos, ref, alt), where pos is 0-based and ref_seq is
+    the reference sequence string. Alleles are trimmed to be parsimonious
+    and indels are left-aligned, like bcftools norm. ref and alt must be
+    different"""
+    assert ref != alt
+    while True:
+        changed = False
+        if len(ref) > 0 and len(alt) > 0 and ref[-1] == alt[-1]:
+            ref, alt = ref[:-1], alt[:-1]
+            changed = True
+        if len(ref) == 0 or len(alt) == 0:
+            if pos == 0:
+                # Can't extend to the left, so use the base after the variant
+                base = ref_seq[pos + len(ref)].upper()
+                ref, alt = ref + base, alt + base
+                break
+            pos -= 1
+            base = ref_seq[pos].upper()
+            ref, alt = base + ref, base + alt
+            changed = True
+        if not changed:
+            break
+
+    while len(ref) > 1 and len(alt) > 1 and ref[0] == alt[0]:
+        ref, alt = ref[1:], alt[1:]
+        pos += 1
+
+    return pos, ref, alt
+
+
+def _split_genotype(sample_fields, alt_index):
+    """Returns sample column for one allele split off from a multi-allelic
+    record. GT is changed so that alt_index becomes 1, and all other alts
+    become 0 (same as bcftools norm -m)"""
+    fields = sample_fields.split(":")
+    alleles = fields[0].replace("|", "/").split("/")
+    fields[0] = "/".join(
+        "1" if x == str(alt_index) else "." if x == "." else "0" for x in alleles
+    )
+    return ":".join(fields)
+
+
+def _normalise_vcf(ref_fasta, vcf_in, vcf_out, window=1000):
+    """Normalises variants and removes duplicates, in one pass over the VCF
+    file. This does the same as running "bcftools norm -c x -d any" (twice),
+    plus splitting multi-allelic records:
+     - records where REF does not match the reference are removed
+     - multi-allelic records are split into one record per ALT
+     - alleles are trimmed and indels are left-aligned
+     - records where REF equals ALT are removed
+     - records with the same CHROM and (normalised) POS as an earlier record
+       are removed.
+    vcf_in must be sorted. Left-aligning moves records, so records are
+    buffered until they are more than window bases before the current input
+    record, then written in sorted order. Records that move further than
+    that are sorted into the output at the end"""
+    ref_seqs = registry.get_seqs(ref_fasta)
+    buffer = []
+    record_count = 0
+    current_chrom = None
+    ref_seq = None
+    last_written = None
+    # Records that moved before a record that was already written
+    late_records = []
+
+    def flush(f_out, before_pos=None):
+        nonlocal last_written
+        while len(buffer) > 0 and (before_pos is None or buffer[0][0] < before_pos):
+            pos, _, fields = heapq.heappop(buffer)
+            fields[1] = str(pos + 1)
+            if last_written == (fields[0], pos):
+                continue
+            elif (
+                last_written is not None
+                and last_written[0] == fields[0]
+                and pos < last_written[1]
+            ):
+                late_records.append(fields)
+                continue
+            last_written = (fields[0], pos)
+            print(*fields, sep="\t", file=f_out)
+
+    with vcf_file_read.open_vcf_file_for_reading(vcf_in) as f_in, open(
+        vcf_out, "w"
+    ) as f_out:
+        for line in f_in:
+            if line.startswith("#"):
+                print(line, end="", file=f_out)
+                continue
+
+            fields = line.rstrip("\n").split("\t")
+            chrom, pos, ref, alts = fields[0], int(fields[1]) - 1, fields[3], fields[4]
+            if chrom != current_chrom:
+                flush(f_out)
+                if chrom not in ref_seqs:
+                    logging.warning(f"CHROM not found in reference. Ignoring: {line}")
+                    continue
+                current_chrom = chrom
+                ref_seq = ref_seqs[chrom].seq
+            else:
+                flush(f_out, before_pos=pos - window)
+
+            if ref_seq[pos : pos + len(ref)].upper() != ref.upper():
+                logging.warning(f"REF does not match reference. Ignoring: {line}")
+                continue
+
+            alts = alts.split(",")
+            for i, alt in enumerate(alts):
+                if alt.upper() == ref.upper():
+                    logging.warning(f"REF and ALT are the same. Ignoring: {line}")
+                    continue
+                new_pos, new_ref, new_alt = _normalise_alleles(
+                    ref_seq, pos, ref.upper(), alt.upper()
+                )
+                new_fields = copy.copy(fields)
+                new_fields[3] = new_ref
+                new_fields[4] = new_alt
+                if len(alts) > 1 and len(fields) > 9:
+                    new_fields[9] = _split_genotype(fields[9], i + 1)
+                heapq.heappush(buffer, (new_pos, record_count, new_fields))
+                record_count += 1
+
+        flush(f_out)
+
+    if len(late_records) > 0:
+        logging.info(
+            f"{len(late_records)} normalised record(s) moved more than {window}bp. Sorting output"
+        )
+        _sort_in_late_records(vcf_out, late_records)
+
+
+def _sort_in_late_records(vcf_file, late_records):
+    """Rewrites the sorted VCF file vcf_file, adding the records
+    late_records (lists of VCF fields, in the order they were made) in
+    sorted position. A late record with the same CHROM and POS as another
+    record is removed, because the other record was earlier in the input"""
+    header_lines = []
+    records = []
+    with open(vcf_file) as f:
+        for line in f:
+            if line.startswith("#"):
+                header_lines.append(line)
+            else:
+                records.append(line.rstrip("\n").split("\t"))
+    chrom_order = {}
+    for fields in records:
+        chrom_order.setdefault(fields[0], len(chrom_order))
+    # The sort is stable, so records already in the file stay before late
+    # records at the same position
+    records.extend(late_records)
+    records.sort(key=lambda x: (chrom_order[x[0]], int(x[1])))
+    with open(vcf_file, "w") as f:
+        print(*header_lines, sep="", end="", file=f)
+        last_written = None
+        for fields in records:
+            if last_written != (fields[0], fields[1]):
+                print(*fields, sep="\t", file=f)
+                last_written = (fields[0], fields[1])
 
 
 def make_truth_vcf(
@@ -124,9 +605,67 @@ def make_truth_vcf(
     debug=False,
     truth_mask=None,
     max_ref_len=None,
+    resume=False,
+    threads=1,
+    max_flank_length=None,
+    local_probe_mapping=False,
+    probe_hit_cache=None,
+    probe_hit_cache_size=1000000,
+    tmpdir=None,
+    keep="all",
+    truth_mask_bed_file=None,
+):
+    """Makes the truth VCF file outdir/04.truth.vcf of the differences
+    between ref_fasta and truth_fasta, and returns its name. The truth mask
+    can be given as the BED file truth_mask_bed_file (which is used to check
+    if probe mapping needs running again when resume is True), or already
+    loaded as truth_mask"""
+    if truth_mask is None and truth_mask_bed_file is not None:
+        truth_mask = registry.get_mask(truth_mask_bed_file)
+    with scratch.output_dir(
+        outdir,
+        tmpdir=tmpdir,
+        keep=keep,
+        resume=resume,
+        results=["04.truth.vcf", truth_probes.probes_file("04.truth.vcf")],
+    ) as workdir:
+        truth_vcf = _make_truth_vcf(
+            ref_fasta,
+            truth_fasta,
+            workdir,
+            flank_length,
+            debug=debug,
+            truth_mask=truth_mask,
+            max_ref_len=max_ref_len,
+            resume=resume,
+            threads=threads,
+            max_flank_length=max_flank_length,
+            local_probe_mapping=local_probe_mapping,
+            probe_hit_cache=probe_hit_cache,
+            probe_hit_cache_size=probe_hit_cache_size,
+            keep=keep,
+            truth_mask_bed_file=truth_mask_bed_file,
+        )
+    return os.path.join(outdir, os.path.relpath(truth_vcf, workdir))
+
+
+def _make_truth_vcf(
+    ref_fasta,
+    truth_fasta,
+    outdir,
+    flank_length,
+    debug=False,
+    truth_mask=None,
+    max_ref_len=None,
+    resume=False,
+    threads=1,
+    max_flank_length=None,
+    local_probe_mapping=False,
+    probe_hit_cache=None,
+    probe_hit_cache_size=1000000,
+    keep="all",
+    truth_mask_bed_file=None,
 ):
-    _check_dependencies_in_path()
-    os.mkdir(outdir)
     minimap2_vcf = os.path.join(outdir, "00.minimap2.vcf")
     dnadiff_vcf = os.path.join(outdir, "00.dnadiff.vcf")
     merged_vcf = os.path.join(outdir, "01.merged.vcf")
@@ -138,13 +677,64 @@ def make_truth_vcf(
     probe_filtered_vcf = os.path.join(outdir, "03.probe_filtered.vcf")
     truth_vcf = os.path.join(outdir, "04.truth.vcf")
 
-    dnadiff.make_truth_vcf(ref_fasta, truth_fasta, dnadiff_vcf, debug=debug)
-    _truth_using_minimap2_paftools(ref_fasta, truth_fasta, minimap2_vcf)
+    # Each stage is checkpointed, so that if resume is True then stages that
+    # were already completed with the same inputs and options are skipped
+    checkpoint.run_stage(
+        [dnadiff_vcf],
+        [ref_fasta, truth_fasta],
+        None,
+        resume,
+        dnadiff.make_truth_vcf,
+        ref_fasta,
+        truth_fasta,
+        dnadiff_vcf,
+        debug=debug,
+    )
+    if local_probe_mapping:
+        # Probe mapping uses the alignment of the truth to the ref to find
+        # where each variant should be in the truth genome
+        logging.info(f"Mapping {truth_fasta} to {ref_fasta} with minimap2 (mappy)")
+        hits = _map_truth_to_ref(ref_fasta, truth_fasta, threads=threads)
+        truth_windows = _ref_to_truth_windows(hits)
+    else:
+        hits = None
+        truth_windows = None
+    checkpoint.run_stage(
+        [minimap2_vcf],
+        [ref_fasta, truth_fasta],
+        None,
+        resume,
+        _truth_using_minimap2,
+        ref_fasta,
+        truth_fasta,
+        minimap2_vcf,
+        threads=threads,
+        hits=hits,
+    )
     to_merge = [dnadiff_vcf, minimap2_vcf]
-    _merge_vcf_files_for_probe_mapping(to_merge, ref_fasta, merged_vcf)
+    checkpoint.run_stage(
+        [merged_vcf],
+        to_merge + [ref_fasta],
+        None,
+        resume,
+        _merge_vcf_files_for_probe_mapping,
+        to_merge,
+        ref_fasta,
+        merged_vcf,
+    )
+    scratch.remove_intermediate_files(keep, *to_merge)
     logging.info(f"Made merged VCF file {merged_vcf}")
     logging.info("Probe mapping to remove incorrect calls")
-    probe_mapping.annotate_vcf_with_probe_mapping(
+    checkpoint.run_stage(
+        [probe_mapped_vcf],
+        [merged_vcf, ref_fasta, truth_fasta, truth_mask_bed_file],
+        {
+            "flank_length": flank_length,
+            "max_flank_length": max_flank_length,
+            "local_probe_mapping": local_probe_mapping,
+        },
+        resume,
+        probe_mapping.annotate_vcf_with_probe_mapping,
         merged_vcf,
         ref_fasta,
         truth_fasta,
@@ -152,12 +742,49 @@ def make_truth_vcf(
         probe_mapped_vcf,
         map_outfile=map_debug_file,
         truth_mask=truth_mask,
+        max_flank_length=max_flank_length,
+        truth_windows=truth_windows,
+        probe_hit_cache=probe_hit_cache,
+        probe_hit_cache_size=probe_hit_cache_size,
     )
-    _filter_fps_and_long_vars_from_probe_mapped_vcf(
-        probe_mapped_vcf, probe_filtered_vcf, max_ref_len
+    scratch.remove_intermediate_files(keep, merged_vcf)
+    checkpoint.run_stage(
+        [probe_filtered_vcf],
+        [probe_mapped_vcf],
+        {"max_ref_len": max_ref_len},
+        resume,
+        _filter_fps_and_long_vars_from_probe_mapped_vcf,
+        probe_mapped_vcf,
+        probe_filtered_vcf,
+        max_ref_len,
     )
+    scratch.remove_intermediate_files(keep, probe_mapped_vcf)
     logging.info(f"Made filtered VCF file {probe_filtered_vcf}")
-    logging.info("Using bcftools to normalise and remove duplicates")
-    _bcftools_norm(ref_fasta, probe_filtered_vcf, truth_vcf)
+    logging.info("Normalising and removing duplicates")
+    checkpoint.run_stage(
+        [truth_vcf],
+        [probe_filtered_vcf, ref_fasta],
+        None,
+        resume,
+        _normalise_vcf,
+        ref_fasta,
+        probe_filtered_vcf,
+        truth_vcf,
+    )
+    scratch.remove_intermediate_files(keep, probe_filtered_vcf)
+    # The probes of the truth variants are saved, so that calculating
+    # recall against this truth VCF does not need to make them again
+    probes_file = truth_probes.probes_file(truth_vcf)
+    checkpoint.run_stage(
+        [probes_file],
+        [truth_vcf, ref_fasta],
+        {"flank_length": flank_length},
+        resume,
+        truth_probes.write_truth_probes,
+        truth_vcf,
+        ref_fasta,
+        flank_length,
+        probes_file,
+    )
     logging.info(f"Finished making truth VCF file {truth_vcf}")
     return truth_vcf
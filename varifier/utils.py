@@ -1,3 +1,5 @@
+import bisect
+
 import pyfastaq
 
 from cluster_vcf_records import vcf_file_read
@@ -29,20 +31,60 @@ def mask_vcf_file(vcf_in, mask_bed_file, vcf_out):
         for line in f_in:
             if not line.startswith("#"):
                 chrom, pos, _, ref, _ = line.split("\t", maxsplit=4)
-                in_mask = False
-                if chrom in mask:
-                    pos = int(pos) - 1
-                    for i in range(pos, pos + len(ref)):
-                        if i in mask[chrom]:
-                            in_mask = True
-                            break
-
-                    if in_mask:
-                        continue
+                if ref_is_in_mask(chrom, int(pos) - 1, ref, mask):
+                    continue
 
             print(line, end="", file=f_out)
 
 
+def ref_is_in_mask(chrom, pos, ref, mask):
+    """Returns True if the REF allele ref, at (0-based) position pos of
+    chrom, intersects the mask made by load_mask_bed_file()"""
+    if chrom not in mask:
+        return False
+    return any(i in mask[chrom] for i in range(pos, pos + len(ref)))
+
+
+def load_bed_intervals(bed_file):
+    """Loads the first three columns (ref seq name, start, end) of a BED
+    file. Returns a dictionary of ref seq name -> tuple (starts, ends), which
+    are sorted lists of the (0-based) start and end (exclusive) coords of
+    the intervals, with overlapping intervals merged. Unlike
+    load_mask_bed_file(), the memory used does not depend on the size of
+    the intervals"""
+    intervals = {}
+    with pyfastaq.utils.open_file_read(bed_file) as f:
+        for line in f:
+            if line.startswith(("#", "track", "browser")) or line.strip() == "":
+                continue
+            chrom, start, end = line.rstrip("\n").split("\t")[:3]
+            intervals.setdefault(chrom, []).append((int(start), int(end)))
+
+    merged = {}
+    for chrom, chrom_intervals in intervals.items():
+        starts, ends = [], []
+        for start, end in sorted(chrom_intervals):
+            if len(ends) > 0 and start <= ends[-1]:
+                ends[-1] = max(ends[-1], end)
+            else:
+                starts.append(start)
+                ends.append(end)
+        merged[chrom] = starts, ends
+    return merged
+
+
+def ref_is_in_intervals(chrom, pos, ref, intervals):
+    """Returns True if the REF allele ref, at (0-based) position pos of
+    chrom, intersects the intervals made by load_bed_intervals()"""
+    if chrom not in intervals:
+        return False
+    starts, ends = intervals[chrom]
+    # The last interval that starts at or before the end of the allele is
+    # the only one that can overlap it, because the intervals are merged
+    i = bisect.bisect_right(starts, pos + len(ref) - 1) - 1
+    return i >= 0 and ends[i] > pos
+
+
 def vcf_records_are_the_same(file1, file2):
     """Returns True if records in the two VCF files are the same.
     Ignores header lines in the files. Returns False if any lines are different"""
@@ -1,11 +1,26 @@
+import bisect
+import contextlib
+import copy
+import heapq
 import json
 import logging
+import operator
 import os
 import subprocess
+import uuid
 
-from cluster_vcf_records import vcf_file_read, vcf_record
+from cluster_vcf_records import vcf_file_read
 
-from varifier import probe_mapping, recall, utils, vcf_stats
+from varifier import (
+    checkpoint,
+    probe_mapping,
+    recall,
+    registry,
+    scratch,
+    utils,
+    vcf_record,
+    vcf_stats,
+)
 
 
 def _add_overall_precision_and_recall_to_summary_stats(summary_stats):
@@ -14,6 +29,8 @@ def _add_overall_precision_and_recall_to_summary_stats(summary_stats):
     # (because these tags were added by probe mapping, which uses TP,FP).
     # So we either have FP or FN for the "wrong" variants from probe mapping.
     for prec_or_recall in "Precision", "Recall":
+        if prec_or_recall not in summary_stats:
+            continue
         fp_key = "FP" if prec_or_recall == "Precision" else "FN"
         d = summary_stats[prec_or_recall]
         tp = d["TP"]["Count"]
@@ -37,6 +54,56 @@ def _add_overall_precision_and_recall_to_summary_stats(summary_stats):
             d[f"{prec_or_recall}_edit_dist"] = 0
 
 
+def _vcf_record_exclude_reason(
+    record, ref_seqs, filter_pass=None, keep_ref_calls=False
+):
+    """Returns the reason why the VcfRecord record should not be evaluated,
+    or None if it should be kept"""
+    exclude_reason = None
+
+    filter_is_dot_and_fails = (
+        filter_pass is not None and len(record.FILTER) == 0 and "." not in filter_pass
+    )
+    filter_not_dot_and_fails = (
+        filter_pass is not None
+        and len(record.FILTER) > 0
+        and record.FILTER.isdisjoint(filter_pass)
+    )
+    filter_fails = filter_is_dot_and_fails or filter_not_dot_and_fails
+
+    if "MISMAPPED_UNPLACEABLE" in record.FILTER or filter_fails:
+        exclude_reason = "filter_fail"
+    elif len(record.ALT) == 0 or record.ALT == ["."]:
+        exclude_reason = "other"
+    elif record.FORMAT is None:
+        exclude_reason = "no_genotype"
+    elif record.REF in [".", ""]:
+        exclude_reason = "other"
+    if ref_seqs[record.CHROM][record.POS : record.POS + len(record.REF)] != record.REF:
+        exclude_reason = "other"
+
+    if exclude_reason is None:
+        gt = set(record.FORMAT.get("GT", ".").split("/"))
+        if len(gt) > 1:
+            exclude_reason = "heterozygous"
+        elif "." in gt:
+            exclude_reason = "no_genotype"
+        elif not keep_ref_calls and "0" in gt:
+            exclude_reason = "ref_call"
+
+    return exclude_reason
+
+
+def _new_filter_counts():
+    return {
+        "filter_fail": 0,
+        "heterozygous": 0,
+        "no_genotype": 0,
+        "ref_call": 0,
+        "other": 0,
+    }
+
+
 def _filter_vcf(
     infile,
     outfile_keep,
@@ -45,13 +112,7 @@ def _filter_vcf(
     filter_pass=None,
     keep_ref_calls=False,
 ):
-    counts = {
-        "filter_fail": 0,
-        "heterozygous": 0,
-        "no_genotype": 0,
-        "ref_call": 0,
-        "other": 0,
-    }
+    counts = _new_filter_counts()
     with vcf_file_read.open_vcf_file_for_reading(infile) as f_in, open(
         outfile_keep, "w"
     ) as f_out_keep, open(outfile_exclude, "w") as f_out_exclude:
@@ -62,46 +123,12 @@ def _filter_vcf(
                 continue
 
             record = vcf_record.VcfRecord(line)
-            exclude_reason = None
-
-            filter_is_dot_and_fails = (
-                filter_pass is not None
-                and len(record.FILTER) == 0
-                and "." not in filter_pass
-            )
-            filter_not_dot_and_fails = (
-                filter_pass is not None
-                and len(record.FILTER) > 0
-                and record.FILTER.isdisjoint(filter_pass)
+            exclude_reason = _vcf_record_exclude_reason(
+                record, ref_seqs, filter_pass=filter_pass, keep_ref_calls=keep_ref_calls
             )
-            filter_fails = filter_is_dot_and_fails or filter_not_dot_and_fails
-
-            if "MISMAPPED_UNPLACEABLE" in record.FILTER or filter_fails:
-                exclude_reason = "filter_fail"
-            elif len(record.ALT) == 0 or record.ALT == ["."]:
-                exclude_reason = "other"
-            elif record.FORMAT is None:
-                exclude_reason = "no_genotype"
-            elif record.REF in [".", ""]:
-                exclude_reason = "other"
-            if (
-                ref_seqs[record.CHROM][record.POS : record.POS + len(record.REF)]
-                != record.REF
-            ):
-                exclude_reason = "other"
-
             if exclude_reason is None:
-                gt = set(record.FORMAT.get("GT", ".").split("/"))
-                if len(gt) > 1:
-                    exclude_reason = "heterozygous"
-                elif "." in gt:
-                    exclude_reason = "no_genotype"
-                elif not keep_ref_calls and "0" in gt:
-                    exclude_reason = "ref_call"
-                else:
-                    print(record, file=f_out_keep)
-
-            if exclude_reason is not None:
+                print(record, file=f_out_keep)
+            else:
                 record.set_format_key_value("VFR_EXCLUDE_REASON", exclude_reason)
                 print(record, file=f_out_exclude)
                 counts[exclude_reason] += 1
@@ -109,6 +136,381 @@ def _filter_vcf(
     return counts
 
 
+def _filter_vcf_records(
+    vcf_records,
+    ref_seqs,
+    counts,
+    f_exclude=None,
+    filter_pass=None,
+    keep_ref_calls=False,
+):
+    """Same as _filter_vcf(), but is a generator that takes an iterable of
+    VcfRecords and yields the ones that are kept. Excluded records are
+    counted in counts (made by _new_filter_counts()), and written to the
+    open file f_exclude if it is not None"""
+    for record in vcf_records:
+        exclude_reason = _vcf_record_exclude_reason(
+            record, ref_seqs, filter_pass=filter_pass, keep_ref_calls=keep_ref_calls
+        )
+        if exclude_reason is None:
+            yield record
+        else:
+            counts[exclude_reason] += 1
+            if f_exclude is not None:
+                record.set_format_key_value("VFR_EXCLUDE_REASON", exclude_reason)
+                print(record, file=f_exclude)
+
+
+def _tee_to_vcf(header_lines, vcf_records, outfile):
+    """Generator that yields each record of the iterable vcf_records, and
+    also writes it to the VCF file outfile. If outfile is None, the records
+    are only yielded"""
+    if outfile is None:
+        yield from vcf_records
+        return
+    with open(outfile, "w") as f:
+        print(*header_lines, sep="\n", file=f)
+        for record in vcf_records:
+            print(record, file=f)
+            yield record
+
+
+def _annotate_and_summarise(
+    header_lines,
+    vcf_records,
+    vcf_ref_seqs,
+    truth_ref_fasta,
+    flank_length,
+    vcf_out,
+    for_recall=False,
+    masked_vcf_out=None,
+    ref_mask=None,
+    map_outfile=None,
+    truth_mask=None,
+    max_flank_length=None,
+    probe_hit_cache=None,
+    probe_hit_cache_size=1000000,
+    precomputed_probes=None,
+    truth_windows=None,
+    strata=None,
+):
+    """Annotates the list vcf_records using probe mapping to
+    truth_ref_fasta, and returns the summary stats made by _summarise(),
+    which also writes vcf_out and masked_vcf_out.
+    precomputed_probes and truth_windows: see
+    probe_mapping.annotate_vcf_records()"""
+    f_map = None if map_outfile is None else open(map_outfile, "w")
+    disk_cache = probe_mapping.open_probe_hit_cache(
+        probe_hit_cache, truth_ref_fasta, probe_hit_cache_size
+    )
+    header_lines = (
+        header_lines[:-1] + probe_mapping.annotation_header_lines + header_lines[-1:]
+    )
+    annotated = probe_mapping.annotate_vcf_records(
+        vcf_records,
+        vcf_ref_seqs,
+        registry.get_seqs(truth_ref_fasta),
+        probe_mapping.LazyMapper(
+            lambda: probe_mapping.get_probe_mapper(truth_ref_fasta)
+        ),
+        flank_length,
+        f_map=f_map,
+        truth_mask=truth_mask,
+        max_flank_length=max_flank_length,
+        truth_windows=truth_windows,
+        disk_cache=disk_cache,
+        precomputed_probes=precomputed_probes,
+    )
+    summary_stats = _summarise(
+        header_lines,
+        annotated,
+        vcf_out,
+        for_recall=for_recall,
+        masked_vcf_out=masked_vcf_out,
+        ref_mask=ref_mask,
+        strata=strata,
+    )
+    if f_map is not None:
+        f_map.close()
+    if disk_cache is not None:
+        disk_cache.close()
+    return summary_stats
+
+
+def _summarise(
+    header_lines,
+    annotated,
+    vcf_out,
+    for_recall=False,
+    masked_vcf_out=None,
+    ref_mask=None,
+    strata=None,
+):
+    """Returns the summary stats of the iterable of annotated VcfRecords
+    annotated. The records are (if ref_mask is not None) masked, and counted
+    as they are made, and are written to vcf_out (before masking) and
+    masked_vcf_out (after masking) on the way. Either file can be None, to
+    not write it. strata can be a dictionary of stratum name -> intervals
+    made by utils.load_bed_intervals(). The summary stats of the records in
+    each stratum are then added to the returned stats, in "Strata"."""
+    annotated = _tee_to_vcf(header_lines, annotated, vcf_out)
+    if ref_mask is not None:
+        annotated = _tee_to_vcf(
+            header_lines,
+            (
+                x
+                for x in annotated
+                if not utils.ref_is_in_mask(x.CHROM, x.POS, x.REF, ref_mask)
+            ),
+            masked_vcf_out,
+        )
+    # The stats of each record are made once, and shared by all the strata
+    # that it is in
+    per_record_stats = []
+    strata_per_record_stats = {x: [] for x in strata or {}}
+    for record in annotated:
+        stats = vcf_stats.per_record_stats_from_vcf_records([record])[0]
+        per_record_stats.append(stats)
+        for name in _strata_of_record(record, strata or {}):
+            strata_per_record_stats[name].append(stats)
+    summary_stats = vcf_stats.summary_stats_from_per_record_stats(
+        per_record_stats, for_recall=for_recall
+    )
+    if strata is not None:
+        summary_stats["Strata"] = {
+            name: vcf_stats.summary_stats_from_per_record_stats(
+                stats, for_recall=for_recall
+            )
+            for name, stats in strata_per_record_stats.items()
+        }
+    return summary_stats
+
+
+def _precision_stats(precision_vcf, strata=None):
+    """Returns the summary stats of precision_vcf, which was annotated for
+    precision. strata: see _summarise()"""
+    header_lines, records = vcf_record.vcf_file_to_list(precision_vcf)
+    return _summarise(header_lines, records, None, strata=strata)
+
+
+def _strata_of_record(record, strata):
+    """Returns a list of the names of the strata that the REF allele of
+    record intersects. strata is a dictionary of stratum name -> intervals
+    made by utils.load_bed_intervals()"""
+    return [
+        name
+        for name, intervals in strata.items()
+        if utils.ref_is_in_intervals(record.CHROM, record.POS, record.REF, intervals)
+    ]
+
+
+def _filter_multi_sample_vcf(
+    infile,
+    outfiles_keep,
+    outfiles_exclude,
+    ref_seqs,
+    filter_pass=None,
+    keep_ref_calls=False,
+):
+    """Same as _filter_vcf(), but for a VCF file with more than one sample.
+    outfiles_keep and outfiles_exclude are dictionaries of sample name ->
+    filename. Each output file has only the one sample. The input file is
+    read once. Returns a dictionary of sample name -> excluded counts"""
+    counts = {x: _new_filter_counts() for x in outfiles_keep}
+    columns = None
+    f_keep = {x: open(y, "w") for x, y in outfiles_keep.items()}
+    f_exclude = {x: open(y, "w") for x, y in outfiles_exclude.items()}
+
+    with vcf_file_read.open_vcf_file_for_reading(infile) as f_in:
+        for line in f_in:
+            if line.startswith("##"):
+                for f in list(f_keep.values()) + list(f_exclude.values()):
+                    print(line, end="", file=f)
+                continue
+
+            fields = line.rstrip("\n").split("\t")
+            if line.startswith("#"):
+                columns = {}
+                for sample in outfiles_keep:
+                    try:
+                        columns[sample] = fields.index(sample, 9)
+                    except ValueError:
+                        raise Exception(f"Sample {sample} not found in {infile}")
+                    header = "\t".join(fields[:9] + [sample])
+                    print(header, file=f_keep[sample])
+                    print(header, file=f_exclude[sample])
+                continue
+
+            if columns is None:
+                raise Exception(f"No #CHROM header line found in {infile}")
+
+            for sample, column in columns.items():
+                record = vcf_record.VcfRecord("\t".join(fields[:9] + [fields[column]]))
+                exclude_reason = _vcf_record_exclude_reason(
+                    record,
+                    ref_seqs,
+                    filter_pass=filter_pass,
+                    keep_ref_calls=keep_ref_calls,
+                )
+                if exclude_reason is None:
+                    print(record, file=f_keep[sample])
+                else:
+                    record.set_format_key_value("VFR_EXCLUDE_REASON", exclude_reason)
+                    print(record, file=f_exclude[sample])
+                    counts[sample][exclude_reason] += 1
+
+    for f in list(f_keep.values()) + list(f_exclude.values()):
+        f.close()
+    return counts
+
+
+def _filter_vcf_with_policies(
+    infile,
+    outfiles_keep,
+    outfiles_exclude,
+    ref_seqs,
+    filter_policies,
+    keep_ref_calls=False,
+):
+    """Same as _filter_vcf(), but filters the VCF file in more than one way.
+    filter_policies is a dictionary of policy name -> filter_pass.
+    outfiles_keep and outfiles_exclude are dictionaries of policy name ->
+    filename. The input file is read once. Returns a dictionary of policy
+    name -> excluded counts"""
+    counts = {x: _new_filter_counts() for x in filter_policies}
+    with contextlib.ExitStack() as stack:
+        f_keep = {
+            x: stack.enter_context(open(y, "w")) for x, y in outfiles_keep.items()
+        }
+        f_exclude = {
+            x: stack.enter_context(open(y, "w")) for x, y in outfiles_exclude.items()
+        }
+        f_in = stack.enter_context(vcf_file_read.open_vcf_file_for_reading(infile))
+        for line in f_in:
+            if line.startswith("#"):
+                for f in list(f_keep.values()) + list(f_exclude.values()):
+                    print(line, end="", file=f)
+                continue
+
+            for name, filter_pass in filter_policies.items():
+                record = vcf_record.VcfRecord(line)
+                exclude_reason = _vcf_record_exclude_reason(
+                    record,
+                    ref_seqs,
+                    filter_pass=filter_pass,
+                    keep_ref_calls=keep_ref_calls,
+                )
+                if exclude_reason is None:
+                    print(record, file=f_keep[name])
+                else:
+                    record.set_format_key_value("VFR_EXCLUDE_REASON", exclude_reason)
+                    print(record, file=f_exclude[name])
+                    counts[name][exclude_reason] += 1
+
+    return counts
+
+
+def _check_dir_names(names, what):
+    """Raises an exception if any of names (eg of filter policies) cannot be
+    used as the name of a directory inside the output directory. what is
+    the kind of name, for the error message"""
+    for name in names:
+        if (
+            name in {"", ".", ".."}
+            or os.sep in name
+            or (os.altsep is not None and os.altsep in name)
+        ):
+            raise Exception(
+                f"Cannot use this {what} name, because it is used as a directory name: {name}"
+            )
+
+
+def _mask_vcf(vcf_to_eval, ref_mask_bed_file, outdir, resume):
+    """Masks vcf_to_eval, if ref_mask_bed_file is not None, writing the
+    masked VCF file in outdir. Returns the name of the VCF file to filter"""
+    if ref_mask_bed_file is None:
+        return vcf_to_eval
+    logging.info("Masking VCF...")
+    masked_vcf = os.path.join(outdir, "variants_to_eval.masked.vcf")
+    checkpoint.run_stage(
+        [masked_vcf],
+        [vcf_to_eval, ref_mask_bed_file],
+        None,
+        resume,
+        utils.mask_vcf_file,
+        vcf_to_eval,
+        ref_mask_bed_file,
+        masked_vcf,
+    )
+    logging.info("Masked VCF")
+    return masked_vcf
+
+
+def _mask_and_filter_vcf(
+    vcf_to_eval,
+    vcf_ref_fasta,
+    outdir,
+    ref_mask_bed_file=None,
+    filter_pass=None,
+    discard_ref_calls=True,
+    resume=False,
+    keep="all",
+):
+    """Masks (if ref_mask_bed_file is not None) and filters vcf_to_eval,
+    writing the files in outdir. Returns tuple (filtered VCF filename,
+    excluded VCF filename, counts of excluded records)"""
+    vcf_to_filter = _mask_vcf(vcf_to_eval, ref_mask_bed_file, outdir, resume)
+
+    filtered_vcf = os.path.join(outdir, "variants_to_eval.filtered.vcf")
+    excluded_vcf = os.path.join(outdir, "variants_to_eval.excluded.vcf")
+    logging.info("Filtering VCF...")
+    filtered_counts = checkpoint.run_stage(
+        [filtered_vcf, excluded_vcf],
+        [vcf_to_filter, vcf_ref_fasta],
+        {"filter_pass": filter_pass, "keep_ref_calls": not discard_ref_calls},
+        resume,
+        lambda: _filter_vcf(
+            vcf_to_filter,
+            filtered_vcf,
+            excluded_vcf,
+            registry.get_seqs(vcf_ref_fasta),
+            filter_pass=filter_pass,
+            keep_ref_calls=not discard_ref_calls,
+        ),
+    )
+    if vcf_to_filter != vcf_to_eval:
+        scratch.remove_intermediate_files(keep, vcf_to_filter)
+    logging.info("Filtering VCF done")
+    return filtered_vcf, excluded_vcf, filtered_counts
+
+
+def _combine_summary_stats(
+    precision_stats, recall_stats, filtered_counts, summary_stats_json
+):
+    """Writes summary_stats_json, made from the summary stats of precision
+    and recall, and the counts of excluded records. Returns the combined
+    stats. If precision_stats and recall_stats have "Strata" (see
+    _annotate_and_summarise()), then the stats of each stratum are in
+    "Strata" of the combined stats"""
+    precision_stats = dict(precision_stats)
+    recall_stats = dict(recall_stats)
+    precision_strata = precision_stats.pop("Strata", None)
+    recall_strata = recall_stats.pop("Strata", None)
+    summary_stats = {"Recall": recall_stats, "Precision": precision_stats}
+    _add_overall_precision_and_recall_to_summary_stats(summary_stats)
+    summary_stats["Excluded_record_counts"] = filtered_counts
+    if precision_strata is not None:
+        summary_stats["Strata"] = {}
+        for name, stats in precision_strata.items():
+            stratum_stats = {"Precision": stats, "Recall": recall_strata[name]}
+            _add_overall_precision_and_recall_to_summary_stats(stratum_stats)
+            summary_stats["Strata"][name] = stratum_stats
+
+    with open(summary_stats_json, "w") as f:
+        json.dump(summary_stats, f, indent=2, sort_keys=True)
+    return summary_stats
+
+
 def evaluate_vcf(
     vcf_to_eval,
     vcf_ref_fasta,
@@ -123,95 +525,1334 @@ def evaluate_vcf(
     discard_ref_calls=True,
     max_recall_ref_len=None,
     filter_pass=None,
+    resume=False,
+    threads=1,
+    max_flank_length=None,
+    local_probe_mapping=False,
+    probe_hit_cache=None,
+    probe_hit_cache_size=1000000,
+    tmpdir=None,
+    keep="all",
+    filter_policies=None,
+    strata_bed_files=None,
 ):
-    if force:
-        subprocess.check_output(f"rm -rf {outdir}", shell=True)
-    os.mkdir(outdir)
+    """filter_policies can be used instead of filter_pass, to compare more
+    than one way of filtering the VCF file. It is a dictionary of policy
+    name -> filter_pass. Each policy is evaluated in
+    outdir/filter_policies/<policy name>/, which has the same files as the
+    output directory of evaluate_multi_sample_vcf() has for each sample.
+    outdir/summary_stats.json has the stats for all policies.
+    strata_bed_files can be a dictionary of stratum name -> BED file. The
+    stats of the precision and recall records that intersect the regions
+    in each BED file are then in "Strata" of summary_stats.json"""
+    if filter_policies is not None:
+        if filter_pass is not None:
+            raise Exception("Cannot use filter_pass and filter_policies together")
+        _check_dir_names(filter_policies, "filter policy")
+        return _evaluate_vcf_with_filter_policies(
+            vcf_to_eval,
+            vcf_ref_fasta,
+            truth_ref_fasta,
+            flank_length,
+            outdir,
+            filter_policies,
+            truth_vcf=truth_vcf,
+            debug=debug,
+            force=force,
+            ref_mask_bed_file=ref_mask_bed_file,
+            truth_mask_bed_file=truth_mask_bed_file,
+            discard_ref_calls=discard_ref_calls,
+            max_recall_ref_len=max_recall_ref_len,
+            resume=resume,
+            threads=threads,
+            max_flank_length=max_flank_length,
+            local_probe_mapping=local_probe_mapping,
+            probe_hit_cache=probe_hit_cache,
+            probe_hit_cache_size=probe_hit_cache_size,
+            tmpdir=tmpdir,
+            keep=keep,
+            strata_bed_files=strata_bed_files,
+        )
 
-    # Mask if needed
-    if ref_mask_bed_file is None:
-        vcf_to_filter = vcf_to_eval
+    with scratch.output_dir(
+        outdir,
+        tmpdir=tmpdir,
+        keep=keep,
+        resume=resume,
+        force=force,
+        results=["summary_stats.json"],
+    ) as workdir:
+        if ref_mask_bed_file is None:
+            ref_mask = None
+        else:
+            ref_mask = registry.get_mask(ref_mask_bed_file)
+        if truth_mask_bed_file is None:
+            truth_mask = None
+        else:
+            truth_mask = registry.get_mask(truth_mask_bed_file)
+        if strata_bed_files is None:
+            strata = None
+            strata_bed_files = {}
+        else:
+            strata = {
+                name: registry.get_bed_intervals(bed_file)
+                for name, bed_file in strata_bed_files.items()
+            }
+        vcf_ref_seqs = registry.get_seqs(vcf_ref_fasta)
+
+        # The VCF file is read once, then masked, filtered, annotated and
+        # counted as the records pass through. The VCF files of each step
+        # are only written along the way, and are not read again
+        filtered_vcf = os.path.join(workdir, "variants_to_eval.filtered.vcf")
+        excluded_vcf = os.path.join(workdir, "variants_to_eval.excluded.vcf")
+        vcf_for_precision = os.path.join(workdir, "precision.vcf")
+        filtered_records = None
+
+        def precision_stage():
+            nonlocal filtered_records
+            header_lines, records = vcf_record.vcf_file_to_list(vcf_to_eval)
+            if ref_mask is not None:
+                records = _tee_to_vcf(
+                    header_lines,
+                    (
+                        x
+                        for x in records
+                        if not utils.ref_is_in_mask(x.CHROM, x.POS, x.REF, ref_mask)
+                    ),
+                    (
+                        os.path.join(workdir, "variants_to_eval.masked.vcf")
+                        if keep == "all"
+                        else None
+                    ),
+                )
+            filtered_counts = _new_filter_counts()
+            with open(excluded_vcf, "w") as f_exclude:
+                print(*header_lines, sep="\n", file=f_exclude)
+                filtered_records = list(
+                    _tee_to_vcf(
+                        header_lines,
+                        _filter_vcf_records(
+                            records,
+                            vcf_ref_seqs,
+                            filtered_counts,
+                            f_exclude=f_exclude,
+                            filter_pass=filter_pass,
+                            keep_ref_calls=not discard_ref_calls,
+                        ),
+                        filtered_vcf,
+                    )
+                )
+            logging.info("Filtering VCF done")
+            precision_stats = _annotate_and_summarise(
+                header_lines,
+                filtered_records,
+                vcf_ref_seqs,
+                truth_ref_fasta,
+                flank_length,
+                vcf_for_precision,
+                map_outfile=f"{vcf_for_precision}.debug.map" if debug else None,
+                truth_mask=truth_mask,
+                max_flank_length=max_flank_length,
+                probe_hit_cache=probe_hit_cache,
+                probe_hit_cache_size=probe_hit_cache_size,
+                strata=strata,
+            )
+            return filtered_counts, precision_stats
+
+        logging.info("Filtering VCF and annotating with TP/FP for precision...")
+        filtered_counts, precision_stats = checkpoint.run_stage(
+            [vcf_for_precision, filtered_vcf, excluded_vcf],
+            [
+                vcf_to_eval,
+                vcf_ref_fasta,
+                truth_ref_fasta,
+                ref_mask_bed_file,
+                truth_mask_bed_file,
+                *strata_bed_files.values(),
+            ],
+            {
+                "filter_pass": filter_pass,
+                "keep_ref_calls": not discard_ref_calls,
+                "flank_length": flank_length,
+                "max_flank_length": max_flank_length,
+                "strata": strata_bed_files,
+            },
+            resume,
+            precision_stage,
+        )
+        logging.info("Annotating VCF with TP/FP for precision done")
+
+        logging.info("Calculating recall...")
+        _, recall_stats = recall.get_recall(
+            vcf_ref_fasta,
+            filtered_vcf,
+            os.path.join(workdir, "recall"),
+            flank_length,
+            truth_fasta=truth_ref_fasta if truth_vcf is None else None,
+            truth_vcf=truth_vcf,
+            debug=debug,
+            truth_mask_bed_file=truth_mask_bed_file,
+            max_ref_len=max_recall_ref_len,
+            resume=resume,
+            threads=threads,
+            max_flank_length=max_flank_length,
+            local_probe_mapping=local_probe_mapping,
+            probe_hit_cache=probe_hit_cache,
+            probe_hit_cache_size=probe_hit_cache_size,
+            keep=keep,
+            ref_mask_bed_file=ref_mask_bed_file,
+            strata_bed_files=strata_bed_files,
+            vcf_records=filtered_records,
+        )
+        scratch.remove_intermediate_files(keep, filtered_vcf)
+        logging.info("Recall calculation done")
+
+        logging.info("Gathering stats...")
+        summary_stats_json = os.path.join(workdir, "summary_stats.json")
+        _combine_summary_stats(
+            precision_stats, recall_stats, filtered_counts, summary_stats_json
+        )
+    # With a tmpdir, files are only moved to outdir when the context exits
+    summary_stats_json = os.path.join(outdir, "summary_stats.json")
+    logging.info(f"Done. Results written to {summary_stats_json}")
+
+
+def _evaluate_vcf_with_filter_policies(
+    vcf_to_eval,
+    vcf_ref_fasta,
+    truth_ref_fasta,
+    flank_length,
+    outdir,
+    filter_policies,
+    truth_vcf=None,
+    debug=False,
+    force=False,
+    ref_mask_bed_file=None,
+    truth_mask_bed_file=None,
+    discard_ref_calls=True,
+    max_recall_ref_len=None,
+    resume=False,
+    threads=1,
+    max_flank_length=None,
+    local_probe_mapping=False,
+    probe_hit_cache=None,
+    probe_hit_cache_size=1000000,
+    tmpdir=None,
+    keep="all",
+    strata_bed_files=None,
+):
+    with scratch.output_dir(
+        outdir,
+        tmpdir=tmpdir,
+        keep=keep,
+        resume=resume,
+        force=force,
+        results=["summary_stats.json"],
+    ) as workdir:
+        policies_dir = os.path.join(workdir, "filter_policies")
+        policy_dirs = {x: os.path.join(policies_dir, x) for x in filter_policies}
+        for directory in [policies_dir] + list(policy_dirs.values()):
+            if not (resume and os.path.exists(directory)):
+                os.mkdir(directory)
+
+        vcf_to_filter = _mask_vcf(vcf_to_eval, ref_mask_bed_file, workdir, resume)
+
+        filtered_vcfs = {
+            x: os.path.join(y, "variants_to_eval.filtered.vcf")
+            for x, y in policy_dirs.items()
+        }
+        excluded_vcfs = {
+            x: os.path.join(y, "variants_to_eval.excluded.vcf")
+            for x, y in policy_dirs.items()
+        }
+        logging.info("Filtering VCF...")
+        filtered_counts = checkpoint.run_stage(
+            list(filtered_vcfs.values()) + list(excluded_vcfs.values()),
+            [vcf_to_filter, vcf_ref_fasta],
+            {
+                "filter_policies": filter_policies,
+                "keep_ref_calls": not discard_ref_calls,
+            },
+            resume,
+            lambda: _filter_vcf_with_policies(
+                vcf_to_filter,
+                filtered_vcfs,
+                excluded_vcfs,
+                registry.get_seqs(vcf_ref_fasta),
+                filter_policies,
+                keep_ref_calls=not discard_ref_calls,
+            ),
+        )
+        if vcf_to_filter != vcf_to_eval:
+            scratch.remove_intermediate_files(keep, vcf_to_filter)
+        logging.info("Filtering VCF done")
+
+        # Precision probe mapping is shared between the policies, because
+        # most calls pass more than one policy. Recall needs a mutated
+        # genome for each policy, so is done separately
+        summary_stats = _evaluate_filtered_vcfs(
+            policy_dirs,
+            filtered_vcfs,
+            excluded_vcfs,
+            filtered_counts,
+            vcf_ref_fasta,
+            {x: truth_ref_fasta for x in filter_policies},
+            {} if truth_vcf is None else {x: truth_vcf for x in filter_policies},
+            flank_length,
+            debug=debug,
+            truth_mask_bed_file=truth_mask_bed_file,
+            ref_mask_bed_file=ref_mask_bed_file,
+            discard_ref_calls=discard_ref_calls,
+            max_recall_ref_len=max_recall_ref_len,
+            resume=resume,
+            threads=threads,
+            max_flank_length=max_flank_length,
+            local_probe_mapping=local_probe_mapping,
+            probe_hit_cache=probe_hit_cache,
+            probe_hit_cache_size=probe_hit_cache_size,
+            keep=keep,
+            strata_bed_files=strata_bed_files,
+        )
+        summary_stats_json = os.path.join(workdir, "summary_stats.json")
+        with open(summary_stats_json, "w") as f:
+            json.dump({"Filter_policies": summary_stats}, f, indent=2, sort_keys=True)
+    summary_stats_json = os.path.join(outdir, "summary_stats.json")
+    logging.info(f"Done. Results written to {summary_stats_json}")
+
+
+def evaluate_multi_sample_vcf(
+    vcf_to_eval,
+    vcf_ref_fasta,
+    truth_ref_fastas,
+    flank_length,
+    outdir,
+    truth_vcfs=None,
+    debug=False,
+    force=False,
+    ref_mask_bed_file=None,
+    truth_mask_bed_file=None,
+    discard_ref_calls=True,
+    max_recall_ref_len=None,
+    filter_pass=None,
+    resume=False,
+    threads=1,
+    max_flank_length=None,
+    local_probe_mapping=False,
+    probe_hit_cache=None,
+    probe_hit_cache_size=1000000,
+    tmpdir=None,
+    keep="all",
+):
+    """Evaluates more than one sample of a multi-sample VCF file.
+    truth_ref_fastas is a dictionary of sample name -> truth FASTA file, and
+    truth_vcfs (if used) is a dictionary of sample name -> truth VCF file.
+    The VCF file is masked and filtered once, and precision is calculated for
+    all samples together. The results for each sample are written to
+    outdir/<sample name>/, which has the same files as the output directory
+    of evaluate_vcf()"""
+    if truth_vcfs is None:
+        truth_vcfs = {}
+    samples = list(truth_ref_fastas)
+    _check_dir_names(samples, "sample")
+    with scratch.output_dir(
+        outdir,
+        tmpdir=tmpdir,
+        keep=keep,
+        resume=resume,
+        force=force,
+        results=[os.path.join(x, "summary_stats.json") for x in samples],
+    ) as workdir:
+        sample_dirs = {x: os.path.join(workdir, x) for x in samples}
+        for sample_dir in sample_dirs.values():
+            if not (resume and os.path.exists(sample_dir)):
+                os.mkdir(sample_dir)
+
+        vcf_to_filter = _mask_vcf(vcf_to_eval, ref_mask_bed_file, workdir, resume)
+
+        filtered_vcfs = {
+            x: os.path.join(y, "variants_to_eval.filtered.vcf")
+            for x, y in sample_dirs.items()
+        }
+        excluded_vcfs = {
+            x: os.path.join(y, "variants_to_eval.excluded.vcf")
+            for x, y in sample_dirs.items()
+        }
+        logging.info("Filtering VCF...")
+        filtered_counts = checkpoint.run_stage(
+            list(filtered_vcfs.values()) + list(excluded_vcfs.values()),
+            [vcf_to_filter, vcf_ref_fasta],
+            {"filter_pass": filter_pass, "keep_ref_calls": not discard_ref_calls},
+            resume,
+            lambda: _filter_multi_sample_vcf(
+                vcf_to_filter,
+                filtered_vcfs,
+                excluded_vcfs,
+                registry.get_seqs(vcf_ref_fasta),
+                filter_pass=filter_pass,
+                keep_ref_calls=not discard_ref_calls,
+            ),
+        )
+        if vcf_to_filter != vcf_to_eval:
+            scratch.remove_intermediate_files(keep, vcf_to_filter)
+        logging.info("Filtering VCF done")
+
+        _evaluate_filtered_vcfs(
+            sample_dirs,
+            filtered_vcfs,
+            excluded_vcfs,
+            filtered_counts,
+            vcf_ref_fasta,
+            truth_ref_fastas,
+            truth_vcfs,
+            flank_length,
+            debug=debug,
+            truth_mask_bed_file=truth_mask_bed_file,
+            ref_mask_bed_file=ref_mask_bed_file,
+            discard_ref_calls=discard_ref_calls,
+            max_recall_ref_len=max_recall_ref_len,
+            resume=resume,
+            threads=threads,
+            max_flank_length=max_flank_length,
+            local_probe_mapping=local_probe_mapping,
+            probe_hit_cache=probe_hit_cache,
+            probe_hit_cache_size=probe_hit_cache_size,
+            keep=keep,
+        )
+    logging.info(f"Done. Results written to {outdir}")
+
+
+def _consensus_summary_stats(precision_vcfs, summary_stats):
+    """Returns stats that combine the results from more than one truth
+    genome. precision_vcfs is a list of precision VCF files of the same
+    calls, one per truth genome. summary_stats is a dictionary of truth
+    name -> summary stats"""
+    counts = {"TP_in_all_truths": 0, "TP_in_some_truths": 0, "TP_in_no_truths": 0}
+    masked = 0
+    record_lists = [vcf_record.vcf_file_to_list(x)[1] for x in precision_vcfs]
+    for records in zip(*record_lists):
+        if any(x.FORMAT.get("VFR_IN_MASK") == "1" for x in records):
+            masked += 1
+            continue
+        tp_count = sum(x.FORMAT["VFR_RESULT"] == "TP" for x in records)
+        if tp_count == len(records):
+            counts["TP_in_all_truths"] += 1
+        elif tp_count > 0:
+            counts["TP_in_some_truths"] += 1
+        else:
+            counts["TP_in_no_truths"] += 1
+
+    total = sum(counts.values())
+    consensus = {"Precision": counts, "Recall": {}}
+    consensus["Precision"]["MASKED"] = masked
+    if total > 0:
+        consensus["Precision"]["Precision_all_truths"] = round(
+            counts["TP_in_all_truths"] / total, 8
+        )
+        consensus["Precision"]["Precision_any_truth"] = round(
+            (counts["TP_in_all_truths"] + counts["TP_in_some_truths"]) / total, 8
+        )
     else:
-        logging.info("Masking VCF...")
-        masked_vcf = os.path.join(outdir, "variants_to_eval.masked.vcf")
-        utils.mask_vcf_file(vcf_to_eval, ref_mask_bed_file, masked_vcf)
-        vcf_to_filter = masked_vcf
-        logging.info("Masked VCF")
+        consensus["Precision"]["Precision_all_truths"] = 0
+        consensus["Precision"]["Precision_any_truth"] = 0
 
-    vcf_ref_seqs = utils.file_to_dict_of_seqs(vcf_ref_fasta)
-    filtered_vcf = os.path.join(outdir, "variants_to_eval.filtered.vcf")
-    excluded_vcf = os.path.join(outdir, "variants_to_eval.excluded.vcf")
-    logging.info("Filtering VCF...")
-    filtered_counts = _filter_vcf(
-        vcf_to_filter,
-        filtered_vcf,
-        excluded_vcf,
-        vcf_ref_seqs,
-        filter_pass=filter_pass,
-        keep_ref_calls=not discard_ref_calls,
-    )
-    logging.info("Filtering VCF done")
+    for prec_or_recall in "Precision", "Recall":
+        values = [x[prec_or_recall][prec_or_recall] for x in summary_stats.values()]
+        consensus[prec_or_recall]["Min"] = min(values)
+        consensus[prec_or_recall]["Max"] = max(values)
+        consensus[prec_or_recall]["Mean"] = round(sum(values) / len(values), 8)
+    return consensus
 
-    vcf_for_precision = os.path.join(outdir, "precision.vcf")
-    map_outfile = f"{vcf_for_precision}.debug.map" if debug else None
+
+def evaluate_vcf_against_truths(
+    vcf_to_eval,
+    vcf_ref_fasta,
+    truth_ref_fastas,
+    flank_length,
+    outdir,
+    truth_vcfs=None,
+    debug=False,
+    force=False,
+    ref_mask_bed_file=None,
+    truth_mask_bed_files=None,
+    discard_ref_calls=True,
+    max_recall_ref_len=None,
+    filter_pass=None,
+    resume=False,
+    threads=1,
+    max_flank_length=None,
+    local_probe_mapping=False,
+    probe_hit_cache=None,
+    probe_hit_cache_size=1000000,
+    tmpdir=None,
+    keep="all",
+):
+    """Evaluates one VCF file against more than one truth genome.
+    truth_ref_fastas is a dictionary of truth name -> truth FASTA file.
+    truth_vcfs and truth_mask_bed_files (if used) are dictionaries of truth
+    name -> file. The VCF file is masked and filtered once, and the probes
+    for precision are made once and then mapped to each truth genome, using
+    up to threads genomes at once. The genome with the calls applied, used
+    for recall, is also only made once. The results for each truth are
+    written to outdir/truths/<truth name>/, which has the same files as the
+    output directory of evaluate_vcf(). outdir/summary_stats.json has the
+    stats for each truth, and a consensus of all the truths"""
+    if truth_vcfs is None:
+        truth_vcfs = {}
+    if truth_mask_bed_files is None:
+        truth_mask_bed_files = {}
+    names = list(truth_ref_fastas)
+    _check_dir_names(names, "truth")
+    with scratch.output_dir(
+        outdir,
+        tmpdir=tmpdir,
+        keep=keep,
+        resume=resume,
+        force=force,
+        results=["summary_stats.json"],
+    ) as workdir:
+        truths_dir = os.path.join(workdir, "truths")
+        truth_dirs = {x: os.path.join(truths_dir, x) for x in names}
+        for directory in [truths_dir] + list(truth_dirs.values()):
+            if not (resume and os.path.exists(directory)):
+                os.mkdir(directory)
+
+        filtered_vcf, excluded_vcf, filtered_counts = _mask_and_filter_vcf(
+            vcf_to_eval,
+            vcf_ref_fasta,
+            workdir,
+            ref_mask_bed_file=ref_mask_bed_file,
+            filter_pass=filter_pass,
+            discard_ref_calls=discard_ref_calls,
+            resume=resume,
+            keep=keep,
+        )
+
+        truth_masks = {
+            x: registry.get_mask(truth_mask_bed_files[x])
+            for x in names
+            if truth_mask_bed_files.get(x) is not None
+        }
+        logging.info("Annotating VCF with TP/FP for precision...")
+        precision_vcfs = {
+            x: os.path.join(truth_dirs[x], "precision.vcf") for x in names
+        }
+        checkpoint.run_stage(
+            [precision_vcfs[x] for x in names],
+            [filtered_vcf, vcf_ref_fasta]
+            + [truth_ref_fastas[x] for x in names]
+            + [truth_mask_bed_files.get(x) for x in names],
+            {
+                "flank_length": flank_length,
+                "max_flank_length": max_flank_length,
+                "use_ref_calls": not discard_ref_calls,
+            },
+            resume,
+            probe_mapping.annotate_vcf_with_probe_mapping_to_truths,
+            filtered_vcf,
+            vcf_ref_fasta,
+            [truth_ref_fastas[x] for x in names],
+            flank_length,
+            [precision_vcfs[x] for x in names],
+            truth_masks=[truth_masks.get(x) for x in names],
+            max_flank_length=max_flank_length,
+            probe_hit_cache=probe_hit_cache,
+            probe_hit_cache_size=probe_hit_cache_size,
+            threads=threads,
+            map_outfiles=(
+                [f"{precision_vcfs[x]}.debug.map" for x in names] if debug else None
+            ),
+        )
+        logging.info("Annotating VCF with TP/FP for precision done")
+
+        mutated_ref_fasta = os.path.join(workdir, "ref_with_mutations_added.fa")
+        recall.make_mutated_ref(vcf_ref_fasta, filtered_vcf, mutated_ref_fasta, resume)
+        try:
+            summary_stats = {}
+            for name in names:
+                logging.info(f"Calculating recall for truth {name}...")
+                truth_vcf = truth_vcfs.get(name)
+                _, recall_stats = recall.get_recall(
+                    vcf_ref_fasta,
+                    filtered_vcf,
+                    os.path.join(truth_dirs[name], "recall"),
+                    flank_length,
+                    debug=debug,
+                    truth_fasta=truth_ref_fastas[name] if truth_vcf is None else None,
+                    truth_vcf=truth_vcf,
+                    truth_mask_bed_file=truth_mask_bed_files.get(name),
+                    max_ref_len=max_recall_ref_len,
+                    resume=resume,
+                    threads=threads,
+                    max_flank_length=max_flank_length,
+                    local_probe_mapping=local_probe_mapping,
+                    probe_hit_cache=probe_hit_cache,
+                    probe_hit_cache_size=probe_hit_cache_size,
+                    keep=keep,
+                    mutated_ref_fasta=mutated_ref_fasta,
+                    ref_mask_bed_file=ref_mask_bed_file,
+                )
+                logging.info(f"Recall calculation for truth {name} done")
+                summary_stats[name] = _combine_summary_stats(
+                    _precision_stats(precision_vcfs[name]),
+                    recall_stats,
+                    filtered_counts,
+                    os.path.join(truth_dirs[name], "summary_stats.json"),
+                )
+        finally:
+            # The mutated genome is only used for recall, so don't keep it
+            # in memory, even if there was an error
+            registry.forget(mutated_ref_fasta)
+        scratch.remove_intermediate_files(keep, mutated_ref_fasta, filtered_vcf)
+
+        logging.info("Gathering stats...")
+        summary_stats = {
+            "Truths": summary_stats,
+            "Consensus": _consensus_summary_stats(
+                [precision_vcfs[x] for x in names], summary_stats
+            ),
+        }
+        summary_stats_json = os.path.join(workdir, "summary_stats.json")
+        with open(summary_stats_json, "w") as f:
+            json.dump(summary_stats, f, indent=2, sort_keys=True)
+    summary_stats_json = os.path.join(outdir, "summary_stats.json")
+    logging.info(f"Done. Results written to {summary_stats_json}")
+
+
+def _evaluate_filtered_vcfs(
+    eval_dirs,
+    filtered_vcfs,
+    excluded_vcfs,
+    filtered_counts,
+    vcf_ref_fasta,
+    truth_ref_fastas,
+    truth_vcfs,
+    flank_length,
+    debug=False,
+    truth_mask_bed_file=None,
+    ref_mask_bed_file=None,
+    discard_ref_calls=True,
+    max_recall_ref_len=None,
+    resume=False,
+    threads=1,
+    max_flank_length=None,
+    local_probe_mapping=False,
+    probe_hit_cache=None,
+    probe_hit_cache_size=1000000,
+    keep="all",
+    strata_bed_files=None,
+):
+    """Evaluates several filtered VCF files (eg one per sample) that have
+    the same reference. All arguments that are dictionaries are keyed by the
+    same names, one per filtered VCF file, except for strata_bed_files (see
+    evaluate_vcf()). Precision is calculated for all the files together, so
+    that probes that are the same in more than one file are only mapped
+    once. Each file gets a summary_stats.json in eval_dirs[name]. Returns a
+    dictionary of name -> summary stats"""
+    names = list(eval_dirs)
     if truth_mask_bed_file is None:
         truth_mask = None
     else:
-        truth_mask = utils.load_mask_bed_file(truth_mask_bed_file)
+        truth_mask = registry.get_mask(truth_mask_bed_file)
+    if strata_bed_files is None:
+        strata = None
+    else:
+        strata = {
+            name: registry.get_bed_intervals(bed_file)
+            for name, bed_file in strata_bed_files.items()
+        }
 
-    logging.info("Annotating VCF with TP/FP for precision...")
-    probe_mapping.annotate_vcf_with_probe_mapping(
-        filtered_vcf,
+    logging.info("Annotating VCFs with TP/FP for precision...")
+    precision_vcfs = {x: os.path.join(y, "precision.vcf") for x, y in eval_dirs.items()}
+    checkpoint.run_stage(
+        list(precision_vcfs.values()),
+        [vcf_ref_fasta, truth_mask_bed_file]
+        + [filtered_vcfs[x] for x in names]
+        + [truth_ref_fastas[x] for x in names],
+        {
+            "flank_length": flank_length,
+            "max_flank_length": max_flank_length,
+            "use_ref_calls": not discard_ref_calls,
+        },
+        resume,
+        probe_mapping.annotate_vcf_files_with_probe_mapping,
+        [filtered_vcfs[x] for x in names],
         vcf_ref_fasta,
-        truth_ref_fasta,
+        [truth_ref_fastas[x] for x in names],
         flank_length,
-        vcf_for_precision,
-        map_outfile=map_outfile,
-        use_ref_calls=not discard_ref_calls,
+        [precision_vcfs[x] for x in names],
         truth_mask=truth_mask,
+        max_flank_length=max_flank_length,
+        probe_hit_cache=probe_hit_cache,
+        probe_hit_cache_size=probe_hit_cache_size,
+        map_outfiles=(
+            [f"{precision_vcfs[x]}.debug.map" for x in names] if debug else None
+        ),
     )
-    logging.info("Annotatiing VCF with with TP/FP for precision done")
+    logging.info("Annotating VCFs with TP/FP for precision done")
 
-    logging.info("Calculating recall...")
-    recall_dir = os.path.join(outdir, "recall")
-    vcf_for_recall = recall.get_recall(
-        vcf_ref_fasta,
-        filtered_vcf,
-        recall_dir,
-        flank_length,
-        debug=debug,
-        truth_fasta=truth_ref_fasta if truth_vcf is None else None,
-        truth_vcf=truth_vcf,
-        truth_mask=truth_mask,
-        max_ref_len=max_recall_ref_len,
-    )
-    if ref_mask_bed_file is not None:
-        logging.info("Masking recall VCF...")
-        utils.mask_vcf_file(
-            vcf_for_recall, ref_mask_bed_file, f"{vcf_for_recall}.masked.vcf"
+    # The truth VCF only depends on the truth genome, so is made once for
+    # each different truth FASTA file
+    truth_vcf_by_fasta = {}
+    summary_stats = {}
+    for name in names:
+        logging.info(f"Calculating recall for {name}...")
+        truth_fasta = truth_ref_fastas[name]
+        truth_vcf = truth_vcfs.get(name, truth_vcf_by_fasta.get(truth_fasta))
+        recall_dir = os.path.join(eval_dirs[name], "recall")
+        _, recall_stats = recall.get_recall(
+            vcf_ref_fasta,
+            filtered_vcfs[name],
+            recall_dir,
+            flank_length,
+            debug=debug,
+            truth_fasta=truth_fasta if truth_vcf is None else None,
+            truth_vcf=truth_vcf,
+            truth_mask_bed_file=truth_mask_bed_file,
+            max_ref_len=max_recall_ref_len,
+            resume=resume,
+            threads=threads,
+            max_flank_length=max_flank_length,
+            local_probe_mapping=local_probe_mapping,
+            probe_hit_cache=probe_hit_cache,
+            probe_hit_cache_size=probe_hit_cache_size,
+            keep=keep,
+            ref_mask_bed_file=ref_mask_bed_file,
+            strata_bed_files=strata_bed_files,
+        )
+        scratch.remove_intermediate_files(keep, filtered_vcfs[name])
+        if truth_vcf is None:
+            truth_vcf_by_fasta[truth_fasta] = os.path.join(
+                recall_dir, "truth_vcf", "04.truth.vcf"
+            )
+        logging.info(f"Recall calculation for {name} done")
+
+        summary_stats_json = os.path.join(eval_dirs[name], "summary_stats.json")
+        summary_stats[name] = _combine_summary_stats(
+            _precision_stats(precision_vcfs[name], strata=strata),
+            recall_stats,
+            filtered_counts[name],
+            summary_stats_json,
         )
-        vcf_for_recall = f"{vcf_for_recall}.masked.vcf"
-        logging.info("Masking recall VCF done")
-    logging.info("Recall calculation done")
+        logging.info(f"Results for {name} done")
 
-    # Gather stats and make plots
-    logging.info("Gathering stats...")
-    per_record_recall = vcf_stats.per_record_stats_from_vcf_file(vcf_for_recall)
-    recall_stats = vcf_stats.summary_stats_from_per_record_stats(
-        per_record_recall, for_recall=True
+    return summary_stats
+
+
+def _to_vcf_records(records):
+    """Returns a list of new VcfRecords, sorted by CHROM then POS, made from
+    an iterable of VcfRecords (from varifier or cluster_vcf_records), or
+    lines of a VCF file. Header lines are ignored"""
+    vcf_records = []
+    for x in records:
+        if isinstance(x, str):
+            if x.startswith("#"):
+                continue
+            vcf_records.append(vcf_record.VcfRecord(x))
+        else:
+            vcf_records.append(vcf_record.VcfRecord(str(x)))
+    vcf_records.sort(key=lambda x: (x.CHROM, x.POS))
+    return vcf_records
+
+
+def _write_annotated_vcf(vcf_records, outfile):
+    with open(outfile, "w") as f:
+        print(
+            "##fileformat=VCFv4.2",
+            *probe_mapping.annotation_header_lines,
+            sep="\n",
+            file=f,
+        )
+        print(
+            "#CHROM",
+            "POS",
+            "ID",
+            "REF",
+            "ALT",
+            "QUAL",
+            "FILTER",
+            "INFO",
+            "FORMAT",
+            "sample",
+            sep="\t",
+            file=f,
+        )
+        for record in vcf_records:
+            print(record, file=f)
+
+
+def evaluate_vcf_records(
+    vcf_records,
+    vcf_ref_seqs,
+    truth_ref_seqs,
+    flank_length=100,
+    truth_vcf_records=None,
+    truth_mapper=None,
+    ref_mask=None,
+    truth_mask=None,
+    discard_ref_calls=True,
+    filter_pass=None,
+    max_flank_length=None,
+    local_probe_mapping=False,
+    as_dataframes=False,
+    summary_stats_json=None,
+    precision_vcf=None,
+    recall_vcf=None,
+):
+    """In-memory version of evaluate_vcf(), for calling from Python. Does
+    not write any files, unless summary_stats_json, precision_vcf or
+    recall_vcf are given.
+    vcf_records = iterable of VcfRecords (from varifier or
+      cluster_vcf_records) or VCF lines, with one sample. These are not
+      changed: annotated copies are returned.
+    vcf_ref_seqs, truth_ref_seqs = dictionaries of sequence name -> sequence
+      (str or pyfastaq.sequences.Fasta).
+    truth_vcf_records = the truth variants, in the same form as vcf_records
+      (eg the output of make_truth_vcf()). Recall is only calculated if
+      these are given.
+    truth_mapper = mapper to use for truth_ref_seqs, eg made by
+      probe_mapping.get_probe_mapper(). If None, one is made from
+      truth_ref_seqs. Its hit sequence names must be keys of truth_ref_seqs.
+    ref_mask, truth_mask = masks of the two references, in the form made by
+      registry.get_mask().
+    local_probe_mapping = for recall, map truth probes to just the region
+      of the mutated reference where they should be (see
+      recall.mutated_ref_windows()) before the whole mutated reference.
+    Returns a dictionary with keys "Summary_stats" (the same as
+    summary_stats.json made by evaluate_vcf()), "Precision" and "Recall"
+    (per-record stats, as a list of dictionaries or as a pandas DataFrame
+    if as_dataframes is True, or None for Recall if not calculated), and
+    "Precision_records", "Recall_records" (the annotated VcfRecords)"""
+    vcf_records = _to_vcf_records(vcf_records)
+    if ref_mask is not None:
+        vcf_records = [
+            x
+            for x in vcf_records
+            if not utils.ref_is_in_mask(x.CHROM, x.POS, x.REF, ref_mask)
+        ]
+
+    filtered_counts = _new_filter_counts()
+    filtered_records = list(
+        _filter_vcf_records(
+            vcf_records,
+            vcf_ref_seqs,
+            filtered_counts,
+            filter_pass=filter_pass,
+            keep_ref_calls=not discard_ref_calls,
+        )
     )
 
-    per_record_precision = vcf_stats.per_record_stats_from_vcf_file(vcf_for_precision)
-    precision_stats = vcf_stats.summary_stats_from_per_record_stats(
-        per_record_precision
+    if truth_mapper is None:
+        truth_mapper = probe_mapping.LazyMapper(
+            lambda: probe_mapping.get_probe_mapper_for_seqs(truth_ref_seqs)
+        )
+    precision_records = list(
+        probe_mapping.annotate_vcf_records(
+            copy.deepcopy(filtered_records),
+            vcf_ref_seqs,
+            truth_ref_seqs,
+            truth_mapper,
+            flank_length,
+            truth_mask=truth_mask,
+            max_flank_length=max_flank_length,
+        )
     )
+    per_record_precision = vcf_stats.per_record_stats_from_vcf_records(
+        precision_records
+    )
+    summary_stats = {
+        "Precision": vcf_stats.summary_stats_from_per_record_stats(per_record_precision)
+    }
+
+    if truth_vcf_records is None:
+        recall_records = per_record_recall = None
+    else:
+        mutated_seqs = recall.apply_variants_to_seqs(vcf_ref_seqs, filtered_records)
+        recall_records = list(
+            probe_mapping.annotate_vcf_records(
+                _to_vcf_records(truth_vcf_records),
+                vcf_ref_seqs,
+                mutated_seqs,
+                probe_mapping.LazyMapper(
+                    lambda: probe_mapping.get_probe_mapper_for_seqs(mutated_seqs)
+                ),
+                flank_length,
+                max_flank_length=max_flank_length,
+                truth_windows=(
+                    recall.mutated_ref_windows(filtered_records)
+                    if local_probe_mapping
+                    else None
+                ),
+            )
+        )
+        if ref_mask is not None:
+            recall_records = [
+                x
+                for x in recall_records
+                if not utils.ref_is_in_mask(x.CHROM, x.POS, x.REF, ref_mask)
+            ]
+        per_record_recall = vcf_stats.per_record_stats_from_vcf_records(recall_records)
+        summary_stats["Recall"] = vcf_stats.summary_stats_from_per_record_stats(
+            per_record_recall, for_recall=True
+        )
 
-    summary_stats = {"Recall": recall_stats, "Precision": precision_stats}
     _add_overall_precision_and_recall_to_summary_stats(summary_stats)
     summary_stats["Excluded_record_counts"] = filtered_counts
 
-    summary_stats_json = os.path.join(outdir, "summary_stats.json")
-    with open(summary_stats_json, "w") as f:
-        json.dump(summary_stats, f, indent=2, sort_keys=True)
+    if summary_stats_json is not None:
+        with open(summary_stats_json, "w") as f:
+            json.dump(summary_stats, f, indent=2, sort_keys=True)
+    if precision_vcf is not None:
+        _write_annotated_vcf(precision_records, precision_vcf)
+    if recall_vcf is not None and recall_records is not None:
+        _write_annotated_vcf(recall_records, recall_vcf)
+
+    if as_dataframes:
+        import pandas as pd
+
+        per_record_precision = pd.DataFrame(per_record_precision)
+        if per_record_recall is not None:
+            per_record_recall = pd.DataFrame(per_record_recall)
+
+    return {
+        "Summary_stats": summary_stats,
+        "Precision": per_record_precision,
+        "Recall": per_record_recall,
+        "Precision_records": precision_records,
+        "Recall_records": recall_records,
+    }
+
 
+def _split_into_shards(vcf_records, ref_seqs, shards, split_by):
+    """Returns a list of shards, where each shard is a list of regions
+    (contig, start, end) (zero-based, end not included). vcf_records is a
+    list of all the records to evaluate, which are split between the
+    shards so that each shard has a similar number of records. If split_by
+    is "contig", then each contig is in one shard. If split_by is
+    "window", then contigs can be split between shards. Returns fewer than
+    shards shards if there are not enough records (or contigs), and one
+    shard with no regions if there are no records"""
+    positions = {}
+    for record in vcf_records:
+        positions.setdefault(record.CHROM, []).append(record.POS)
+    contigs = [x for x in ref_seqs if x in positions]
+    if len(contigs) == 0:
+        return [[]]
+
+    if split_by == "contig":
+        loads = [(0, i, []) for i in range(min(shards, len(contigs)))]
+        for contig in sorted(contigs, key=lambda x: -len(positions[x])):
+            load, i, regions = heapq.heappop(loads)
+            regions.append((contig, 0, len(ref_seqs[contig])))
+            heapq.heappush(loads, (load + len(positions[contig]), i, regions))
+        order = {x: i for i, x in enumerate(contigs)}
+        return [
+            sorted(x[2], key=lambda region: order[region[0]])
+            for x in sorted(loads, key=operator.itemgetter(1))
+        ]
+
+    assert split_by == "window"
+    # Cut the sorted records into shards of similar size, but records at the
+    # same position must be in the same shard
+    keys = [
+        (i, x) for i, contig in enumerate(contigs) for x in sorted(positions[contig])
+    ]
+    cuts = {
+        bisect.bisect_left(keys, keys[i * len(keys) // shards])
+        for i in range(1, shards)
+    }
+    bounds = [0] + sorted(cuts.difference({0})) + [len(keys)]
+    shard_list = []
+    for first, last in zip(bounds, bounds[1:]):
+        regions = []
+        for i in range(keys[first][0], keys[last - 1][0] + 1):
+            if i == keys[first][0] and first > 0 and keys[first - 1][0] == i:
+                start = keys[first][1]
+            else:
+                start = 0
+            if last < len(keys) and keys[last][0] == i:
+                end = keys[last][1]
+            else:
+                end = len(ref_seqs[contigs[i]])
+            regions.append((contigs[i], start, end))
+        shard_list.append(regions)
+    return shard_list
+
+
+def _shard_finder(shard_list):
+    """Returns a function that takes a VcfRecord and returns the index of
+    the shard in shard_list (as made by _split_into_shards()) that the
+    record belongs to, or None if it is not in any shard"""
+    starts = {}
+    for i, regions in enumerate(shard_list):
+        for contig, start, end in regions:
+            starts.setdefault(contig, []).append((start, end, i))
+    for regions in starts.values():
+        regions.sort()
+
+    def find_shard(record):
+        regions = starts.get(record.CHROM, [])
+        j = bisect.bisect_right(regions, (record.POS, float("inf"))) - 1
+        if j >= 0 and record.POS < regions[j][1]:
+            return regions[j][2]
+        return None
+
+    return find_shard
+
+
+def _records_for_shards(vcf_records, shard_list, flank):
+    """Returns a list of lists of VcfRecords, one per shard. Each shard
+    gets the records that are in its regions, plus any other records that
+    are within flank of them, because they are needed to make the probes"""
+    find_shard = _shard_finder(shard_list)
+    windows = {}
+    for record in vcf_records:
+        i = find_shard(record)
+        if i is None:
+            continue
+        key = (record.CHROM, i)
+        start, end = record.POS - flank, record.ref_end_pos() + flank
+        if key in windows:
+            start = min(start, windows[key][0])
+            end = max(end, windows[key][1])
+        windows[key] = start, end
+
+    windows_by_contig = {}
+    for (contig, i), (start, end) in windows.items():
+        windows_by_contig.setdefault(contig, []).append((start, end, i))
+
+    shard_records = [[] for _ in shard_list]
+    for record in vcf_records:
+        for start, end, i in windows_by_contig.get(record.CHROM, []):
+            if start <= record.POS <= end:
+                shard_records[i].append(record)
+    return shard_records
+
+
+def _write_vcf(header_lines, vcf_records, outfile):
+    with open(outfile, "w") as f:
+        print(*header_lines, sep="\n", file=f)
+        for record in vcf_records:
+            print(record, file=f)
+
+
+def scatter_vcf_eval(
+    vcf_to_eval,
+    vcf_ref_fasta,
+    truth_ref_fasta,
+    flank_length,
+    outdir,
+    shards,
+    split_by="window",
+    truth_vcf=None,
+    debug=False,
+    force=False,
+    ref_mask_bed_file=None,
+    truth_mask_bed_file=None,
+    discard_ref_calls=True,
+    max_recall_ref_len=None,
+    filter_pass=None,
+    threads=1,
+    max_flank_length=None,
+    local_probe_mapping=False,
+    probe_hit_cache=None,
+    probe_hit_cache_size=1000000,
+):
+    """Does the same as evaluate_vcf(), up to the probe mapping. The VCF
+    file is masked and filtered, and the truth VCF is made (if truth_vcf is
+    None). Then the calls and truth variants are split into (up to) shards
+    shards, by contig or by window (see _split_into_shards()). Each shard is
+    written to outdir/shards/<shard number>/, with a manifest.json file
+    that is the input to evaluate_vcf_shard(). The shards can be run in any
+    order on any machine that can see the input files, and the results
+    combined with gather_vcf_eval()"""
+    if force:
+        subprocess.check_output(f"rm -rf {outdir}", shell=True)
+    os.mkdir(outdir)
+    filtered_vcf, excluded_vcf, filtered_counts = _mask_and_filter_vcf(
+        vcf_to_eval,
+        vcf_ref_fasta,
+        outdir,
+        ref_mask_bed_file=ref_mask_bed_file,
+        filter_pass=filter_pass,
+        discard_ref_calls=discard_ref_calls,
+    )
+
+    if truth_vcf is None:
+        # Imported here because making the truth VCF needs dependencies that
+        # are slow to load (and MUMmer), which are not needed otherwise
+        from varifier import truth_variant_finding
+
+        truth_vcf = truth_variant_finding.make_truth_vcf(
+            vcf_ref_fasta,
+            truth_ref_fasta,
+            os.path.join(outdir, "truth_vcf"),
+            flank_length,
+            debug=debug,
+            truth_mask_bed_file=truth_mask_bed_file,
+            max_ref_len=max_recall_ref_len,
+            threads=threads,
+            max_flank_length=max_flank_length,
+            local_probe_mapping=local_probe_mapping,
+            probe_hit_cache=probe_hit_cache,
+            probe_hit_cache_size=probe_hit_cache_size,
+        )
+        truth_vcf = os.path.relpath(truth_vcf, outdir)
+    else:
+        truth_vcf = os.path.abspath(truth_vcf)
+    mutated_ref_fasta = os.path.join(outdir, "ref_with_mutations_added.fa")
+    recall.make_mutated_ref(vcf_ref_fasta, filtered_vcf, mutated_ref_fasta)
+
+    logging.info("Splitting variants into shards...")
+    ref_seqs = registry.get_seqs(vcf_ref_fasta)
+    calls_header, calls = vcf_record.vcf_file_to_list(filtered_vcf)
+    truth_header, truths = vcf_record.vcf_file_to_list(os.path.join(outdir, truth_vcf))
+    shard_list = _split_into_shards(calls + truths, ref_seqs, shards, split_by)
+    flank = max(flank_length, max_flank_length or 0)
+    shard_calls = _records_for_shards(calls, shard_list, flank)
+    shard_truths = _records_for_shards(truths, shard_list, flank)
+    scatter_id = uuid.uuid4().hex
+    shards_dir = os.path.join(outdir, "shards")
+    os.mkdir(shards_dir)
+    for i, regions in enumerate(shard_list):
+        shard_dir = os.path.join(shards_dir, str(i))
+        os.mkdir(shard_dir)
+        _write_vcf(calls_header, shard_calls[i], os.path.join(shard_dir, "calls.vcf"))
+        _write_vcf(truth_header, shard_truths[i], os.path.join(shard_dir, "truth.vcf"))
+        # Files made here are relative to the shard directory, so that the
+        # scatter directory can be moved. Input files are absolute paths
+        manifest = {
+            "scatter_id": scatter_id,
+            "shard": i,
+            "shards": len(shard_list),
+            "regions": regions,
+            "calls_vcf": "calls.vcf",
+            "truth_vcf": "truth.vcf",
+            "filtered_vcf": os.path.join("..", "..", os.path.basename(filtered_vcf)),
+            "vcf_ref_fasta": os.path.abspath(vcf_ref_fasta),
+            "truth_ref_fasta": os.path.abspath(truth_ref_fasta),
+            "mutated_ref_fasta": os.path.join(
+                "..", "..", "ref_with_mutations_added.fa"
+            ),
+            "truth_mask_bed_file": (
+                None
+                if truth_mask_bed_file is None
+                else os.path.abspath(truth_mask_bed_file)
+            ),
+            "flank_length": flank_length,
+            "max_flank_length": max_flank_length,
+            "local_probe_mapping": local_probe_mapping,
+        }
+        with open(os.path.join(shard_dir, "manifest.json"), "w") as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+
+    scatter_info = {
+        "scatter_id": scatter_id,
+        "shards": shard_list,
+        "filtered_vcf": os.path.basename(filtered_vcf),
+        "truth_vcf": truth_vcf,
+        "ref_mask_bed_file": (
+            None if ref_mask_bed_file is None else os.path.abspath(ref_mask_bed_file)
+        ),
+        "filtered_counts": filtered_counts,
+    }
+    with open(os.path.join(outdir, "scatter.json"), "w") as f:
+        json.dump(scatter_info, f, indent=2, sort_keys=True)
+    logging.info(f"Wrote {len(shard_list)} shards to {shards_dir}")
+
+
+def _annotate_shard_records(
+    vcf_in,
+    vcf_ref_fasta,
+    truth_ref_fasta,
+    flank_length,
+    vcf_out,
+    find_shard,
+    truth_mask=None,
+    max_flank_length=None,
+    probe_hit_cache=None,
+    probe_hit_cache_size=1000000,
+    truth_windows=None,
+):
+    """Annotates vcf_in using probe mapping, writing only the records in
+    the shard (ie for which find_shard() does not return None) to vcf_out.
+    truth_windows: see probe_mapping.annotated_vcf_records()"""
+    disk_cache = probe_mapping.open_probe_hit_cache(
+        probe_hit_cache, truth_ref_fasta, probe_hit_cache_size
+    )
+    annotated_records = probe_mapping.annotated_vcf_records(
+        vcf_in,
+        vcf_ref_fasta,
+        truth_ref_fasta,
+        flank_length,
+        truth_mask=truth_mask,
+        max_flank_length=max_flank_length,
+        truth_windows=truth_windows,
+        disk_cache=disk_cache,
+    )
+    header_lines = next(annotated_records)
+    _write_vcf(
+        header_lines,
+        (x for x in annotated_records if find_shard(x) is not None),
+        vcf_out,
+    )
+    if disk_cache is not None:
+        disk_cache.close()
+
+
+def evaluate_vcf_shard(
+    manifest_json,
+    outdir,
+    force=False,
+    probe_hit_cache=None,
+    probe_hit_cache_size=1000000,
+):
+    """Runs the probe mapping for one shard made by scatter_vcf_eval().
+    manifest_json is the shard's manifest.json file. Writes precision.vcf
+    and recall.vcf, plus shard.json (which identifies the shard), in
+    outdir"""
+    with open(manifest_json) as f:
+        manifest = json.load(f)
+    manifest_dir = os.path.dirname(manifest_json)
+    for key in "calls_vcf", "truth_vcf", "filtered_vcf", "mutated_ref_fasta":
+        manifest[key] = os.path.join(manifest_dir, manifest[key])
+    if force:
+        subprocess.check_output(f"rm -rf {outdir}", shell=True)
+    os.mkdir(outdir)
+    find_shard = _shard_finder([manifest["regions"]])
+    if manifest["truth_mask_bed_file"] is None:
+        truth_mask = None
+    else:
+        truth_mask = registry.get_mask(manifest["truth_mask_bed_file"])
+
+    logging.info(f"Annotating shard {manifest['shard']} with TP/FP for precision...")
+    _annotate_shard_records(
+        manifest["calls_vcf"],
+        manifest["vcf_ref_fasta"],
+        manifest["truth_ref_fasta"],
+        manifest["flank_length"],
+        os.path.join(outdir, "precision.vcf"),
+        find_shard,
+        truth_mask=truth_mask,
+        max_flank_length=manifest["max_flank_length"],
+        probe_hit_cache=probe_hit_cache,
+        probe_hit_cache_size=probe_hit_cache_size,
+    )
+    logging.info(f"Annotating shard {manifest['shard']} for recall...")
+    if manifest["local_probe_mapping"]:
+        # The positions in the mutated genome depend on all the calls before
+        # them, not just the calls in this shard
+        truth_windows = recall.mutated_ref_windows(
+            vcf_record.vcf_file_to_list(manifest["filtered_vcf"])[1]
+        )
+    else:
+        truth_windows = None
+    _annotate_shard_records(
+        manifest["truth_vcf"],
+        manifest["vcf_ref_fasta"],
+        manifest["mutated_ref_fasta"],
+        manifest["flank_length"],
+        os.path.join(outdir, "recall.vcf"),
+        find_shard,
+        max_flank_length=manifest["max_flank_length"],
+        # Hits to the mutated genome can never be reused, so they are not put
+        # in the probe hit cache
+        probe_hit_cache=None,
+        truth_windows=truth_windows,
+    )
+    with open(os.path.join(outdir, "shard.json"), "w") as f:
+        json.dump(
+            {"scatter_id": manifest["scatter_id"], "shard": manifest["shard"]},
+            f,
+            indent=2,
+            sort_keys=True,
+        )
+    logging.info(f"Shard {manifest['shard']} done")
+
+
+def _merge_shard_vcfs(vcf_in, find_shard, shard_vcfs, vcf_out):
+    """Writes vcf_out, which has the annotated records from the list of
+    files shard_vcfs, in the same order as the records in vcf_in"""
+    header_lines, records = vcf_record.vcf_file_to_list(vcf_in)
+    shard_records = [iter(vcf_record.vcf_file_to_list(x)[1]) for x in shard_vcfs]
+    with open(vcf_out, "w") as f:
+        print(*vcf_record.vcf_file_to_list(shard_vcfs[0])[0], sep="\n", file=f)
+        for record in records:
+            i = find_shard(record)
+            annotated = next(shard_records[i], None)
+            if annotated is None or (annotated.CHROM, annotated.POS) != (
+                record.CHROM,
+                record.POS,
+            ):
+                raise Exception(
+                    f"Results for shard {i} do not match the scattered variants. Expected this record next: {record}"
+                )
+            print(annotated, file=f)
+    for i, remaining in enumerate(shard_records):
+        if next(remaining, None) is not None:
+            raise Exception(f"Results for shard {i} have unexpected extra records")
+
+
+def gather_vcf_eval(scatter_dir, shard_outdirs, outdir, force=False):
+    """Combines the results of running evaluate_vcf_shard() on each shard
+    made by scatter_vcf_eval() in scatter_dir. shard_outdirs is a list of the
+    output directories of the shards, in any order. Writes the same
+    precision.vcf, recall VCF and summary_stats.json files to outdir as
+    running evaluate_vcf() would"""
+    with open(os.path.join(scatter_dir, "scatter.json")) as f:
+        scatter_info = json.load(f)
+    shard_dirs = {}
+    for shard_outdir in shard_outdirs:
+        with open(os.path.join(shard_outdir, "shard.json")) as f:
+            shard_info = json.load(f)
+        if shard_info["scatter_id"] != scatter_info["scatter_id"]:
+            raise Exception(f"Shard results {shard_outdir} are not from {scatter_dir}")
+        if shard_info["shard"] in shard_dirs:
+            raise Exception(f"Got shard {shard_info['shard']} more than once")
+        shard_dirs[shard_info["shard"]] = shard_outdir
+    missing = set(range(len(scatter_info["shards"]))).difference(shard_dirs)
+    if len(missing) > 0:
+        raise Exception(f"Missing results for shards: {sorted(missing)}")
+    shard_dirs = [shard_dirs[i] for i in range(len(shard_dirs))]
+
+    if force:
+        subprocess.check_output(f"rm -rf {outdir}", shell=True)
+    os.mkdir(outdir)
+    find_shard = _shard_finder(scatter_info["shards"])
+    logging.info("Gathering shard results...")
+    vcf_for_precision = os.path.join(outdir, "precision.vcf")
+    _merge_shard_vcfs(
+        os.path.join(scatter_dir, scatter_info["filtered_vcf"]),
+        find_shard,
+        [os.path.join(x, "precision.vcf") for x in shard_dirs],
+        vcf_for_precision,
+    )
+    recall_dir = os.path.join(outdir, "recall")
+    os.mkdir(recall_dir)
+    vcf_for_recall = os.path.join(recall_dir, "recall.vcf")
+    _merge_shard_vcfs(
+        os.path.join(scatter_dir, scatter_info["truth_vcf"]),
+        find_shard,
+        [os.path.join(x, "recall.vcf") for x in shard_dirs],
+        vcf_for_recall,
+    )
+    if scatter_info["ref_mask_bed_file"] is None:
+        ref_mask = None
+    else:
+        ref_mask = registry.get_mask(scatter_info["ref_mask_bed_file"])
+    header_lines, recall_records = vcf_record.vcf_file_to_list(vcf_for_recall)
+    recall_stats = _summarise(
+        header_lines,
+        recall_records,
+        None,
+        for_recall=True,
+        masked_vcf_out=f"{vcf_for_recall}.masked.vcf",
+        ref_mask=ref_mask,
+    )
+    summary_stats_json = os.path.join(outdir, "summary_stats.json")
+    _combine_summary_stats(
+        _precision_stats(vcf_for_precision),
+        recall_stats,
+        scatter_info["filtered_counts"],
+        summary_stats_json,
+    )
     logging.info(f"Done. Results written to {summary_stats_json}")
@@ -0,0 +1,169 @@
+from cluster_vcf_records import vcf_file_read
+
+
+class VcfRecord:
+    """Single-sample VCF record, for reading and annotating large VCF files.
+    Has the same attributes as cluster_vcf_records.vcf_record.VcfRecord,
+    but only CHROM, POS and REF are parsed up front. ID, ALT, QUAL, FILTER,
+    INFO and FORMAT are parsed the first time they are used. When printed,
+    the original line is kept as it was, with any new FORMAT keys
+    added by set_format_key_value() appended to the end. Apart from FORMAT,
+    the fields are read-only"""
+
+    __slots__ = (
+        "_fields",
+        "CHROM",
+        "POS",
+        "REF",
+        "_alt",
+        "_filter",
+        "_info",
+        "_format",
+        "_new_format",
+        "_format_changed",
+    )
+
+    def __init__(self, line):
+        assert not line.startswith("#")
+        self._fields = line.rstrip().split("\t")
+        try:
+            self.CHROM = self._fields[0]
+            self.POS = int(self._fields[1]) - 1
+            self.REF = self._fields[3]
+            assert len(self._fields) >= 8
+        except:
+            raise Exception("Error reading line of vcf file:" + line)
+
+        if self.POS < 0:
+            raise ValueError(
+                f"POS value {self.POS + 1}, which is less than 1. Cannot continue. Line of VCF file:\n{line}"
+            )
+
+        self._alt = None
+        self._filter = None
+        self._info = None
+        self._format = None
+        self._new_format = {}
+        self._format_changed = False
+
+    @property
+    def ID(self):
+        return self._fields[2]
+
+    @property
+    def ALT(self):
+        if self._alt is None:
+            self._alt = self._fields[4].split(",")
+        return self._alt
+
+    @property
+    def QUAL(self):
+        try:
+            return float(self._fields[5])
+        except ValueError:
+            return None
+
+    @property
+    def FILTER(self):
+        if self._filter is None:
+            f = self._fields[6]
+            self._filter = set() if f == "." else set(f.split(";"))
+        return self._filter
+
+    @property
+    def INFO(self):
+        if self._info is None:
+            self._info = {}
+            if self._fields[7] != ".":
+                for field in self._fields[7].split(";"):
+                    key, eq, value = field.partition("=")
+                    self._info[key] = value if eq else None
+        return self._info
+
+    def _original_format_keys(self):
+        return self._fields[8].split(":") if len(self._fields) == 10 else []
+
+    @property
+    def FORMAT(self):
+        if self._format is None:
+            if len(self._fields) == 10:
+                self._format = dict(
+                    zip(self._fields[8].split(":"), self._fields[9].split(":"))
+                )
+            else:
+                self._format = {}
+            self._format.update(self._new_format)
+        return self._format
+
+    @FORMAT.setter
+    def FORMAT(self, value):
+        self._format = dict(value)
+        self._new_format = {}
+        self._format_changed = True
+
+    def set_format_key_value(self, key, value):
+        """Add a new key/value pair to the FORMAT and sample columns. If key
+        already exists, then updates the value to the new given value"""
+        if key not in self._new_format and key in self._original_format_keys():
+            self._format_changed = True
+        else:
+            self._new_format[key] = value
+        self.FORMAT[key] = value
+
+    def ref_end_pos(self):
+        """Returns (zero-based) ref coord of the end of the variant"""
+        return self.POS + len(self.REF) - 1
+
+    def __eq__(self, other):
+        return type(other) is type(self) and all(
+            getattr(self, x) == getattr(other, x)
+            for x in ["CHROM", "POS", "ID", "REF", "ALT", "QUAL", "FILTER"]
+            + ["INFO", "FORMAT"]
+        )
+
+    def __repr__(self):
+        if self._format_changed or (
+            len(self._fields) == 10
+            and self._fields[8].count(":") != self._fields[9].count(":")
+        ):
+            # Can't just append to the existing columns, so remake them
+            keys = list(self.FORMAT)
+            return "\t".join(
+                self._fields[:8]
+                + [":".join(keys), ":".join(self.FORMAT[x] for x in keys)]
+            )
+        elif len(self._new_format) == 0:
+            return "\t".join(self._fields)
+
+        keys = ":".join(self._new_format)
+        values = ":".join(self._new_format.values())
+        if len(self._fields) == 10:
+            return "\t".join(
+                self._fields[:8]
+                + [f"{self._fields[8]}:{keys}", f"{self._fields[9]}:{values}"]
+            )
+        else:
+            return "\t".join(self._fields[:8] + [keys, values])
+
+
+def vcf_file_records(filename):
+    """Generator that yields each VcfRecord in a VCF file"""
+    with vcf_file_read.open_vcf_file_for_reading(filename) as f:
+        for line in f:
+            if not line.startswith("#"):
+                yield VcfRecord(line)
+
+
+def vcf_file_to_list(filename):
+    """Returns tuple (header lines, list of VcfRecords) from a VCF file.
+    Same as cluster_vcf_records.vcf_file_read.vcf_file_to_list, but makes
+    varifier VcfRecords"""
+    header_lines = []
+    records = []
+    with vcf_file_read.open_vcf_file_for_reading(filename) as f:
+        for line in f:
+            if line.startswith("#"):
+                header_lines.append(line.rstrip())
+            else:
+                records.append(VcfRecord(line))
+    return header_lines, records
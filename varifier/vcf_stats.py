@@ -1,7 +1,7 @@
 import copy
 from operator import itemgetter
 
-from cluster_vcf_records import vcf_file_read
+from varifier import vcf_record
 
 
 def _frs_from_vcf_record(record, cov_key="COV"):
@@ -36,6 +36,12 @@ def per_record_stats_from_vcf_file(infile):
     """Gathers stats for each record in a VCF file.
     Returns a list of dictionaries of stats. One dict per VCF line.
     List is sorted by ref seq name (CHROM), then position (POS)"""
+    return per_record_stats_from_vcf_records(vcf_record.vcf_file_records(infile))
+
+
+def per_record_stats_from_vcf_records(vcf_records):
+    """Same as per_record_stats_from_vcf_file(), but gathers stats from
+    an iterable of VcfRecords instead of a file"""
     stats = []
     wanted_keys = [
         "DP",
@@ -66,7 +72,6 @@ def per_record_stats_from_vcf_file(infile):
         "VFR_ALLELE_LEN": int,
         "VFR_ALLELE_MATCH_COUNT": int,
     }
-    header_lines, vcf_records = vcf_file_read.vcf_file_to_list(infile)
     for record in vcf_records:
         record_stats = {x: record.FORMAT.get(x, "NA") for x in wanted_keys}
         record_stats["FRS"] = _frs_from_vcf_record(record)